@@ -9,11 +9,13 @@ from .view_graph import view_graph
 from .results_graph import results_graph
 from .augment_view_graph import elsewhere_bundles, augment
 from .sankey_view import sankey_view
+from .optimise_ordering import optimise_ordering
 from .hierarchy import Hierarchy
 from .graph_to_sankey import graph_to_sankey
 from .save_sankey import save_sankey_data, serialise_data
 
 __all__ = ['Dataset', 'Partition', 'Group', 'SankeyDefinition', 'ProcessGroup',
            'Waypoint', 'Bundle', 'Elsewhere', 'view_graph', 'results_graph',
-           'elsewhere_bundles', 'augment', 'sankey_view', 'Hierarchy',
-           'graph_to_sankey', 'save_sankey_data', 'serialise_data']
+           'elsewhere_bundles', 'augment', 'sankey_view', 'optimise_ordering',
+           'Hierarchy', 'graph_to_sankey', 'save_sankey_data',
+           'serialise_data']
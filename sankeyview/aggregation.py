@@ -0,0 +1,169 @@
+"""Vectorised aggregation of flow measures, for ``agg_measures``.
+
+Each aggregation function is a reducer, called once with the values of a
+measure for all the flows, sorted so that the flows of each group (results
+graph edge) are contiguous, and the offsets of the groups: the flows of
+group ``i`` are ``values[offsets[i]:offsets[i + 1]]``. It returns an array
+with the aggregate of each group. Reducers can ask for other columns, which
+are passed after the offsets, sorted in the same way.
+
+``agg_measures`` maps each measure to the name of a registered function, or
+to a tuple ``(name, column, ...)`` overriding the columns it is given.
+Functions which are not registered are applied by pandas, a group at a time.
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Stands for the main measure in the columns of a reducer
+MEASURE = '<measure>'
+
+# Registered reducers: name -> (reducer, default columns)
+_AGGREGATORS = {}
+
+
+def register_aggregator(name, reducer, columns=()):
+    """Register `reducer` as the aggregation function `name`.
+
+    `reducer(values, offsets, *extra)` is given the values of the flows,
+    sorted by group, the offsets of the groups, and the values of `columns`
+    (by default; ``MEASURE`` stands for the main measure) sorted likewise.
+    """
+    _AGGREGATORS[name] = (reducer, tuple(columns))
+
+
+def _present(values):
+    return ~pd.isnull(values)
+
+
+def _segment_sum(values, offsets):
+    """Sum of each segment of `values`."""
+    if values.ndim == 1 and values.dtype.kind == 'f':
+        # Add in order, as pandas does, rather than pairwise
+        segment = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+        return np.bincount(segment, values, minlength=len(offsets) - 1)
+    return np.add.reduceat(values, offsets[:-1], axis=0)
+
+
+def _sum(values, offsets):
+    return _segment_sum(np.where(_present(values), values, 0), offsets)
+
+
+def _count(values, offsets):
+    return _segment_sum(_present(values).astype(int), offsets)
+
+
+def _mean(values, offsets):
+    # Groups with no values are NaN, without a warning
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return _sum(values, offsets) / _count(values, offsets)
+
+
+def _weighted_mean(values, offsets, weights):
+    present = _present(values) & _present(weights)
+    weights = np.where(present, weights, 0)
+    values = np.where(present, values, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (_segment_sum(values * weights, offsets) /
+                _segment_sum(weights, offsets))
+
+
+def _by_order(values, offsets, order_by, last):
+    """Value of the first (or `last`) flow of each group, ordered by
+    `order_by`."""
+    group = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    rank = pd.factorize(np.asarray(order_by), sort=True)[0]
+    order = np.lexsort((rank, group))
+    return values[order[offsets[1:] - 1 if last else offsets[:-1]]]
+
+
+register_aggregator('sum', _sum)
+register_aggregator('count', _count)
+register_aggregator('mean', _mean)
+register_aggregator(
+    'min', lambda values, offsets: np.fmin.reduceat(values, offsets[:-1],
+                                                    axis=0))
+register_aggregator(
+    'max', lambda values, offsets: np.fmax.reduceat(values, offsets[:-1],
+                                                    axis=0))
+register_aggregator('weighted_mean', _weighted_mean, [MEASURE])
+register_aggregator(
+    'first', lambda values, offsets, time: _by_order(values, offsets, time,
+                                                     last=False), ['time'])
+register_aggregator(
+    'last', lambda values, offsets, time: _by_order(values, offsets, time,
+                                                    last=True), ['time'])
+
+
+def _spec(func):
+    """Reducer and columns of aggregation function `func` (a value of
+    agg_measures), or None if it is not a registered function."""
+    if isinstance(func, tuple):
+        name, columns = func[0], func[1:]
+        if name not in _AGGREGATORS:
+            raise ValueError('Unknown aggregation function {!r}'.format(name))
+        return _AGGREGATORS[name][0], columns
+    if isinstance(func, str) and func in _AGGREGATORS:
+        return _AGGREGATORS[func]
+    return None
+
+
+def all_measures(measure, agg_measures):
+    """`agg_measures`, with the main `measure` summed."""
+    agg_all_measures = dict(agg_measures or {})
+    agg_all_measures[measure] = 'sum'
+    return agg_all_measures
+
+
+def aggregation_columns(measure, agg_measures, samples=None):
+    """Names of the flow columns needed to aggregate `measure` and
+    `agg_measures` (except for the ensembles in `samples`)."""
+    columns = OrderedDict()
+    for column, func in sorted(all_measures(measure, agg_measures).items()):
+        if column not in (samples or {}):
+            columns[column] = True
+        spec = _spec(func)
+        for name in spec[1] if spec else ():
+            columns[measure if name == MEASURE else name] = True
+    return list(columns)
+
+
+def aggregate(grouped, flows, measure, agg_measures=None, samples=None):
+    """Aggregate `measure` (summed) and `agg_measures` of `flows` by the
+    groups of `grouped` (a groupby of `flows`).
+
+    Measures in `samples` are ensembles (see ``Dataset.samples``), whose rows
+    of samples are found from the index of `flows`. The registered
+    functions are evaluated together, after sorting the flows by group
+    once. Returns a dict of arrays, in the order of the groups.
+    """
+    agg_all_measures = all_measures(measure, agg_measures)
+    samples = samples or {}
+    group = grouped.ngroup().values
+    order = np.argsort(group, kind='mergesort')
+    offsets = np.searchsorted(group[order], np.arange(grouped.ngroups + 1))
+
+    def sorted_values(column):
+        if column in samples:
+            return samples[column][flows.index.values[order]]
+        if column not in flows:
+            raise ValueError('Cannot aggregate without column "{}"'
+                             .format(column))
+        return np.asarray(flows[column].values)[order]
+
+    results = {}
+    for column, func in agg_all_measures.items():
+        spec = _spec(func)
+        if spec is None:
+            if column in samples:
+                raise ValueError('Cannot aggregate samples of "{}" using {!r}'
+                                 .format(column, func))
+            results[column] = grouped[column].agg(func).values
+            continue
+        reducer, columns = spec
+        extra = [sorted_values(measure if name == MEASURE else name)
+                 for name in columns]
+        results[column] = reducer(sorted_values(column), offsets, *extra)
+    return results
@@ -1,7 +1,7 @@
 import networkx as nx
 
 from .sankey_definition import ProcessGroup, Waypoint, Bundle, Elsewhere
-from .ordering import new_node_indices, Ordering
+from .ordering import new_node_indices, OrderingBuilder
 
 
 def elsewhere_bundles(sankey_definition):
@@ -71,8 +71,9 @@ def augment(G, new_waypoints, new_bundles):
 
     # copy G and order
     G = G.copy()
+    ordering = OrderingBuilder(G.ordering)
 
-    R = len(G.ordering.layers)
+    R = len(ordering.layers)
     # XXX sorting makes order deterministic, which can affect final placement
     # of waypoints
     for k, bundle in sorted(new_bundles.items(), reverse=True):
@@ -81,46 +82,47 @@ def augment(G, new_waypoints, new_bundles):
 
         if bundle.to_elsewhere:
             u = G.node[bundle.source]['node']
-            r, _, _ = G.ordering.indices(bundle.source)
+            r, _, _ = ordering.indices(bundle.source)
             d_rank = +1 if u.direction == 'R' else -1
             G.add_node(w, node=new_waypoints[w])
 
-            r, G.ordering = check_order_edges(G.ordering, r, d_rank)
+            r = check_order_edges(ordering, r, d_rank)
 
-            this_rank = G.ordering.layers[r + d_rank]
-            prev_rank = G.ordering.layers[r]
+            this_rank = ordering.layers[r + d_rank]
+            prev_rank = ordering.layers[r]
             G.add_edge(bundle.source, w, bundles=[k])
             i, j = new_node_indices(G, this_rank, prev_rank, w, side='below')
 
-            G.ordering = G.ordering.insert(r + d_rank, i, j, w)
+            ordering.insert(r + d_rank, i, j, w)
 
         elif bundle.from_elsewhere:
             u = G.node[bundle.target]['node']
-            r, _, _ = G.ordering.indices(bundle.target)
+            r, _, _ = ordering.indices(bundle.target)
             d_rank = +1 if u.direction == 'R' else -1
             G.add_node(w, node=new_waypoints[w])
 
-            r, G.ordering = check_order_edges(G.ordering, r, -d_rank)
+            r = check_order_edges(ordering, r, -d_rank)
 
-            this_rank = G.ordering.layers[r - d_rank]
-            prev_rank = G.ordering.layers[r]
+            this_rank = ordering.layers[r - d_rank]
+            prev_rank = ordering.layers[r]
             G.add_edge(w, bundle.target, bundles=[k])
             i, j = new_node_indices(G, this_rank, prev_rank, w, side='below')
 
-            G.ordering = G.ordering.insert(r - d_rank, i, j, w)
+            ordering.insert(r - d_rank, i, j, w)
 
         else:
             assert False, "Should not call augment() with non-elsewhere bundle"
 
+    G.ordering = ordering.freeze()
     return G
 
 
 def check_order_edges(ordering, r, dr):
-    layers = ordering.layers
-    nb = len(layers[0]) if layers else 1
-    if r + dr >= len(layers):
-        layers = layers + tuple(() for i in range(nb))
+    """Add an empty layer to `ordering` (an :class:`OrderingBuilder`) if
+    layer `r + dr` is past either end. Returns the new index of layer `r`."""
+    if r + dr >= len(ordering.layers):
+        ordering.insert_layer(len(ordering.layers))
     elif r + dr < 0:
-        layers = tuple(() for i in range(nb)) + layers
+        ordering.insert_layer(0)
         r += 1
-    return r, Ordering(layers)
+    return r
@@ -0,0 +1,261 @@
+"""Pre-aggregated cubes of flow measures."""
+
+import itertools
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .aggregation import all_measures
+from .dataset import Dataset, KEY_COLUMNS, _compact_codes
+from .results_graph import _PARTIAL_AGGREGATES, _partial_column
+
+CUBE_FORMAT = 'sankeyview-cube'
+
+# Partial aggregates stored for each measure, and how they are combined when
+# rolling up to a coarser level
+_CUBE_PARTIALS = [('sum', 'sum'), ('count', 'sum'), ('min', 'min'),
+                  ('max', 'max')]
+
+# How partial aggregates are combined with those of appended rows
+_COMBINE = {'sum': np.add, 'min': np.fmin, 'max': np.fmax}
+
+# Key columns which can be rolled up to one of their dimension attributes
+_ROLLUP_KEYS = ('material', 'time')
+
+
+class Cube:
+    """Measures of a dataset aggregated by key, with optional rollups.
+
+    Each level of the cube is a :class:`Dataset` with one row for each
+    distinct combination of its keys. The finest level is keyed by source,
+    target, material and time; coarser levels replace material and/or time
+    by one of their dimension attributes (such as ``time.year``). Each
+    numeric measure ``m`` is stored as the partial aggregates ``m:sum``,
+    ``m:count``, ``m:min`` and ``m:max``.
+    """
+
+    def __init__(self, levels, measures, rollups=()):
+        # List of (rolled-up attribute columns, Dataset), finest first
+        self.levels = levels
+        self.measures = measures
+        self.rollups = tuple(rollups)
+
+        # Index of the rows of each level by their key codes, built when the
+        # cube is first updated
+        self._rows = {}
+
+    @classmethod
+    def build(cls, dataset, rollups=()):
+        """Aggregate the numeric measures of `dataset`.
+
+        `rollups` lists attribute columns of material or time (such as
+        ``"time.year"``) to add coarser levels for: one level for every
+        combination of rolling up (or not) each key.
+        """
+        measures = [name for name, values in dataset._columns.items()
+                    if name not in dataset._dictionaries and
+                    values.dtype.kind in 'biuf']
+        finest = _aggregate_rows(dataset, measures, slice(None))
+        return cls._from_finest(dataset, finest, measures, rollups)
+
+    def update(self, dataset, rows):
+        """Update the cube after `rows` were appended to `dataset` (see
+        :meth:`Dataset.append`), and return it.
+
+        The partial aggregates of the new rows are merged into the rows of
+        each level with the same keys, and rows are added to the levels for
+        new keys, so that the cost depends on the number of new rows.
+        """
+        rows = slice(rows.start, rows.stop)
+        for i, (_, level) in enumerate(self.levels):
+            self._update_level(i, level, dataset, rows)
+        return self
+
+    def _update_level(self, i, level, dataset, rows):
+        keys = [name for name in level._columns if name in level._dictionaries]
+
+        # Codes of the new rows' keys in the level's dictionaries, with new
+        # codes after the end for values not seen before
+        columns = OrderedDict()
+        labels = {}
+        for name in keys:
+            dictionary = level._dictionaries[name]
+            values = np.asarray(dataset._encoded(name, rows).decode())
+            codes = dictionary.get_indexer(values)
+            unseen = (codes < 0) & pd.notnull(values)
+            extra_codes, extra = pd.factorize(values[unseen])
+            codes[unseen] = len(dictionary) + extra_codes
+            columns[name] = codes
+            labels[name] = np.concatenate([np.asarray(dictionary, dtype=object),
+                                           np.asarray(extra, dtype=object),
+                                           [np.nan]])
+        columns.update((name, dataset._columns[name][rows])
+                       for name in self.measures)
+        delta = _aggregate(columns, keys, _partials(self.measures))
+
+        existing, added = self._row_index(i, level, keys)
+        found = existing.get_indexer(
+            pd.MultiIndex.from_arrays([delta[name] for name in keys]))
+        for j in np.flatnonzero(found < 0):
+            found[j] = added.get(tuple(int(delta[name][j]) for name in keys),
+                                 -1)
+
+        # Merge into the rows with the same keys
+        matched = found >= 0
+        if matched.any():
+            for name in self.measures:
+                for func, combine in _CUBE_PARTIALS:
+                    column = _partial_column(name, func)
+                    values = delta[column][matched]
+                    current = level._columns[column]
+                    dtype = np.result_type(current, values)
+                    if dtype != current.dtype or not current.flags.writeable:
+                        current = level._columns[column] = \
+                            current.astype(dtype)
+                    current[found[matched]] = _COMBINE[combine](
+                        current[found[matched]], values)
+            level._mapped = level._shared = None
+
+        # Add rows for new keys
+        new = ~matched
+        if new.any():
+            frame = pd.DataFrame(OrderedDict(
+                [(name, labels[name][delta[name][new]]) for name in keys] +
+                [(name, values[new]) for name, values in delta.items()
+                 if name not in keys]))
+            start = level._num_rows
+            level.append(frame)
+            codes = zip(*[level._columns[name][start:].tolist()
+                          for name in keys])
+            added.update(zip(codes, range(start, level._num_rows)))
+
+    def _row_index(self, i, level, keys):
+        # The rows when first updated are indexed by pandas, and those added
+        # since then in a dict
+        if i not in self._rows:
+            existing = pd.MultiIndex.from_arrays(
+                [level._columns[name] for name in keys])
+            self._rows[i] = (existing, {})
+        return self._rows[i]
+
+    @classmethod
+    def _from_finest(cls, dataset, finest, measures, rollups):
+        choices = OrderedDict((key, [None]) for key in _ROLLUP_KEYS)
+        for name in rollups:
+            split = dataset._split_column(name)
+            if split is None or split[0] not in choices:
+                raise ValueError('Cannot roll up to "{}": not an attribute of '
+                                 'material or time'.format(name))
+            choices[split[0]].append(split)
+
+        keys = [key for key in KEY_COLUMNS if key in finest]
+        levels = []
+        for splits in itertools.product(*choices.values()):
+            splits = [split for split in splits if split is not None]
+            level_keys = list(keys)
+            columns = OrderedDict(finest)
+            dictionaries = {key: dataset._dictionaries[key] for key in keys}
+            dims = {'material': dataset._dim_material,
+                    'time': dataset._dim_time}
+            for key, attribute in splits:
+                name = '{}.{}'.format(key, attribute)
+                values = dataset._dimension(key)[attribute].values
+                codes, dictionary = pd.factorize(values)
+                columns[name] = np.append(codes, -1)[columns.pop(key)]
+                dictionaries[name] = pd.Index(dictionary)
+                del dictionaries[key]
+                level_keys[level_keys.index(key)] = name
+                dims[key] = None
+            if splits:
+                columns = _aggregate(columns, level_keys, _combined(measures))
+            for name, dictionary in dictionaries.items():
+                columns[name] = _compact_codes(columns[name], len(dictionary))
+            level = Dataset._from_columns(columns, dictionaries,
+                                          dataset._dim_process,
+                                          dims['material'], dims['time'])
+            rolled = tuple('{}.{}'.format(*split) for split in splits)
+            levels.append((rolled, level))
+        return cls(levels, measures, rollups)
+
+    def level_for(self, sankey_definition, measure='value',
+                  agg_measures=None):
+        """The coarsest level which can answer `sankey_definition`, or None
+        if no level has the columns and measures it needs."""
+        if not isinstance(measure, str):
+            return None
+        for column, func in all_measures(measure, agg_measures).items():
+            if column not in self.measures or func not in _PARTIAL_AGGREGATES:
+                return None
+
+        needed = sankey_definition.referenced_columns()
+        usable = [level for _, level in self.levels
+                  if all(level._has_column(name) for name in needed)]
+        if not usable:
+            return None
+        return min(usable, key=lambda level: level._num_rows)
+
+    def save(self, dirname):
+        """Save the cube levels (with :meth:`Dataset.save_columnar`)."""
+        os.makedirs(dirname, exist_ok=True)
+        levels = []
+        for i, (rolled, level) in enumerate(self.levels):
+            entry = {'dirname': 'level{}'.format(i), 'rollups': list(rolled)}
+            level.save_columnar(os.path.join(dirname, entry['dirname']))
+            levels.append(entry)
+        meta = {
+            'format': CUBE_FORMAT,
+            'version': 1,
+            'measures': self.measures,
+            'rollups': list(self.rollups),
+            'levels': levels,
+        }
+        with open(os.path.join(dirname, 'cube.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, dirname, mmap=False):
+        """Load a cube saved by :meth:`save`."""
+        with open(os.path.join(dirname, 'cube.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != CUBE_FORMAT:
+            raise ValueError('{} is not a saved cube'.format(dirname))
+        levels = [(tuple(entry['rollups']),
+                   Dataset.from_columnar(
+                       os.path.join(dirname, entry['dirname']), mmap=mmap))
+                  for entry in meta['levels']]
+        return cls(levels, meta['measures'], meta['rollups'])
+
+
+def _aggregate_rows(dataset, measures, rows):
+    """Partial aggregates of `measures` in `rows` of `dataset`, by key."""
+    keys = [key for key in KEY_COLUMNS if key in dataset._columns]
+    columns = OrderedDict((key, dataset._codes(key)[rows]) for key in keys)
+    columns.update((name, dataset._columns[name][rows]) for name in measures)
+    return _aggregate(columns, keys, _partials(measures))
+
+
+def _partials(measures):
+    """Aggregates giving the partial aggregates of `measures`."""
+    return [(name, func, _partial_column(name, func))
+            for name in measures for func, _ in _CUBE_PARTIALS]
+
+
+def _combined(measures):
+    """Aggregates combining the partial aggregates of `measures`."""
+    return [(_partial_column(name, func), combine, _partial_column(name, func))
+            for name in measures for func, combine in _CUBE_PARTIALS]
+
+
+def _aggregate(columns, keys, aggregates):
+    """Group the arrays `columns` by `keys`, aggregating them as given by
+    (column, function, result column) in `aggregates`."""
+    grouped = pd.DataFrame(columns).groupby(keys)
+    index = grouped.size().index
+    result = OrderedDict((key, index.get_level_values(i).values)
+                         for i, key in enumerate(keys))
+    for column, func, name in aggregates:
+        result[name] = grouped[column].agg(func).values
+    return result
@@ -1,43 +1,37 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 import networkx as nx
 
 from .partition import Partition
+from .selection import compile_selection, Encoded, Summary
+from .utils import pairwise
 
 
-def leaves_below(tree, node):
-    return set(sum(([vv for vv in v if tree.out_degree(vv) == 0]
-                    for k, v in nx.dfs_successors(tree, node).items()), []))
+KEY_COLUMNS = ('source', 'target', 'material', 'time')
 
+COLUMNAR_FORMAT = 'sankeyview-columnar'
 
-class Resolver:
-    def __init__(self, df, column):
-        self.df = df
-        self.column = column
 
-    def __iter__(self):
-        # XXX hack to avoid __getitem__ being called with integer indices, but
-        # to have non-zero len.
-        return iter(['keys'])
+def leaves_below(tree, node):
+    return set(sum(([vv for vv in v if tree.out_degree(vv) == 0]
+                    for k, v in nx.dfs_successors(tree, node).items()), []))
 
-    def __getitem__(self, k):
-        if not self.column:
-            col = k
-        elif k == 'id':
-            col = self.column
-        else:
-            col = '{}.{}'.format(self.column, k)
-        return self.df[col]
 
+def eval_selection(df, column, sel, cache=None):
+    """Evaluate selection `sel` against table `df`.
 
-def eval_selection(df, column, sel):
+    Lists of ids are matched against `column`; strings are compiled to a
+    :class:`~sankeyview.selection.Selection`, which is stored in `cache` (if
+    given) for reuse.
+    """
     if isinstance(sel, (list, tuple)):
         return df[column].isin(sel)
     elif isinstance(sel, str):
-        resolver = Resolver(df, column)
-        return df.eval(sel,
-                       local_dict={},
-                       global_dict={},
-                       resolvers=(resolver, ))
+        return compile_selection(sel, column, cache)(df)
     else:
         raise TypeError('Unknown selection type: %s' % type(sel))
 
@@ -47,7 +41,8 @@ class Dataset:
                  flows,
                  dim_process=None,
                  dim_material=None,
-                 dim_time=None):
+                 dim_time=None,
+                 samples=None):
 
         if dim_process is not None and not dim_process.index.is_unique:
             raise ValueError('dim_process index not unique')
@@ -59,60 +54,490 @@ class Dataset:
         # Fixed bug: make sure flows index is unique
         flows = flows.reset_index(drop=True)
 
-        self._flows = flows
+        # Dictionary-encode the key columns. Source and target share a
+        # dictionary of processes, so their codes can be compared directly.
+        # Selections are evaluated over the dictionaries and looked up by
+        # code; the values themselves are only needed for the final output.
+        processes = _dictionary([flows['source'], flows['target']],
+                                dim_process)
+        dictionaries = {'source': processes, 'target': processes}
+        dims = {'material': dim_material, 'time': dim_time}
+        for column, dim in dims.items():
+            if column in flows:
+                dictionaries[column] = _dictionary([flows[column]], dim)
+
+        columns = OrderedDict()
+        for name in flows.columns:
+            if name in dictionaries:
+                dictionary = dictionaries[name]
+                columns[name] = _compact_codes(
+                    dictionary.get_indexer(flows[name]), len(dictionary))
+            else:
+                columns[name] = flows[name].values
+
+        self._setup(columns, dictionaries, dim_process, dim_material,
+                    dim_time)
+        for name, values in (samples or {}).items():
+            self._set_samples(name, values)
+
+    def _setup(self, columns, dictionaries, dim_process, dim_material,
+               dim_time):
+        # The flows are stored as a dict of equal-length arrays, which may be
+        # memory-mapped. Columns in `dictionaries` (including all the key
+        # columns) hold dictionary codes, with -1 for missing values; source
+        # and target share a dictionary.
+        self._columns = columns
+        self._dictionaries = dictionaries
+        self._processes = dictionaries['source']
+        self._num_rows = len(columns['source'])
         self._dim_process = dim_process
         self._dim_material = dim_material
         self._dim_time = dim_time
 
-        self._table = flows
-        if dim_process is not None:
-            self._table = self._table \
-                              .join(dim_process.add_prefix('source.'), on='source') \
-                              .join(dim_process.add_prefix('target.'), on='target')
-        if dim_material is not None:
-            self._table = self._table \
-                              .join(dim_material.add_prefix('material.'), on='material')
-        if dim_time is not None:
-            self._table = self._table \
-                              .join(dim_time.add_prefix('time.'), on='time')
+        # Set if the columns are mapped from files saved by save_columnar,
+        # or are in shared memory (see sankeyview.parallel.SharedDataset)
+        self._mapped = None
+        self._shared = None
+
+        # Pre-aggregated measures, used by sankey_view when possible
+        self.cube = None
+
+        # Ensemble measures: a 2-D array for each, with a row of samples for
+        # each flow
+        self.samples = OrderedDict()
+
+        # Incremented by each call to append. Arrays which grow as flows are
+        # appended are kept in buffers with spare capacity.
+        self.version = 0
+        self._buffers = {}
+
+        # Compiled selections, keyed by (selection, column)
+        self._selections = {}
+
+        # Process selections are evaluated once over the processes, and then
+        # looked up by code.
+        self._memberships = {}
+        self._process_pairs = None
+
+        # Dimension tables are not joined to the flows up front. Their
+        # attributes are aligned with the dictionaries when first needed, and
+        # only gathered into flow-level columns when they are referenced.
+        self._attributes = {}
+        self._gathered = {}
+
+    def _set_samples(self, name, values):
+        values = np.asarray(values)
+        if values.ndim != 2 or len(values) != self._num_rows:
+            raise ValueError('Samples of "{}" must be a 2-D array with a row '
+                             'for each flow'.format(name))
+        if name in self._columns:
+            raise ValueError('Samples of "{}" clash with a flow column'
+                             .format(name))
+        self.samples[name] = values
+
+    @classmethod
+    def _from_columns(cls, columns, dictionaries, dim_process=None,
+                      dim_material=None, dim_time=None):
+        """Dataset from already-encoded `columns` (see `_setup`)."""
+        dataset = cls.__new__(cls)
+        dataset._setup(columns, dictionaries, dim_process, dim_material,
+                       dim_time)
+        return dataset
+
+    def _rows(self, start, stop):
+        """Dataset of the flows from `start` to `stop`, sharing the
+        dictionaries and the caches over them."""
+        columns = OrderedDict((name, values[start:stop])
+                              for name, values in self._columns.items())
+        dataset = Dataset._from_columns(columns, self._dictionaries,
+                                        self._dim_process, self._dim_material,
+                                        self._dim_time)
+        dataset._selections = self._selections
+        dataset._memberships = self._memberships
+        dataset._attributes = self._attributes
+        dataset._gathered = {name: values[start:stop]
+                             for name, values in self._gathered.items()}
+        return dataset
+
+    def __reduce_ex__(self, protocol):
+        if self._mapped is not None:
+            # Map the same files again, rather than copying the data
+            return (_map_columnar, self._mapped)
+        if self._shared is not None:
+            from .parallel import _attach_shared
+            return (_attach_shared, self._shared)
+        return super().__reduce_ex__(protocol)
+
+    @property
+    def _flows(self):
+        """The flows as a DataFrame, with encoded columns as categoricals.
+
+        This is built on demand; prefer `_take` with the rows needed.
+        """
+        return self._take(slice(None), [])
+
+    @property
+    def _table(self):
+        """The flows joined with all the dimension tables.
+
+        This is built on demand; prefer `_take` with the columns needed.
+        """
+        return self._take(slice(None))
+
+    def _codes(self, column):
+        """Dictionary codes of key `column`, with -1 for missing values."""
+        return self._columns[column]
+
+    def _dimension(self, column):
+        """Attributes of the values of key `column`, aligned with its
+        dictionary, or None if there is no dimension table."""
+        try:
+            return self._attributes[column]
+        except KeyError:
+            pass
+        dim = {
+            'source': self._dim_process,
+            'target': self._dim_process,
+            'material': self._dim_material,
+            'time': self._dim_time,
+        }.get(column)
+        if dim is None or column not in self._columns:
+            attributes = None
+        elif column == 'target':
+            attributes = self._dimension('source')
+        else:
+            attributes = dim.reindex(self._dictionaries[column])
+        self._attributes[column] = attributes
+        return attributes
+
+    def _split_column(self, name):
+        """Split a dimension attribute column name such as "source.function"
+        into the key column and attribute; None if it is not one."""
+        key, _, attribute = name.partition('.')
+        attributes = self._dimension(key) if attribute else None
+        if attributes is not None and attribute in attributes:
+            return key, attribute
+        return None
+
+    def dimension_columns(self):
+        """Names of all the dimension attribute columns that can be joined to
+        the flows."""
+        columns = []
+        for key in KEY_COLUMNS:
+            attributes = self._dimension(key)
+            if attributes is not None:
+                columns.extend('{}.{}'.format(key, k)
+                               for k in attributes.columns)
+        return columns
+
+    def _has_column(self, name):
+        return name in self._columns or self._split_column(name) is not None
+
+    def _encoded(self, name, rows=slice(None)):
+        """Values of column `name` at `rows`, keeping dictionary-encoded
+        columns encoded (see :class:`~sankeyview.selection.Encoded`)."""
+        if name in self._dictionaries:
+            return Encoded(self._columns[name][rows],
+                           self._dictionaries[name].values)
+        elif name in self._columns:
+            return self._columns[name][rows]
+        split = self._split_column(name)
+        if split is None:
+            raise KeyError(name)
+        key, attribute = split
+        return Encoded(self._codes(key)[rows],
+                       self._dimension(key)[attribute].values)
+
+    def _column(self, name):
+        """Values of dimension attribute column `name` for all flows. They
+        are gathered from the dimension table the first time, and cached."""
+        try:
+            return self._gathered[name]
+        except KeyError:
+            values = self._gathered[name] = self._encoded(name).decode()
+            return values
+
+    def _take(self, rows, columns=None):
+        """Flows at positions `rows`, with dimension attribute `columns`
+        joined (all of them, if `columns` is None)."""
+        if columns is None:
+            columns = self.dimension_columns()
+        data = OrderedDict()
+        for name, values in self._columns.items():
+            if name in self._dictionaries:
+                data[name] = pd.Categorical.from_codes(
+                    values[rows], self._dictionaries[name])
+            else:
+                data[name] = values[rows]
+        for name in columns:
+            if name not in data and self._has_column(name):
+                data[name] = self._column(name)[rows]
+        if isinstance(rows, slice):
+            index = pd.RangeIndex(self._num_rows)[rows]
+        else:
+            index = rows
+        return pd.DataFrame(data, index=index, columns=list(data))
 
     def partition(self, dimension, processes=None):
         """Partition of all values of `dimension` within `processes`"""
         if processes:
-            q = (self._table.source.isin(processes) |
-                 self._table.target.isin(processes))
-            values = self._table.loc[q, dimension].unique()
+            member = self._processes.isin(processes)
+            q = (_lookup(member, self._codes('source')) |
+                 _lookup(member, self._codes('target')))
+        else:
+            q = slice(None)
+        values = self._encoded(dimension, q)
+        if isinstance(values, Encoded):
+            codes = pd.unique(values.codes)
+            if dimension in self._dictionaries:
+                codes = codes[codes >= 0]
+            values = Encoded(codes, values.values).decode()
+        return Partition.Simple(dimension, pd.unique(values))
+
+    def process_membership(self, sel):
+        """Boolean array indicating which processes are selected by `sel`.
+
+        The result is indexed by process code, and is cached.
+        """
+        key = tuple(sel) if isinstance(sel, list) else sel
+        try:
+            return self._memberships[key]
+        except KeyError:
+            pass
+
+        if isinstance(sel, (list, tuple)):
+            member = self._processes.isin(sel)
+        elif isinstance(sel, str):
+            selection = compile_selection(sel, 'source', self._selections)
+            member = selection.evaluate(self._process_column,
+                                        self._processes).values
         else:
-            values = self._table[dimension].unique()
-        return Partition.Simple(dimension, values)
+            raise TypeError('Unknown selection type: %s' % type(sel))
+
+        self._memberships[key] = member
+        return member
+
+    def _process_column(self, name):
+        if name == 'source':
+            return self._processes.values
+        attributes = self._dimension('source')
+        if attributes is None:
+            raise KeyError(name)
+        return attributes[name[len('source.'):]]
+
+    def eval_selection(self, flows, column, sel):
+        """Evaluate `sel` against `flows`, a subset of this dataset's flows.
+
+        Process selections (`column` is ``'source'`` or ``'target'``) are
+        looked up by process code; flow selections are compiled once and
+        cached, and only gather the columns they refer to.
+        """
+        rows = flows.index.values
+        if column in ('source', 'target'):
+            member = self.process_membership(sel)
+            codes = self._codes(column)[rows]
+            return pd.Series(_lookup(member, codes), index=flows.index)
+        elif isinstance(sel, str):
+            selection = compile_selection(sel, column, self._selections)
+            return selection.evaluate(lambda name: self._encoded(name, rows),
+                                      flows.index)
+        return eval_selection(flows, column, sel)
+
+    def select_flows(self, sel):
+        """Boolean array indicating which flows are selected by `sel`."""
+        if isinstance(sel, str):
+            selection = compile_selection(sel, '', self._selections)
+            index = pd.RangeIndex(self._num_rows)
+            return selection.evaluate(self._encoded, index).values
+        return eval_selection(self._flows, '', sel).values
+
+    def process_pairs(self):
+        """Distinct (source, target) process pairs in the flows.
+
+        Returns `(pairs, pair_source, pair_target)`: the pair index of each
+        flow, and the source and target process codes of each pair (-1 if
+        missing). The result is cached.
+        """
+        if self._process_pairs is None:
+            n = len(self._processes) + 1
+            combined = ((self._codes('source').astype(np.int64) + 1) * n +
+                        self._codes('target') + 1)
+            unique, pairs = np.unique(combined, return_inverse=True)
+            self._process_pairs = (pairs, unique // n - 1, unique % n - 1)
+        return self._process_pairs
+
+    def apply_view(self, process_groups, bundles, flow_selection=None,
+                   columns=None):
+        """Find the flows belonging to each bundle.
+
+        The flows in each bundle have the dimension attribute `columns`
+        joined (all of them, if `columns` is None).
+        """
+        return _apply_view(self, process_groups, bundles, flow_selection,
+                           columns)
+
+    def append(self, flows, samples=None):
+        """Append `flows` (with the same columns as the dataset), and their
+        `samples` of each of the dataset's ensemble measures.
+
+        Dictionaries only grow, so existing codes stay valid; the row-level
+        caches are extended rather than recomputed, and the cube (if any) is
+        updated. Returns the new `version` and the `range` of rows added, so
+        that downstream caches can be updated too.
+        """
+        if set(flows.columns) != set(self._columns):
+            raise ValueError('Appended flows must have columns {}'
+                             .format(', '.join(self._columns)))
+        samples = samples or {}
+        if set(samples) != set(self.samples):
+            raise ValueError('Appended flows must have samples of {}'
+                             .format(', '.join(self.samples)))
+        for name, values in samples.items():
+            values = np.asarray(values)
+            if values.shape != (len(flows), ) + self.samples[name].shape[1:]:
+                raise ValueError('Samples of "{}" must be a 2-D array with a '
+                                 'row for each flow'.format(name))
+        start, stop = self._num_rows, self._num_rows + len(flows)
+
+        # Extend the dictionaries with any new values
+        grown = set()
+        for name, dictionary in list(self._dictionaries.items()):
+            if name == 'target':
+                continue
+            values = [flows[name]]
+            if name == 'source':
+                values.append(flows['target'])
+            extra = _dictionary(values)
+            extra = extra[~extra.isin(dictionary)]
+            if len(extra):
+                dictionary = dictionary.append(extra)
+                self._dictionaries[name] = dictionary
+                if name == 'source':
+                    self._dictionaries['target'] = dictionary
+                    self._processes = dictionary
+                    grown.update(['source', 'target'])
+                else:
+                    grown.add(name)
+
+        for name in self._columns:
+            if name in self._dictionaries:
+                dictionary = self._dictionaries[name]
+                values = _compact_codes(dictionary.get_indexer(flows[name]),
+                                        len(dictionary))
+            else:
+                values = np.asarray(flows[name])
+            self._columns[name] = self._grow(('column', name),
+                                             self._columns[name], values)
+        for name, values in samples.items():
+            self.samples[name] = self._grow(('samples', name),
+                                            self.samples[name],
+                                            np.asarray(values))
+        self._num_rows = stop
+        self._mapped = None
+        self._shared = None
+
+        # Caches over the dictionaries are cheap to recompute; those over the
+        # flows are extended with the new rows.
+        for name in grown:
+            self._attributes.pop(name, None)
+        if grown & {'source', 'target'}:
+            self._memberships = {}
+        for name in list(self._gathered):
+            rows = slice(start, stop)
+            self._gathered[name] = self._grow(
+                ('gathered', name), self._gathered[name],
+                self._encoded(name, rows).decode())
+        if self._process_pairs is not None:
+            self._extend_process_pairs(start, stop)
+
+        if self.cube is not None:
+            self.cube = self.cube.update(self, range(start, stop))
+        self.version += 1
+        return self.version, range(start, stop)
+
+    def _grow(self, key, current, values):
+        """`current` with `values` appended. The result is a view of a buffer
+        (stored under `key`) whose capacity is doubled when it runs out."""
+        buffer = self._buffers.get(key)
+        n, end = len(current), len(current) + len(values)
+        dtype = np.result_type(current, values)
+        if (buffer is None or current.base is not buffer or
+                len(buffer) < end or buffer.dtype != dtype):
+            buffer = np.empty((max(end, 2 * n), ) + current.shape[1:],
+                              dtype=dtype)
+            buffer[:n] = current
+            self._buffers[key] = buffer
+        buffer[n:end] = values
+        return buffer[:end]
+
+    def _extend_process_pairs(self, start, stop):
+        pairs, pair_source, pair_target = self._process_pairs
+        n = len(self._processes) + 1
+        known = pd.Index((pair_source + 1) * n + pair_target + 1)
+        combined = ((self._codes('source')[start:stop].astype(np.int64) + 1)
+                    * n + self._codes('target')[start:stop] + 1)
+        new_pairs = known.get_indexer(combined)
+        missing = new_pairs < 0
+        added, inverse = np.unique(combined[missing], return_inverse=True)
+        new_pairs[missing] = len(known) + inverse
+        self._process_pairs = (self._grow(('pairs', ), pairs, new_pairs),
+                               np.append(pair_source, added // n - 1),
+                               np.append(pair_target, added % n - 1))
 
-    def apply_view(self, process_groups, bundles, flow_selection=None):
-        return _apply_view(self, process_groups, bundles, flow_selection)
+    def build_cube(self, rollups=()):
+        """Pre-aggregate the measures by key into a
+        :class:`~sankeyview.cube.Cube`.
+
+        The cube is kept as ``self.cube``, and :func:`sankey_view` answers
+        definitions from its coarsest usable level instead of the flows.
+        `rollups` lists attributes of material or time (such as
+        ``"time.year"``) to add coarser levels for.
+        """
+        from .cube import Cube
+        self.cube = Cube.build(self, rollups)
+        return self.cube
 
     def save(self, filename):
         with pd.HDFStore(filename) as store:
-            store['flows'] = self._flows
+            store['flows'] = _decode(self._flows)
             if self._dim_process is not None:
                 store['dim_process'] = self._dim_process
             if self._dim_material is not None:
                 store['dim_material'] = self._dim_material
             if self._dim_time is not None:
                 store['dim_time'] = self._dim_time
+            if self.samples:
+                store['sample_names'] = pd.Series(list(self.samples))
+                for i, values in enumerate(self.samples.values()):
+                    store['samples{}'.format(i)] = pd.DataFrame(values)
 
     @classmethod
     def from_hdf(cls, filename):
         with pd.HDFStore(filename) as store:
+            samples = None
+            if 'sample_names' in store:
+                samples = OrderedDict(
+                    (name, store['samples{}'.format(i)].values)
+                    for i, name in enumerate(store['sample_names']))
             return cls(store['flows'],
                        store['dim_process'] if 'dim_process' in store else None,
                        store['dim_material'] if 'dim_material' in store else None,
-                       store['dim_time'] if 'dim_time' in store else None)
+                       store['dim_time'] if 'dim_time' in store else None,
+                       samples)
 
     @classmethod
     def from_csv(cls,
                  flows_filename,
                  dim_process_filename=None,
                  dim_material_filename=None,
-                 dim_time_filename=None):
+                 dim_time_filename=None,
+                 chunksize=None):
+        """Load a dataset from CSV files.
+
+        If `chunksize` is given, the flows are not read now; instead a
+        :class:`ChunkedDataset` is returned, which :func:`sankey_view` reads
+        and aggregates `chunksize` rows at a time.
+        """
 
         def read(filename):
             if filename is not None:
@@ -120,113 +545,556 @@ class Dataset:
             else:
                 return None
 
-        flows = pd.read_csv(flows_filename)
         dim_process = read(dim_process_filename)
         dim_material = read(dim_material_filename)
         dim_time = read(dim_time_filename)
+        if chunksize is not None:
+            return ChunkedDataset(flows_filename, chunksize, dim_process,
+                                  dim_material, dim_time)
+        flows = pd.read_csv(flows_filename)
         return cls(flows, dim_process, dim_material, dim_time)
 
+    def save_columnar(self, dirname, row_group_size=65536):
+        """Save the dataset as a directory of per-column ``.npy`` files.
+
+        Text columns are saved as dictionary codes, and each block of
+        `row_group_size` rows is summarised (value ranges, or which
+        dictionary values appear), so that :meth:`from_columnar` can read
+        only the columns and row groups that are needed. Dictionaries of
+        text are saved as JSON, so only text and numbers can be saved in
+        them; nothing is pickled. The samples of ensemble measures are
+        saved as 2-D ``.npy`` files.
+        """
+        os.makedirs(dirname, exist_ok=True)
+        n = self._num_rows
+        bounds = list(range(0, n, row_group_size)) + [n]
+        row_groups = [[int(i0), int(i1)] for i0, i1 in pairwise(bounds)]
+
+        columns = []
+        dictionaries = {}
+        for i, (name, values) in enumerate(self._columns.items()):
+            entry = {'name': name, 'file': 'column{}.npy'.format(i)}
+            if name in self._dictionaries:
+                codes, dictionary = values, self._dictionaries[name]
+            elif values.dtype == object:
+                codes, dictionary = pd.factorize(values)
+                codes = _compact_codes(codes, len(dictionary))
+            else:
+                codes, dictionary = None, None
+
+            if dictionary is None:
+                np.save(os.path.join(dirname, entry['file']), values,
+                        allow_pickle=False)
+                entry['stats'] = _column_stats(values, row_groups)
+            else:
+                # Source and target share a dictionary
+                key = id(dictionary)
+                if key not in dictionaries:
+                    dictionaries[key] = _save_dictionary(
+                        dirname, 'dictionary{}'.format(i), dictionary)
+                entry['dictionary'] = dictionaries[key]
+                entry['presence'] = 'presence{}.npy'.format(i)
+                np.save(os.path.join(dirname, entry['file']), codes,
+                        allow_pickle=False)
+                np.save(os.path.join(dirname, entry['presence']),
+                        _code_presence(codes, len(dictionary), row_groups),
+                        allow_pickle=False)
+            columns.append(entry)
+
+        for i, (name, values) in enumerate(self.samples.items()):
+            entry = {'name': name, 'file': 'samples{}.npy'.format(i),
+                     'samples': True}
+            np.save(os.path.join(dirname, entry['file']), values,
+                    allow_pickle=False)
+            columns.append(entry)
+
+        dims = {}
+        for dim, table in [('process', self._dim_process),
+                           ('material', self._dim_material),
+                           ('time', self._dim_time)]:
+            if table is not None:
+                dims[dim] = _save_table(dirname, 'dim_{}'.format(dim), table)
+
+        meta = {
+            'format': COLUMNAR_FORMAT,
+            'version': 1,
+            'num_rows': n,
+            'row_groups': row_groups,
+            'columns': columns,
+            'dimensions': dims,
+        }
+        with open(os.path.join(dirname, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    @classmethod
+    def from_columnar(cls,
+                      dirname,
+                      sankey_definition=None,
+                      measures=('value', ),
+                      columns=None,
+                      flow_selection=None,
+                      mmap=False):
+        """Load a dataset saved by :meth:`save_columnar`.
+
+        Only the key columns and `columns` are read (all columns, if None);
+        `columns` may name ensemble measures. Row groups which cannot match
+        `flow_selection` are skipped.
+
+        If `sankey_definition` is given, `columns` defaults to the columns it
+        refers to plus `measures`, and `flow_selection` to its flow
+        selection: the result is then only suitable for that definition.
+
+        If `mmap` is True, the columns are memory-mapped rather than read
+        into memory (unless the row groups kept are not contiguous). A
+        memory-mapped dataset pickles as a reference to the files, so
+        worker processes map the same files instead of receiving copies.
+        """
+        reader = _ColumnarReader(dirname)
+
+        if sankey_definition is not None:
+            if columns is None:
+                columns = sankey_definition.referenced_columns()
+                columns.update(measures)
+            if flow_selection is None:
+                flow_selection = sankey_definition.flow_selection
+        names = [name for name in reader.entries
+                 if columns is None or name in KEY_COLUMNS or name in columns]
+
+        row_groups = reader.meta['row_groups']
+        if isinstance(flow_selection, str):
+            selection = compile_selection(flow_selection)
+            row_groups = [g for i, g in enumerate(row_groups)
+                          if selection.may_match(_ColumnarSummaries(reader, i))]
+
+        dataset = _read_columnar(reader, names, row_groups, mmap)
+        if mmap:
+            dataset._mapped = (dirname, names, row_groups)
+        return dataset
+
+
+class ChunkedDataset:
+    """Flows in a CSV file, read `chunksize` rows at a time.
+
+    Each chunk is loaded as a :class:`Dataset` sharing the dimension tables,
+    so that :func:`sankey_view` can aggregate a large file in bounded memory.
+    """
+
+    def __init__(self,
+                 flows_filename,
+                 chunksize,
+                 dim_process=None,
+                 dim_material=None,
+                 dim_time=None):
+        self.flows_filename = flows_filename
+        self.chunksize = chunksize
+        self._dim_process = dim_process
+        self._dim_material = dim_material
+        self._dim_time = dim_time
+
+        # Compiled selections, shared by the chunks
+        self._selections = {}
+
+    def chunks(self, columns=None):
+        """Datasets of successive chunks of flows, with the key columns and
+        `columns` (all columns, if None)."""
+        if columns is None:
+            usecols = None
+        else:
+            usecols = lambda name: name in KEY_COLUMNS or name in columns
+        reader = pd.read_csv(self.flows_filename, chunksize=self.chunksize,
+                             usecols=usecols)
+        for flows in reader:
+            dataset = Dataset(flows, self._dim_process, self._dim_material,
+                              self._dim_time)
+            dataset._selections = self._selections
+            yield dataset
+
+
+def _read_columnar(reader, names, row_groups, mmap=False):
+    samples = [name for name in names if reader.entries[name].get('samples')]
+    columns = OrderedDict(
+        (name, reader.column(name, row_groups, mmap)) for name in names
+        if name not in samples)
+    dictionaries = {name: reader.dictionary(name) for name in names
+                    if 'dictionary' in reader.entries[name]}
+    dataset = Dataset._from_columns(columns, dictionaries,
+                                    reader.dims.get('process'),
+                                    reader.dims.get('material'),
+                                    reader.dims.get('time'))
+    for name in samples:
+        dataset._set_samples(name, reader.column(name, row_groups, mmap))
+    return dataset
+
+
+def _map_columnar(dirname, names, row_groups):
+    """Memory-map a columnar dataset again, when unpickling."""
+    dataset = _read_columnar(_ColumnarReader(dirname), names, row_groups,
+                             mmap=True)
+    dataset._mapped = (dirname, names, row_groups)
+    return dataset
+
+
+def _save_dictionary(dirname, name, dictionary):
+    """Save `dictionary` as ``name.npy``, or as ``name.json`` if it holds
+    objects (which must be text or numbers). Returns the filename."""
+    if dictionary.dtype != object:
+        filename = name + '.npy'
+        np.save(os.path.join(dirname, filename), np.asarray(dictionary),
+                allow_pickle=False)
+        return filename
+
+    values = [v.item() if isinstance(v, np.generic) else v
+              for v in dictionary]
+    for v in values:
+        if not isinstance(v, (str, int, float)):
+            raise ValueError('Cannot save {!r}: only text and numbers can be '
+                             'saved in a dictionary'.format(v))
+    filename = name + '.json'
+    with open(os.path.join(dirname, filename), 'w') as f:
+        json.dump(values, f)
+    return filename
+
+
+def _save_table(dirname, name, table):
+    """Save the index and columns of `table` as ``.npy`` files, with object
+    columns as dictionary codes. Returns the entry for the metadata."""
+    def save(values, filename, column):
+        entry = {'name': column, 'file': filename + '.npy'}
+        values = np.asarray(values)
+        if values.dtype == object:
+            codes, dictionary = pd.factorize(values)
+            entry['dictionary'] = _save_dictionary(
+                dirname, filename + '_dictionary', dictionary)
+            values = _compact_codes(codes, len(dictionary))
+        np.save(os.path.join(dirname, entry['file']), values,
+                allow_pickle=False)
+        return entry
+
+    return {
+        'index': save(table.index, name + '_index', table.index.name),
+        'columns': [save(table[column], '{}_column{}'.format(name, i), column)
+                    for i, column in enumerate(table.columns)],
+    }
+
+
+def _column_stats(values, row_groups):
+    """Range of `values` in each row group, if they are numeric."""
+    if values.dtype.kind not in 'biuf':
+        return None
+    stats = []
+    for i0, i1 in row_groups:
+        chunk = values[i0:i1]
+        if values.dtype.kind == 'f':
+            present = chunk[~np.isnan(chunk)]
+            has_missing = len(present) < len(chunk)
+        else:
+            present, has_missing = chunk, False
+        if len(present):
+            stats.append([present.min().item(), present.max().item(),
+                          has_missing])
+        else:
+            stats.append([None, None, has_missing])
+    return stats
+
+
+def _code_presence(codes, size, row_groups):
+    """Which codes (and, at the end, -1) appear in each row group."""
+    presence = np.zeros((len(row_groups), size + 1), dtype=bool)
+    for i, (i0, i1) in enumerate(row_groups):
+        presence[i, codes[i0:i1]] = True
+    return np.packbits(presence, axis=1)
+
+
+class _ColumnarSummaries:
+    """Summaries of the columns in one row group of a columnar dataset, for
+    :meth:`Selection.may_match`."""
+
+    def __init__(self, reader, group):
+        self.reader = reader
+        self.group = group
+
+    def present(self, name):
+        """Dictionary values of column `name` present in the row group, as
+        an object array (including NaN if any values are missing)."""
+        dictionary = self.reader.dictionary(name)
+        presence = np.unpackbits(self.reader.presence(name)[self.group])
+        present = presence[:len(dictionary) + 1].astype(bool)
+        values = dictionary.values[present[:-1]].astype(object)
+        return np.append(values, np.nan) if present[-1] else values
+
+    def __call__(self, name):
+        entry = self.reader.entries.get(name)
+        if entry is not None and 'presence' in entry:
+            return Summary(values=self.present(name))
+        elif entry is not None and entry.get('stats'):
+            lower, upper, has_missing = entry['stats'][self.group]
+            return Summary(lower=lower, upper=upper, has_missing=has_missing)
+
+        # Attributes of dimension tables
+        key, _, attribute = name.partition('.')
+        dim = self.reader.dims.get(_DIMENSIONS.get(key))
+        entry = self.reader.entries.get(key)
+        if (dim is None or attribute not in dim or entry is None or
+                'presence' not in entry):
+            return None
+        values = dim[attribute].reindex(self.present(key)).values
+        return Summary(values=values.astype(object))
+
+
+class _ColumnarReader:
+    """Reads the files of a dataset saved by :meth:`Dataset.save_columnar`."""
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        with open(self.path('meta.json')) as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != COLUMNAR_FORMAT:
+            raise ValueError('{} is not a columnar dataset'.format(dirname))
+        self.entries = {entry['name']: entry
+                        for entry in self.meta['columns']}
+        self.dims = {dim: self.table(entry)
+                     for dim, entry in self.meta['dimensions'].items()}
+        self._dictionaries = {}
+
+    def path(self, filename):
+        return os.path.join(self.dirname, filename)
+
+    def dictionary(self, name):
+        filename = self.entries[name]['dictionary']
+        if filename not in self._dictionaries:
+            self._dictionaries[filename] = self.load_dictionary(filename)
+        return self._dictionaries[filename]
+
+    def load_dictionary(self, filename):
+        if filename.endswith('.json'):
+            with open(self.path(filename)) as f:
+                return pd.Index(json.load(f), dtype=object)
+        return pd.Index(np.load(self.path(filename), allow_pickle=False))
+
+    def table(self, entry):
+        """Dimension table saved by `_save_table`."""
+        def load(entry):
+            values = np.load(self.path(entry['file']), allow_pickle=False)
+            if 'dictionary' not in entry:
+                return values
+            dictionary = self.load_dictionary(entry['dictionary'])
+            return np.append(np.asarray(dictionary, dtype=object),
+                             np.nan)[values]
+
+        index = pd.Index(load(entry['index']), name=entry['index']['name'])
+        names = [column['name'] for column in entry['columns']]
+        return pd.DataFrame(OrderedDict(
+            (column['name'], load(column)) for column in entry['columns']),
+                            index=index, columns=names)
+
+    def presence(self, name):
+        return np.load(self.path(self.entries[name]['presence']),
+                       mmap_mode='r', allow_pickle=False)
+
+    def column(self, name, row_groups, mmap=False):
+        """Values (or dictionary codes) of column `name` in `row_groups`.
+
+        If `mmap` is True and the row groups are contiguous, the result is a
+        read-only view of the mapped file; otherwise it is read into memory.
+        """
+        entry = self.entries[name]
+        data = np.load(self.path(entry['file']), mmap_mode='r',
+                       allow_pickle=False)
+        contiguous = all(a[1] == b[0] for a, b in pairwise(row_groups))
+        if not row_groups:
+            return np.array(data[:0])
+        elif mmap and contiguous:
+            return data[row_groups[0][0]:row_groups[-1][1]]
+        elif len(row_groups) == len(self.meta['row_groups']):
+            return np.array(data)
+        return np.concatenate([data[i0:i1] for i0, i1 in row_groups])
+
+
+_DIMENSIONS = {
+    'source': 'process',
+    'target': 'process',
+    'material': 'material',
+    'time': 'time',
+}
+
+
+def _dictionary(values, dim=None):
+    """Index of the distinct values in `values`, followed by any others in
+    the index of `dim`."""
+    values = [v.values for v in values]
+    if dim is not None:
+        values.append(dim.index.values)
+    return pd.Index(pd.unique(np.concatenate(values))).dropna()
+
+
+def _compact_codes(codes, size):
+    """`codes` in the smallest integer type that can hold `size` values."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if size < np.iinfo(dtype).max:
+            return codes.astype(dtype, copy=False)
+    return codes.astype(np.int64, copy=False)
+
+
+def _lookup(table, codes):
+    """`table[codes]`, giving False where `codes` is -1 (missing)."""
+    return np.append(table, False)[codes]
+
+
+def _decode(flows):
+    """Copy of `flows` with categorical columns converted back to values."""
+    return flows.assign(**{
+        column: np.asarray(flows[column])
+        for column in flows.columns
+        if hasattr(flows[column], 'cat')
+    })
+
 
 def find_flows(flows,
                source_query,
                target_query,
                flow_query=None,
-               ignore_edges=None):
+               ignore_edges=None,
+               dataset=None):
     """Filter flows according to source_query, target_query, and flow_query.
+
+    If `flows` is a subset of `dataset`'s table, the queries are evaluated
+    using `dataset`'s cached selections.
     """
+    select = dataset.eval_selection if dataset is not None else eval_selection
+
     if flow_query is not None:
-        flows = flows[eval_selection(flows, '', flow_query)]
+        flows = flows[select(flows, '', flow_query)]
 
     if source_query is None and target_query is None:
         raise ValueError('source_query and target_query cannot both be None')
 
     elif source_query is None and target_query is not None:
-        qt = eval_selection(flows, 'target', target_query)
-        qs = (~eval_selection(flows, 'source', target_query) &
+        qt = select(flows, 'target', target_query)
+        qs = (~select(flows, 'source', target_query) &
               ~flows.index.isin(ignore_edges or []))
 
     elif source_query is not None and target_query is None:
-        qs = eval_selection(flows, 'source', source_query)
-        qt = (~eval_selection(flows, 'target', source_query) &
+        qs = select(flows, 'source', source_query)
+        qt = (~select(flows, 'target', source_query) &
               ~flows.index.isin(ignore_edges or []))
 
     else:
-        qs = eval_selection(flows, 'source', source_query)
-        qt = eval_selection(flows, 'target', target_query)
+        qs = select(flows, 'source', source_query)
+        qt = select(flows, 'target', target_query)
 
     f = flows[qs & qt]
     if source_query is None:
         internal_source = None
     else:
-        internal_source = flows[qs & eval_selection(flows, 'target',
-                                                    source_query)]
+        internal_source = flows[qs & select(flows, 'target', source_query)]
     if target_query is None:
         internal_target = None
     else:
-        internal_target = flows[qt & eval_selection(flows, 'source',
-                                                    target_query)]
+        internal_target = flows[qt & select(flows, 'source', target_query)]
 
     return f, internal_source, internal_target
 
 
-def _apply_view(dataset, process_groups, bundles, flow_selection):
+def _apply_view(dataset, process_groups, bundles, flow_selection,
+                columns=None):
     # What we want to warn about is flows between process_groups in the view_graph; they
     # are "used", since they appear in Elsewhere bundles, but the connection
     # isn't visible.
 
-    used_edges = set()
-    used_internal = set()
-    used_process_groups = set()
-    bundle_flows = {}
+    pairs, pair_source, pair_target = dataset.process_pairs()
+    select_rows = dataset.select_flows
 
-    table = dataset._table
     if flow_selection:
-        table = table[eval_selection(table, '', flow_selection)]
+        selected = select_rows(flow_selection)
+    else:
+        selected = np.ones(len(pairs), dtype=bool)
+    pair_selected = np.bincount(pairs[selected], minlength=len(pair_source)) > 0
 
-    for k, bundle in bundles.items():
-        if bundle.from_elsewhere or bundle.to_elsewhere:
-            continue  # do these afterwards
-
-        source = process_groups[bundle.source]
-        target = process_groups[bundle.target]
-        flows, internal_source, internal_target = \
-            find_flows(table, source.selection, target.selection, bundle.flow_selection)
-        assert len(used_edges.intersection(
-            flows.index.values)) == 0, 'duplicate bundle'
-        bundle_flows[k] = flows
-        used_edges.update(flows.index.values)
-        used_process_groups.update(flows.source)
-        used_process_groups.update(flows.target)
-        # Also marked internal edges as "used"
-        used_internal.update(internal_source.index.values)
-        used_internal.update(internal_target.index.values)
+    # Label each flow with the index (in `keys`) of the bundle it belongs to,
+    # or -1. Bundles are matched against each distinct source-target pair,
+    # except those with a flow_selection, which are matched flow by flow.
+    keys = [k for k, bundle in bundles.items()
+            if not (bundle.from_elsewhere or bundle.to_elsewhere)]
+    pair_bundle = np.full(len(pair_source), -1, dtype=int)
+    pair_internal = np.zeros(len(pair_source), dtype=bool)
+    with_flow_selection = []
+    for i, k in enumerate(keys):
+        bundle = bundles[k]
+        qs = dataset.process_membership(process_groups[bundle.source].selection)
+        qt = dataset.process_membership(process_groups[bundle.target].selection)
+        ss, st = _lookup(qs, pair_source), _lookup(qs, pair_target)
+        ts, tt = _lookup(qt, pair_source), _lookup(qt, pair_target)
+        match = ss & tt
+        # Flows within the source or target are marked as "used" too
+        internal = (ss & st) | (ts & tt)
+        if bundle.flow_selection:
+            with_flow_selection.append((i, match, internal))
+            continue
+        match &= pair_selected
+        _check_duplicate_bundles(keys, k, pair_bundle[match])
+        pair_bundle[match] = i
+        pair_internal |= internal
+
+    assignment = pair_bundle[pairs]
+    assignment[~selected] = -1
+    internal_flows = pair_internal[pairs] & selected
+    for i, match, internal in with_flow_selection:
+        q = selected & select_rows(bundles[keys[i]].flow_selection)
+        rows = match[pairs] & q
+        _check_duplicate_bundles(keys, keys[i], assignment[rows])
+        assignment[rows] = i
+        internal_flows |= internal[pairs] & q
 
+    # Split the flows by bundle, keeping them in their original order
+    order = np.argsort(assignment, kind='mergesort')
+    offsets = np.cumsum(np.bincount(assignment + 1, minlength=len(keys) + 1))
+    bundle_flows = {
+        k: dataset._take(order[offsets[i]:offsets[i + 1]], columns)
+        for i, k in enumerate(keys)
+    }
+
+    assigned = assignment >= 0
+    used_codes = np.union1d(dataset._codes('source')[assigned],
+                            dataset._codes('target')[assigned])
+    used_process_groups = set(dataset._processes[used_codes[used_codes >= 0]])
+
+    # Flows to/from Elsewhere are those not already in a bundle
+    unassigned = selected & ~assigned
     for k, bundle in bundles.items():
         if bundle.from_elsewhere and bundle.to_elsewhere:
             raise ValueError('Cannot have flow from Elsewhere to Elsewhere')
 
         elif bundle.from_elsewhere:
-            target = process_groups[bundle.target]
-            flows, _, _ = find_flows(table, None, target.selection,
-                                     bundle.flow_selection, used_edges)
+            qt = dataset.process_membership(process_groups[bundle.target].selection)
+            match = _lookup(qt, pair_target) & ~_lookup(qt, pair_source)
             used_process_groups.add(bundle.target)
 
         elif bundle.to_elsewhere:
-            source = process_groups[bundle.source]
-            flows, _, _ = find_flows(table, source.selection, None,
-                                     bundle.flow_selection, used_edges)
+            qs = dataset.process_membership(process_groups[bundle.source].selection)
+            match = _lookup(qs, pair_source) & ~_lookup(qs, pair_target)
             used_process_groups.add(bundle.source)
 
         else:
             continue
 
-        bundle_flows[k] = flows
+        rows = match[pairs] & unassigned
+        if bundle.flow_selection:
+            rows &= select_rows(bundle.flow_selection)
+        bundle_flows[k] = dataset._take(np.flatnonzero(rows), columns)
 
     # XXX shouldn't this check processes in selections, not process groups?
     # Check set of process_groups
-    relevant_flows = dataset._flows[dataset._flows.source.isin(
-        used_process_groups) & dataset._flows.target.isin(used_process_groups)]
-    unused_flows = relevant_flows[~relevant_flows.index.isin(used_edges) &
-                                  ~relevant_flows.index.isin(used_internal)]
+    used = dataset._processes.isin(list(used_process_groups))
+    relevant = (_lookup(used, dataset._codes('source')) &
+                _lookup(used, dataset._codes('target')))
+    unused_flows = dataset._take(
+        np.flatnonzero(relevant & ~assigned & ~internal_flows), [])
 
     return bundle_flows, unused_flows
+
+
+def _check_duplicate_bundles(keys, k, assignment):
+    clash = assignment[assignment >= 0]
+    if len(clash):
+        raise ValueError('Duplicate bundles: flows matched by bundle {} '
+                         'are already in bundle {}'.format(k, keys[clash[0]]))
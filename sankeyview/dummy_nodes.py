@@ -3,13 +3,27 @@ from .sankey_definition import Waypoint
 
 
 def add_dummy_nodes(G, v, w, bundle_key, bundle_index=0, node_kwargs=None):
+    """Copy of `G` with the dummy nodes and edges for the segment `v` to `w`
+    of bundle `bundle_key` added (see :func:`add_dummy_nodes_in_place`)."""
+    H = G.copy()
+    add_dummy_nodes_in_place(H, v, w, bundle_key, bundle_index, node_kwargs)
+    return H
+
+
+def add_dummy_nodes_in_place(H, v, w, bundle_key, bundle_index=0,
+                             node_kwargs=None):
+    """Add the dummy nodes and edges for the segment `v` to `w` of bundle
+    `bundle_key` to `H`, modifying it in place.
+
+    ``H.ordering`` can be an :class:`OrderingBuilder`, to avoid creating a new
+    ordering for every dummy node.
+    """
 
     if node_kwargs is None:
         node_kwargs = {}
 
-    V = G.get_node(v)
-    W = G.get_node(w)
-    H = G.copy()
+    V = H.get_node(v)
+    W = H.get_node(w)
     rv, iv, jv = H.ordering.indices(v)
     rw, iw, jw = H.ordering.indices(w)
 
@@ -28,7 +42,7 @@ def add_dummy_nodes(G, v, w, bundle_key, bundle_index=0, node_kwargs=None):
 
     if not new_ranks:
         _add_edge(H, v, w, bundle_key)
-        return H
+        return
 
     u = v
     for r in new_ranks:
@@ -53,8 +67,6 @@ def add_dummy_nodes(G, v, w, bundle_key, bundle_index=0, node_kwargs=None):
         u = idr
     _add_edge(H, u, w, bundle_key)
 
-    return H
-
 
 def _add_edge(G, v, w, bundle_key):
     if G.has_edge(v, w):
@@ -17,7 +17,11 @@ def graph_to_sankey(G,
                     hue_range=None,
                     hue_norm=False,
                     flow_color=None):
-    """Convert to display format, set colours, titles etc."""
+    """Convert to display format, set colours, titles etc.
+
+    `G` is a results graph, or a :class:`~sankeyview.results_graph.Results`
+    table.
+    """
     if groups is None:
         groups = []
 
@@ -17,6 +17,12 @@ class LayeredMixin(object):
         super().remove_node(u)
         self.ordering = self.ordering.remove(u)
 
+    def remove_nodes_from(self, nodes):
+        """Remove `nodes`, updating the ordering once for all of them."""
+        nodes = list(nodes)
+        super().remove_nodes_from(nodes)
+        self.ordering = self.ordering.remove_many(nodes)
+
     def get_node(self, u):
         """Get the ProcessGroup or Waypoint associated with `u`"""
         return self.node[u]['node']
@@ -0,0 +1,236 @@
+"""Reduce the crossing edges of a Sankey diagram by reordering its nodes."""
+
+import time
+from collections import defaultdict
+
+import attr
+import numpy as np
+
+from .ordering import Ordering
+from .view_graph import view_graph
+from .sankey_view import sankey_view
+
+
+def optimise_ordering(sankey_definition,
+                      dataset=None,
+                      time_budget=1.0,
+                      measure='value'):
+    """Reorder the nodes within the bands of `sankey_definition` to reduce the
+    number of crossing edges.
+
+    The nodes of the view graph (including dummy nodes) are sorted by the
+    median or barycenter of the positions of their neighbours, sweeping down
+    and up the layers, and then adjacent nodes are swapped while that removes
+    crossings. This is repeated until there is no improvement, or until
+    `time_budget` seconds have been spent. Nodes are not moved between bands
+    or layers.
+
+    If `dataset` is given, each crossing counts as the product of the flows
+    (`measure`) of the two edges, so that crossings of large flows are
+    avoided first.
+
+    Returns the new :class:`Ordering`, and the number of crossings in the view
+    graph before and after. If no better ordering is found, the original
+    ordering is returned.
+    """
+    start = time.monotonic()
+    weights = (_edge_weights(sankey_definition, dataset, measure)
+               if dataset is not None else None)
+
+    layout = _Layout(view_graph(sankey_definition), weights)
+    before = best = layout.crossings()
+    best_layers = list(layout.layers)
+    iteration = 0
+    while best > 0 and time.monotonic() - start < time_budget:
+        method = 'median' if iteration % 2 == 0 else 'barycenter'
+        R = len(layout.layers)
+        for r in range(1, R):
+            layout.sort_layer(r, r - 1, method)
+        for r in range(R - 2, -1, -1):
+            layout.sort_layer(r, r + 1, method)
+        for r in range(R):
+            layout.transpose(r)
+
+        crossings = layout.crossings()
+        if crossings < best:
+            best, best_layers = crossings, list(layout.layers)
+        elif iteration > 0:
+            # stop once neither method improves on the best ordering
+            break
+        iteration += 1
+
+    layout.set_layers(best_layers)
+    ordering = Ordering([[sorted(rank, key=layout.position) for rank in bands]
+                         for bands in sankey_definition.ordering.layers])
+
+    # The dummy nodes are placed again in the view graph of the new ordering
+    new_definition = attr.evolve(sankey_definition, ordering=ordering)
+    after = _Layout(view_graph(new_definition), weights).crossings()
+    if after >= before:
+        return sankey_definition.ordering, before, before
+    return ordering, before, after
+
+
+def _edge_weights(sankey_definition, dataset, measure):
+    """Total flow along each edge of the view graph of `sankey_definition`."""
+    GR, groups = sankey_view(sankey_definition, dataset, measure)
+    group_of = {x: group['id'] for group in groups for x in group['nodes']}
+    weights = defaultdict(float)
+    for v, w, data in GR.edges(data=True):
+        weights[group_of[v], group_of[w]] += float(np.mean(data['value']))
+    return weights
+
+
+def bilayer_crossings(upper, lower, weights=None):
+    """Number of crossings between edges joining two layers.
+
+    `upper` and `lower` are the positions of the ends of the edges in each
+    layer. If `weights` are given, each crossing counts as the product of the
+    weights of the two edges. Edges are added to an accumulator tree in order
+    of position (Barth et al., 2004), in O(E log V) time.
+    """
+    upper = np.asarray(upper, dtype=int)
+    lower = np.asarray(lower, dtype=int)
+    if weights is None:
+        weights = np.ones(len(lower), dtype=int)
+    order = np.lexsort((lower, upper))
+    size = int(lower.max()) + 1 if len(lower) else 0
+    tree = [0] * (size + 1)
+    total = crossings = 0
+    weights = np.asarray(weights)[order]
+    for x, w in zip(lower[order].tolist(), weights.tolist()):
+        # weight of the earlier edges ending at or before x
+        i, before = x + 1, 0
+        while i > 0:
+            before += tree[i]
+            i -= i & -i
+        crossings += w * (total - before)
+
+        i = x + 1
+        while i <= size:
+            tree[i] += w
+            i += i & -i
+        total += w
+    return crossings
+
+
+class _Layout(object):
+    """Positions of the nodes of a view graph, as arrays of node indices.
+
+    Only the edges between adjacent layers are counted, which after adding
+    dummy nodes are all the edges except those within a layer. Edges with
+    no flow (given `weights`) are ignored.
+    """
+
+    def __init__(self, G, weights=None):
+        self.nodes = []
+        self.layers = []
+        layer, band = [], []
+        for r, bands in enumerate(G.ordering.layers):
+            first = len(self.nodes)
+            for i, rank in enumerate(bands):
+                self.nodes.extend(rank)
+                layer.extend([r] * len(rank))
+                band.extend([i] * len(rank))
+            self.layers.append(np.arange(first, len(self.nodes)))
+        self._index = {u: k for k, u in enumerate(self.nodes)}
+        self.band = np.array(band, dtype=int)
+        self.pos = np.zeros(len(self.nodes), dtype=int)
+        for order in self.layers:
+            self.pos[order] = np.arange(len(order))
+
+        # Edges from layer r to r + 1, and each node's neighbours in the
+        # layers above (0) and below (1)
+        edges = [([], [], []) for order in self.layers]
+        self.neighbours = [([], []) for u in self.nodes]
+        for v, w in G.edges():
+            if v not in self._index or w not in self._index:
+                continue
+            a, b = self._index[v], self._index[w]
+            if layer[a] > layer[b]:
+                a, b = b, a
+            weight = 1 if weights is None else weights.get((v, w), 0)
+            if layer[b] - layer[a] != 1 or weight == 0:
+                continue
+            for column, value in zip(edges[layer[a]], (a, b, weight)):
+                column.append(value)
+            self.neighbours[a][1].append((b, weight))
+            self.neighbours[b][0].append((a, weight))
+        self.edges = [(np.array(upper, dtype=int), np.array(lower, dtype=int),
+                       np.array(weight)) for upper, lower, weight in edges]
+        self.neighbours = [tuple(_split(side) for side in sides)
+                           for sides in self.neighbours]
+
+    def position(self, u):
+        return self.pos[self._index[u]]
+
+    def set_layers(self, layers):
+        self.layers = list(layers)
+        for order in self.layers:
+            self.pos[order] = np.arange(len(order))
+
+    def crossings(self):
+        return sum(bilayer_crossings(self.pos[upper], self.pos[lower], weight)
+                   for upper, lower, weight in self.edges if len(upper))
+
+    def sort_layer(self, r, q, method):
+        """Sort the nodes of layer `r` within their bands, by the median or
+        barycenter of the positions of their neighbours in layer `q`."""
+        if q < r:
+            other, mine, weight = self.edges[q]
+        else:
+            mine, other, weight = self.edges[r]
+        order = self.layers[r]
+        key = self.pos[order].astype(float)
+        if len(mine):
+            N = len(self.nodes)
+            values = self.pos[other].astype(float)
+            if method == 'median':
+                s = np.lexsort((values, mine))
+                values = values[s]
+                counts = np.bincount(mine, minlength=N)
+                offsets = np.cumsum(counts) - counts
+                has = counts[order] > 0
+                c, o = counts[order][has], offsets[order][has]
+                key[has] = (values[o + (c - 1) // 2] + values[o + c // 2]) / 2
+            else:
+                total = np.bincount(mine, weight, minlength=N)[order]
+                sums = np.bincount(mine, weight * values, minlength=N)[order]
+                has = total > 0
+                key[has] = sums[has] / total[has]
+        new = order[np.lexsort((self.pos[order], key, self.band[order]))]
+        self.layers[r] = new
+        self.pos[new] = np.arange(len(new))
+
+    def transpose(self, r):
+        """Swap adjacent nodes of layer `r` in the same band while that
+        reduces the crossings."""
+        order = self.layers[r].copy()
+        improved = True
+        while improved:
+            improved = False
+            for k in range(len(order) - 1):
+                u, v = order[k], order[k + 1]
+                if self.band[u] != self.band[v]:
+                    continue
+                if self._pair_crossings(v, u) < self._pair_crossings(u, v):
+                    order[k], order[k + 1] = v, u
+                    self.pos[u], self.pos[v] = k + 1, k
+                    improved = True
+        self.layers[r] = order
+
+    def _pair_crossings(self, u, v):
+        """Crossings between the edges of `u` and `v`, with `u` before `v`."""
+        crossings = 0
+        for (nu, wu), (nv, wv) in zip(self.neighbours[u], self.neighbours[v]):
+            if len(nu) and len(nv):
+                after = self.pos[nu][:, None] > self.pos[nv][None, :]
+                crossings += (wu[:, None] * wv[None, :] * after).sum()
+        return crossings
+
+
+def _split(neighbours):
+    """Arrays of the nodes and weights in a list of (node, weight) pairs."""
+    nodes = np.array([n for n, w in neighbours], dtype=int)
+    weights = np.array([w for n, w in neighbours])
+    return nodes, weights
@@ -17,6 +17,10 @@ def _convert_layers(layers):
 class Ordering(object):
     layers = attr.ib(convert=_convert_layers)
 
+    # Cached map of node -> (layer, band, position), built when first needed
+    # and updated incrementally by `insert` and `remove_many`
+    _index = attr.ib(default=None, init=False, cmp=False, repr=False)
+
     def __repr__(self):
         def format_layer(layer):
             return '; '.join(', '.join(band) for band in layer)
@@ -34,11 +38,29 @@ class Ordering(object):
 
         layers = [_insert(layer) if i == ii else layer
                   for ii, layer in enumerate(self.layers)]
-        return Ordering(layers)
+        new = Ordering(layers)
+
+        index = self._index
+        if index is not None and 0 <= i < len(new.layers) and \
+                0 <= j < len(new.layers[i]):
+            index = dict(index)
+            band = new.layers[i][j]
+            # position of the new value, as for slicing the old band
+            start = slice(k, None).indices(len(band) - 1)[0]
+            for kk in range(start, len(band)):
+                index[band[kk]] = (i, j, kk)
+            new._set_index(index)
+        return new
 
     def remove(self, value):
+        return self.remove_many([value])
+
+    def remove_many(self, values):
+        """Remove all of `values` at once, dropping any layers left empty."""
+        values = set(values)
+
         def __remove(band):
-            return tuple(x for x in band if x != value)
+            return tuple(x for x in band if x not in values)
 
         def _remove(layer):
             return tuple(__remove(band) for band in layer)
@@ -46,17 +68,133 @@ class Ordering(object):
         layers = tuple(_remove(layer) for layer in self.layers)
 
         # remove unused ranks from layers
-        layers = tuple(layer for layer in layers if any(rank
-                                                        for rank in layer))
-
-        return Ordering(layers)
+        kept = [r for r, layer in enumerate(layers) if any(layer)]
+        new = Ordering(tuple(layers[r] for r in kept))
+
+        index = self._index
+        if index is not None:
+            # Update the positions in the bands that changed, and the layer
+            # of nodes after any removed layers
+            index = dict(index)
+            changed = {index.pop(value)[:2] for value in values
+                       if value in index}
+            for r, rr in enumerate(kept):
+                for i, band in enumerate(new.layers[r]):
+                    if r != rr or (rr, i) in changed:
+                        for j, x in enumerate(band):
+                            index[x] = (r, i, j)
+            new._set_index(index)
+        return new
 
     def indices(self, value):
+        """The (layer, band, position) of `value`."""
+        if self._index is None:
+            index = {}
+            for r, bands in enumerate(self.layers):
+                for i, rank in enumerate(bands):
+                    for j, x in enumerate(rank):
+                        index.setdefault(x, (r, i, j))
+            self._set_index(index)
+        try:
+            return self._index[value]
+        except KeyError:
+            raise ValueError('node "{}" not in ordering'.format(value))
+
+    def _set_index(self, index):
+        # Only kept if each node appears once, so that it can be updated
+        if len(index) == sum(len(rank) for bands in self.layers
+                             for rank in bands):
+            object.__setattr__(self, '_index', index)
+
+
+class OrderingBuilder(object):
+    """Mutable version of :class:`Ordering`, for inserting or removing many
+    nodes one at a time.
+
+    The bands are kept as lists, and each node is looked up in an index of
+    its band; positions within a band are recalculated only when needed after
+    it changes. `layers` should not be modified directly. Each node may only
+    appear once. :meth:`freeze` gives the final :class:`Ordering`.
+    """
+
+    def __init__(self, ordering=None):
+        layers = ordering.layers if ordering is not None else ()
+        self.layers = [[list(band) for band in bands] for bands in layers]
+        self._reindex()
+
+    def _reindex(self):
+        self._bands = {}
+        self._positions = {}
+        self._changed = set()
         for r, bands in enumerate(self.layers):
-            for i, rank in enumerate(bands):
-                if value in rank:
-                    return r, i, rank.index(value)
-        raise ValueError('node "{}" not in ordering'.format(value))
+            for i, band in enumerate(bands):
+                for j, x in enumerate(band):
+                    if x in self._bands:
+                        raise ValueError(
+                            'node "{}" appears more than once in ordering'
+                            .format(x))
+                    self._bands[x] = (r, i)
+                    self._positions[x] = j
+
+    def insert(self, i, j, k, value):
+        """Insert `value` at position `k` of band `j` of layer `i`.
+
+        Returns the builder itself, so it can be used in place of
+        :meth:`Ordering.insert`. As there, nothing is inserted if there is no
+        such band.
+        """
+        if value in self._bands:
+            raise ValueError('node "{}" already in ordering'.format(value))
+        if not (0 <= i < len(self.layers) and 0 <= j < len(self.layers[i])):
+            return self
+        self.layers[i][j].insert(k, value)
+        self._bands[value] = (i, j)
+        self._changed.add((i, j))
+        return self
+
+    def insert_layer(self, r):
+        """Insert an empty layer, with the same number of bands, at `r`."""
+        nb = len(self.layers[0]) if self.layers else 1
+        self.layers.insert(r, [[] for i in range(nb)])
+        self._reindex()
+        return self
+
+    def remove(self, value):
+        return self.remove_many([value])
+
+    def remove_many(self, values):
+        """Remove all of `values`, dropping any layers left empty."""
+        for value in values:
+            if value in self._bands:
+                r, i = self._bands.pop(value)
+                self._positions.pop(value, None)
+                self.layers[r][i].remove(value)
+                self._changed.add((r, i))
+
+        # remove unused ranks from layers
+        if not all(any(bands) for bands in self.layers):
+            self.layers = [bands for bands in self.layers if any(bands)]
+            self._reindex()
+        return self
+
+    def indices(self, value):
+        """The (layer, band, position) of `value`."""
+        try:
+            r, i = self._bands[value]
+        except KeyError:
+            raise ValueError('node "{}" not in ordering'.format(value))
+        if (r, i) in self._changed:
+            for j, x in enumerate(self.layers[r][i]):
+                self._positions[x] = j
+            self._changed.discard((r, i))
+        return r, i, self._positions[value]
+
+    def freeze(self):
+        """The :class:`Ordering` of the nodes, with its index filled in."""
+        index = {value: self.indices(value) for value in self._bands}
+        ordering = Ordering(self.layers)
+        ordering._set_index(index)
+        return ordering
 
 
 def flatten_bands(bands):
@@ -78,10 +216,9 @@ def unflatten_bands(L, idx):
 
 
 def band_index(idx, i):
-    for iband, i0 in reversed(list(enumerate(idx))):
-        if i >= i0:
-            return iband
-    return len(idx)
+    # the last band starting at or before i
+    iband = bisect.bisect_right(idx, i) - 1
+    return iband if iband >= 0 else len(idx)
 
 
 def new_node_indices(G,
@@ -93,9 +230,10 @@ def new_node_indices(G,
 
     this_layer, this_idx = flatten_bands(this_bands)
     other_layer, other_idx = flatten_bands(other_bands)
+    other_positions = {u: i for i, u in enumerate(other_layer)}
 
     # Position of new node, and which band in other_bands it would be
-    new_pos = median_value(neighbour_positions(G, other_layer,
+    new_pos = median_value(_adjacent_positions(G, other_positions,
                                                new_process_group))
     if new_pos == -1:
         # no connection -- default value?
@@ -103,7 +241,7 @@ def new_node_indices(G,
     new_band = band_index(other_idx, new_pos)
 
     # Position of other nodes in layer
-    existing_pos = [median_value(neighbour_positions(G, other_layer, u))
+    existing_pos = [median_value(_adjacent_positions(G, other_positions, u))
                     for u in this_layer]
     existing_pos = fill_unknown(existing_pos, side)
 
@@ -136,12 +274,19 @@ def median_value(positions):
 
 def neighbour_positions(G, rank, u):
     # neighbouring positions on other rank
-    positions = []
-    for i, n in enumerate(rank):
-        if G.has_edge(n, u) or G.has_edge(u, n):
-            positions.append(i)
+    return _adjacent_positions(G, {n: i for i, n in enumerate(rank)}, u)
+
 
-    return sorted(positions)
+def _adjacent_positions(G, positions, u):
+    """Sorted positions of the neighbours of `u`, looked up in `positions` (a
+    map of node -> position), so that only the edges of `u` are visited."""
+    if u not in G:
+        return []
+    if G.is_directed():
+        neighbours = set(G.predecessors(u)) | set(G.successors(u))
+    else:
+        neighbours = set(G.neighbors(u))
+    return sorted(positions[n] for n in neighbours if n in positions)
 
 
 def fill_unknown(values, side):
@@ -0,0 +1,159 @@
+"""Running :func:`sankey_view` in a pool of worker processes."""
+
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None
+
+from .dataset import Dataset
+
+# State of each worker process, set by _init_worker or _init_batch_worker
+_worker = {}
+
+
+def _init_worker(dataset, view, results):
+    _worker['dataset'] = dataset
+    _worker['view'] = view
+    _worker['results'] = results
+
+
+def _shard_partial(rows):
+    """Partial aggregates of the worker's dataset between `rows`."""
+    shard = _worker['dataset']._rows(*rows)
+    process_groups, bundles, flow_selection, columns = _worker['view']
+    bundle_flows, _ = shard.apply_view(process_groups, bundles,
+                                       flow_selection, columns)
+    return _worker['results'].partial(bundle_flows)
+
+
+def sharded_results(dataset, results, view, processes, shards=None):
+    """Add the flows of `dataset` to `results` (a
+    :class:`~sankeyview.results_graph.ChunkedResults`), a shard of rows at a
+    time in a pool of `processes` workers.
+
+    Each worker assigns the flows of its shards to bundles and finds their
+    partial aggregates; these are merged in order of the shards. `view` is
+    ``(process_groups, bundles, flow_selection, columns)`` as passed to
+    `Dataset.apply_view`. There is one shard for each process by default.
+    """
+    if shards is None:
+        shards = processes
+    bounds = np.linspace(0, dataset._num_rows, shards + 1).astype(int)
+    with multiprocessing.Pool(processes, _init_worker,
+                              (dataset, view, results)) as pool:
+        for partial in pool.imap(_shard_partial, zip(bounds[:-1],
+                                                     bounds[1:])):
+            if partial is not None:
+                results.merge(partial)
+    return results
+
+
+class SharedDataset:
+    """The flows of a :class:`Dataset` published in shared memory.
+
+    ``dataset`` is a copy of the dataset whose columns (and samples) are
+    arrays in shared memory blocks. It pickles as the names of the blocks,
+    so worker processes attach to the same memory instead of receiving a
+    copy. The blocks are freed by :meth:`close` (or on leaving a ``with``
+    block), after which the shared dataset must no longer be used.
+
+    Requires Python 3.8 or later.
+    """
+
+    def __init__(self, dataset):
+        if shared_memory is None:
+            raise RuntimeError('multiprocessing.shared_memory (Python 3.8+) '
+                               'is required')
+        self._blocks = []
+        layout = [self._publish(dataset._columns),
+                  self._publish(dataset.samples)]
+        self.dataset = _attach_shared(
+            layout, dataset._dictionaries, dataset._dim_process,
+            dataset._dim_material, dataset._dim_time, blocks=self._blocks)
+
+    def _publish(self, arrays):
+        layout = OrderedDict()
+        for name, values in arrays.items():
+            values = np.ascontiguousarray(values)
+            block = shared_memory.SharedMemory(create=True,
+                                               size=max(values.nbytes, 1))
+            np.ndarray(values.shape, values.dtype, block.buf)[...] = values
+            self._blocks.append(block)
+            layout[name] = (block.name, values.dtype.str, values.shape)
+        return layout
+
+    def close(self):
+        """Free the shared memory."""
+        self.dataset = None
+        for block in self._blocks:
+            block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                # Still in use: unmapped once the arrays are released
+                pass
+        self._blocks = []
+
+    def __enter__(self):
+        return self.dataset
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _attach_shared(layout, dictionaries, dim_process, dim_material, dim_time,
+                   blocks=None):
+    """Dataset over the arrays in shared memory described by `layout`."""
+    if blocks is None:
+        blocks = []
+    attached = {block.name: block for block in blocks}
+
+    def attach(name, dtype, shape):
+        block = attached.get(name)
+        if block is None:
+            block = attached[name] = shared_memory.SharedMemory(name)
+            # The creating process is responsible for freeing the block
+            resource_tracker.unregister(block._name, 'shared_memory')
+        return np.ndarray(shape, dtype, block.buf)
+
+    columns, samples = [OrderedDict((name, attach(*entry))
+                                    for name, entry in part.items())
+                        for part in layout]
+    dataset = Dataset._from_columns(columns, dictionaries, dim_process,
+                                    dim_material, dim_time)
+    dataset.samples = samples
+    dataset._shared = (layout, dictionaries, dim_process, dim_material,
+                       dim_time)
+    # Keep the blocks open for as long as the dataset is used
+    dataset._shared_blocks = list(attached.values())
+    return dataset
+
+
+def _init_batch_worker(dataset, kwargs):
+    _worker['dataset'] = dataset
+    _worker['kwargs'] = kwargs
+
+
+def _batch_view(sankey_definition):
+    from .sankey_view import sankey_view
+    return sankey_view(sankey_definition, _worker['dataset'],
+                       **_worker['kwargs'])
+
+
+def sankey_views(sankey_definitions, dataset, processes=None, **kwargs):
+    """Results of :func:`sankey_view` for each of `sankey_definitions` (with
+    the other arguments in `kwargs`), found in a pool of `processes` worker
+    processes (by default, one per CPU). Results are returned in order.
+
+    The dataset is sent to each worker once; use a :class:`SharedDataset`
+    so that the workers share its memory rather than receiving copies.
+    """
+    with multiprocessing.Pool(processes, _init_batch_worker,
+                              (dataset, kwargs)) as pool:
+        return pool.map(_batch_view, sankey_definitions)
@@ -1,4 +1,9 @@
+import functools
+from collections import OrderedDict
+
 import attr
+import numpy as np
+import pandas as pd
 
 
 def _validate_query(instance, attribute, value):
@@ -21,6 +26,11 @@ class Partition(object):
     def labels(self):
         return [g.label for g in self.groups]
 
+    @property
+    def dimensions(self):
+        """Set of the dimensions used by the groups"""
+        return {dim for g in self.groups for dim, _ in g.query}
+
     @classmethod
     def Simple(cls, dimension, values):
         def make_group(v):
@@ -43,6 +53,15 @@ class Partition(object):
 
         return cls(groups)
 
+    def compile(self):
+        """Lookup tables assigning values to groups (see
+        :class:`CompiledPartition`), cached for hashable partitions."""
+        try:
+            hash(self)
+        except TypeError:
+            return CompiledPartition(self)
+        return _compile(self)
+
     def __add__(self, other):
         return Partition(self.groups + other.groups)
 
@@ -53,3 +72,86 @@ class Partition(object):
             for g1 in self.groups for g2 in other.groups
         ]
         return Partition(groups)
+
+
+class CompiledPartition(object):
+    """Lookup tables assigning values to the groups of a partition.
+
+    The values of each dimension are mapped to "atoms", sets of values which
+    belong to the same groups, and each combination of atoms (one from each
+    dimension) to a group, so that assigning groups takes one vectorised
+    lookup per dimension. Values in no group (or missing) map to an extra
+    atom. Raises ValueError if any combination belongs to more than one
+    group.
+    """
+
+    def __init__(self, partition):
+        groups = partition.groups
+        self.num_groups = len(groups)
+        self.dimensions = sorted(partition.dimensions)
+        self._values = []
+        self._atoms = []
+        shape = []
+
+        # Membership of each atom in each group, by dimension
+        masks = [[] for group in groups]
+        for dim in self.dimensions:
+            sets = []
+            for group in groups:
+                values = None
+                for d, v in group.query:
+                    if d == dim:
+                        values = (list(v) if values is None else
+                                  [x for x in values if x in v])
+                sets.append(values)
+
+            signatures = OrderedDict()
+            for i, values in enumerate(sets):
+                for value in values or []:
+                    signatures.setdefault(value, []).append(i)
+            atoms = OrderedDict()
+            codes = [atoms.setdefault(tuple(signature), len(atoms))
+                     for signature in signatures.values()]
+            self._values.append(pd.Index(list(signatures), dtype=object))
+            self._atoms.append(np.array(codes + [len(atoms)], dtype=int))
+            shape.append(len(atoms) + 1)
+
+            for i, values in enumerate(sets):
+                mask = np.zeros(len(atoms) + 1, dtype=bool)
+                if values is None:
+                    mask[:] = True
+                else:
+                    mask[[a for signature, a in atoms.items()
+                          if i in signature]] = True
+                masks[i].append(mask)
+
+        self._table = np.full(shape, self.num_groups, dtype=int)
+        for i, group in enumerate(groups):
+            mask = functools.reduce(np.multiply.outer, masks[i],
+                                    np.ones((), dtype=bool))
+            clash = self._table[mask & (self._table < self.num_groups)]
+            if len(clash):
+                raise ValueError('Duplicate values in groups {} and {}'
+                                 .format(groups[clash[0]], group))
+            self._table[mask] = i
+
+    def codes(self, column, n):
+        """Index of the group of each of `n` rows (`num_groups` if none),
+        where `column(dim)` gives the values of dimension `dim`."""
+        flat = np.zeros(n, dtype=int)
+        for dim, values, atoms, size in zip(self.dimensions, self._values,
+                                            self._atoms, self._table.shape):
+            data = column(dim)
+            if hasattr(data, 'cat'):
+                data = data.cat
+            if hasattr(data, 'categories'):
+                # Look up the categories, and then the codes
+                lookup = atoms[values.get_indexer(data.categories)]
+                codes = np.append(lookup, atoms[-1])[np.asarray(data.codes)]
+            else:
+                codes = atoms[values.get_indexer(np.asarray(data))]
+            flat = flat * size + codes
+        return self._table.ravel()[flat]
+
+
+_compile = functools.lru_cache(maxsize=256)(CompiledPartition)
@@ -1,5 +1,9 @@
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
 
+from .aggregation import aggregate, aggregation_columns, all_measures
 from .layered_graph import MultiLayeredGraph, Ordering
 from .partition import Partition, Group
 from .sankey_definition import ProcessGroup
@@ -10,12 +14,355 @@ def results_graph(view_graph,
                   flow_partition=None,
                   time_partition=None,
                   measure='value',
-                  agg_measures=None):
+                  agg_measures=None,
+                  samples=None):
+
+    results = results_table(view_graph, bundle_flows, flow_partition,
+                            time_partition, measure, agg_measures, samples)
+    return results.to_graph(), results.groups
+
+
+def results_table(view_graph,
+                  bundle_flows,
+                  flow_partition=None,
+                  time_partition=None,
+                  measure='value',
+                  agg_measures=None,
+                  samples=None):
+    """The results of :func:`results_graph` as a :class:`Results` table,
+    without building a networkx graph.
+
+    Measures named in `samples` are ensembles: ``samples[name]`` is a 2-D
+    array with a row of samples for each flow, indexed by the index of the
+    bundle flows (see ``Dataset.samples``). They are aggregated for all
+    samples at once. The aggregation functions are described in
+    :mod:`sankeyview.aggregation`.
+    """
+
+    if isinstance(measure, str):
+        if agg_measures is None:
+            agg_measures = {}
+        agg_all_measures = all_measures(measure, agg_measures)
+        columns = aggregation_columns(measure, agg_measures, samples)
+
+        # Aggregate the flows along all the edges at once
+        view_edges = _view_edges(view_graph, flow_partition, time_partition)
+        keys, flows = _view_flows(view_edges, bundle_flows, columns)
+        if len(flows):
+            grouped = flows.groupby(keys)
+            index = grouped.size().index
+            values = aggregate(grouped, flows, measure, agg_measures, samples)
+        else:
+            samples = samples or {}
+            index = None
+            values = {column: np.zeros((0, ) + samples[column].shape[1:])
+                      if column in samples else np.array([])
+                      for column in agg_all_measures}
+        return _results_from_index(view_graph, view_edges, time_partition,
+                                   index, values[measure], OrderedDict(
+                                       (k, values[k]) for k in agg_measures))
+
+    # Find the edges of each view graph edge in turn
+    links = []
+    for v, w, data in view_graph.edges(data=True):
+        flows = pd.concat([bundle_flows[bundle] for bundle in data['bundles']],
+                          ignore_index=True)
+        gv = view_graph.get_node(v).partition
+        gw = view_graph.get_node(w).partition
+        gf = data.get('flow_partition') or flow_partition or None
+        gt = time_partition or None
+        edges = group_flows(flows, v, gv, w, gw, gf, gt, measure, agg_measures)
+        links.extend((source, target, material, time, d, data['bundles'])
+                     for source, target, (material, time), d in edges)
+
+    source, target, material, time, data, bundles = (
+        list(x) for x in zip(*links)) if links else [[]] * 6
+    value = _object_array([d['value'] for d in data])
+    return _results(view_graph, time_partition, source, target, material,
+                    time, value, pd.DataFrame(index=range(len(data))),
+                    _object_array(bundles), _object_array(data))
+
+
+class Results:
+    """Results of a Sankey view, stored as arrays rather than as a graph.
+
+    ``node_table`` is indexed by node id, with the ``type``, ``direction``
+    and ``title`` of each node. ``link_table`` has a row for each link, with
+    the positions in ``node_table`` of its ``source`` and ``target``, its
+    ``material`` and ``time`` (as categoricals), ``value`` and ``bundles``;
+    ``measures`` holds the other aggregated measures of each link. When a
+    callable measure was used, ``link_table`` also has the ``data`` it
+    returned for each link.
+
+    If the measure is an ensemble, ``value_samples`` is a 2-D array with a
+    row of samples for each link, and ``samples`` likewise holds those of
+    the other ensemble measures; the tables hold their means. The samples
+    are used for the edge data.
+
+    ``edges()`` and ``nodes()`` work like those of the equivalent networkx
+    graph (so the results can be passed to :func:`graph_to_sankey`), and
+    :meth:`to_graph` builds the graph itself.
+    """
+
+    def __init__(self, node_table, link_table, measures, ordering, groups,
+                 value_samples=None, samples=None):
+        self.node_table = node_table
+        self.link_table = link_table
+        self.measures = measures
+        self.ordering = ordering
+        self.groups = groups
+        self.value_samples = value_samples
+        self.samples = samples or OrderedDict()
+
+    def nodes(self, data=False):
+        """List of node ids, or (id, data) pairs if `data`."""
+        ids = list(self.node_table.index)
+        if not data:
+            return ids
+        return list(zip(ids, self.node_table.to_dict('records')))
+
+    def edges(self, keys=False, data=False):
+        """List of links as ``(source, target[, (material, time)][, data])``,
+        like ``MultiDiGraph.edges``."""
+        links = self.link_table
+        ids = self.node_table.index.values
+        columns = [ids[links['source'].values], ids[links['target'].values]]
+        if keys:
+            columns.append(zip(np.asarray(links['material']),
+                               np.asarray(links['time'])))
+        if data:
+            columns.append(self._link_data())
+        return list(zip(*columns))
+
+    def _values(self, measure):
+        """Values of `measure` ("value" for the main measure) for each link,
+        as a 2-D array of samples for ensemble measures."""
+        if measure == 'value':
+            if self.value_samples is not None:
+                return self.value_samples
+            return self.link_table['value'].values
+        if measure in self.samples:
+            return self.samples[measure]
+        return self.measures[measure].values
 
-    G = MultiLayeredGraph()
+    def _link_data(self):
+        links = self.link_table
+        if 'data' in links:
+            return [dict(d, bundles=bundles) for d, bundles
+                    in zip(links['data'], links['bundles'])]
+        measures = [(k, self.samples[k] if k in self.samples
+                     else self.measures[k].values) for k in self.measures]
+        return [{
+            'value': value,
+            'measures': {k: values[i] for k, values in measures},
+            'bundles': bundles,
+        } for i, (value, bundles) in enumerate(zip(
+            self._values('value'), links['bundles']))]
+
+    def time_matrix(self, measure='value', fill_value=0):
+        """Values of `measure` with a row for each (source, target,
+        material) link and a column for each time group.
+
+        Returns `(links, times, matrix)`: `links` has the source, target and
+        material of each row (as in ``link_table``), and `times` the labels
+        of the columns, in the order of the time partition. Links with no
+        flows in a time group get `fill_value`. For ensemble measures the
+        matrix has a third axis, of samples.
+        """
+        links = self.link_table
+        values = self._values(measure)
+        materials = links['material'].cat
+        key = ((links['source'].values * len(self.node_table) +
+                links['target'].values) * (len(materials.categories) + 1) +
+               np.asarray(materials.codes))
+        rows, unique = pd.factorize(key)
+
+        # First link of each row, for its source, target and material
+        first = np.zeros(len(unique), dtype=int)
+        first[rows[::-1]] = np.arange(len(rows))[::-1]
+
+        times = links['time'].cat.categories
+        matrix = np.full((len(unique), len(times)) + values.shape[1:],
+                         fill_value, dtype=np.result_type(values, fill_value))
+        matrix[rows, np.asarray(links['time'].cat.codes)] = values
+        row_links = links[['source', 'target', 'material']].iloc[first]
+        return row_links.reset_index(drop=True), times, matrix
+
+    def to_graph(self):
+        """The results as a :class:`MultiLayeredGraph`."""
+        G = MultiLayeredGraph()
+        G.add_nodes_from(self.nodes(data=True))
+        G.add_edges_from(self.edges(keys=True, data=True))
+        G.ordering = self.ordering
+        return G
+
+
+def _view_edges(view_graph, flow_partition, time_partition):
+    """The edges of `view_graph`, as (data, partitions) where `partitions`
+    gives the (partition, process side, label prefix) of keys k1-k4."""
+    edges = []
+    for v, w, data in view_graph.edges(data=True):
+        partitions = [
+            (view_graph.get_node(v).partition, 'source', v + '^'),
+            (view_graph.get_node(w).partition, 'target', w + '^'),
+            (data.get('flow_partition') or flow_partition or None, None, ''),
+            (time_partition or None, None, ''),
+        ]
+        edges.append((data, partitions))
+    return edges
+
+
+def _view_flows(view_edges, bundle_flows, columns):
+    """The flows along each of `view_edges`, tagged with the edge and keys.
+
+    Returns `(keys, flows)`: `keys` holds the index of the edge and the codes
+    of keys k1-k4 of each row of `flows`, which has `columns` (and the index)
+    of the bundle flows of each edge in turn. Partition keys are only found
+    once for each flow, however many edges it runs along.
+    """
+    codes = {}
+
+    def partition_codes(bundle, partition, side):
+        key = (bundle, id(partition), side)
+        if key not in codes:
+            codes[key] = _partition_codes(bundle_flows[bundle], partition,
+                                          side)
+        return codes[key]
+
+    edge_index = []
+    flow_index = []
+    key_codes = [[] for i in range(4)]
+    values = {column: [] for column in columns}
+    for i, (data, partitions) in enumerate(view_edges):
+        for bundle in data['bundles']:
+            flows = bundle_flows[bundle]
+            edge_index.append(np.full(len(flows), i, dtype=int))
+            flow_index.append(flows.index.values)
+            for k, (partition, side, _) in enumerate(partitions):
+                key_codes[k].append(partition_codes(bundle, partition, side))
+            for column in columns:
+                values[column].append(flows[column].values)
+
+    keys = [np.concatenate(x) if x else np.array([], dtype=int)
+            for x in [edge_index] + key_codes]
+    flows = pd.DataFrame({column: np.concatenate(x) if x else []
+                          for column, x in values.items()},
+                         index=np.concatenate(flow_index) if flow_index
+                         else None, columns=list(columns))
+    return keys, flows
+
+
+def _results_from_index(view_graph, view_edges, time_partition, index, value,
+                        measures):
+    """Results for the links in `index`, which holds the view edge index and
+    key codes (or is None if there are none), with `value` and the other
+    `measures` (a dict of arrays) of each link."""
+    if index is None:
+        edge = np.array([], dtype=int)
+        codes = [edge] * 4
+    else:
+        edge = index.get_level_values(0).values
+        codes = [index.get_level_values(k + 1).values for k in range(4)]
+
+    # Look up the labels of each key in a table of the labels for all the
+    # edges, offset by edge
+    labels = []
+    for k in range(4):
+        tables = [_partition_labels(partitions[k][0], partitions[k][2])
+                  for _, partitions in view_edges]
+        offsets = np.cumsum([0] + [len(table) for table in tables])
+        table = np.concatenate([table.values for table in tables] +
+                               [np.array([], dtype=object)])
+        labels.append(table[offsets[edge] + codes[k]])
+
+    # The links of each edge are sorted by their labels, not by their codes
+    order = np.lexsort([pd.factorize(x, sort=True)[0] for x in labels[::-1]] +
+                       [edge])
+    edge = edge[order]
+    labels = [x[order] for x in labels]
+    value = np.asarray(value)[order]
+    measures = OrderedDict((k, np.asarray(values)[order])
+                           for k, values in measures.items())
+
+    # Ensemble measures are kept as 2-D arrays; the tables hold their means
+    value_samples = value if np.ndim(value) == 2 else None
+    samples = OrderedDict((k, values) for k, values in measures.items()
+                          if np.ndim(values) == 2)
+    measures = pd.DataFrame(OrderedDict(
+        (k, values.mean(axis=1) if k in samples else values)
+        for k, values in measures.items()), index=range(len(edge)),
+                            columns=list(measures))
+    if value_samples is not None:
+        value = value_samples.mean(axis=1)
+
+    bundles = _object_array([data['bundles'] for data, _ in view_edges])
+    return _results(view_graph, time_partition, *labels, value=value,
+                    measures=measures, bundles=bundles[edge],
+                    value_samples=value_samples, samples=samples)
+
+
+def _results(view_graph, time_partition, source, target, material, time,
+             value, measures, bundles, data=None, value_samples=None,
+             samples=None):
+    """Results for links given by the labels of their `source`, `target`,
+    `material` and `time`, with unused nodes removed."""
+    node_ids, node_data, layers, groups = _results_nodes(view_graph)
+    nodes = pd.Index(node_ids, dtype=object)
+    source = nodes.get_indexer(source)
+    target = nodes.get_indexer(target)
+
+    # remove unused nodes
+    used = np.zeros(len(nodes), dtype=bool)
+    used[source] = True
+    used[target] = True
+    unused = set(nodes[~used])
+    ordering = Ordering(layers).remove_many(unused)
+    position = np.cumsum(used) - 1
+
+    # remove unused nodes from groups
+    groups = [
+        dict(g, nodes=[x for x in g['nodes'] if x not in unused])
+        for g in groups
+    ]
+    groups = [g for g in groups if len(g['nodes']) > 0]
+
+    # Time groups in the order of the partition (other values only if used)
+    time = np.asarray(time, dtype=object)
+    times = _partition_labels(time_partition, '')
+    times = times[(times != '_') | times.isin(time)]
+
+    node_table = pd.DataFrame(node_data, index=nodes,
+                              columns=['type', 'direction', 'title'])[used]
+    link_table = pd.DataFrame(OrderedDict([
+        ('source', position[source]),
+        ('target', position[target]),
+        ('material', pd.Categorical(np.asarray(material, dtype=object))),
+        ('time', pd.Categorical(time, categories=times)),
+        ('value', value),
+        ('bundles', bundles),
+    ]), columns=['source', 'target', 'material', 'time', 'value', 'bundles'])
+    if data is not None:
+        link_table['data'] = data
+    return Results(node_table, link_table, measures, ordering, groups,
+                   value_samples, samples)
+
+
+def _object_array(items):
+    """1-d object array of `items` (which may themselves be sequences)."""
+    array = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        array[i] = item
+    return array
+
+
+def _results_nodes(view_graph):
+    """The nodes of the results for `view_graph`, as lists of node ids and
+    data, the layers of their ordering, and the list of node groups."""
+    node_ids = []
+    node_data = []
     groups = []
 
-    # Add nodes to graph and to order
+    # Add nodes to table and to order
     layers = []
     for r, bands in enumerate(view_graph.ordering.layers):
         o = [[] for band in bands]
@@ -30,7 +377,8 @@ def results_graph(view_graph,
                         title = u if node.title is None else node.title
                     else:
                         title = xtitle
-                    G.add_node(x, {
+                    node_ids.append(x)
+                    node_data.append({
                         'type': ('process' if isinstance(node, ProcessGroup)
                                  else 'group'),
                         'direction': node.direction,
@@ -45,34 +393,136 @@ def results_graph(view_graph,
                 })
         layers.append(o)
 
-    G.ordering = Ordering(layers)
+    return node_ids, node_data, layers, groups
 
-    # Add edges to graph
-    for v, w, data in view_graph.edges(data=True):
-        flows = pd.concat([bundle_flows[bundle] for bundle in data['bundles']],
-                          ignore_index=True)
-        gv = view_graph.get_node(v).partition
-        gw = view_graph.get_node(w).partition
-        gf = data.get('flow_partition') or flow_partition or None
-        gt = time_partition or None
-        edges = group_flows(flows, v, gv, w, gw, gf, gt, measure, agg_measures)
-        for _, _, _, d in edges:
-            d['bundles'] = data['bundles']
-        G.add_edges_from(edges)
 
-    # remove unused nodes
-    unused = [u for u, deg in G.degree_iter() if deg == 0]
-    for u in unused:
-        G.remove_node(u)
+# How the partial aggregates of each chunk are calculated and combined, for
+# the aggregation functions that can be calculated a chunk at a time
+_PARTIAL_AGGREGATES = {
+    'sum': [('sum', 'sum')],
+    'count': [('count', 'sum')],
+    'min': [('min', 'min')],
+    'max': [('max', 'max')],
+    'mean': [('sum', 'sum'), ('count', 'sum')],
+}
 
-    # remove unused nodes from groups
-    groups = [
-        dict(g, nodes=[x for x in g['nodes'] if x not in unused])
-        for g in groups
-    ]
-    groups = [g for g in groups if len(g['nodes']) > 0]
 
-    return G, groups
+def _partial_column(column, func):
+    """Name of the column holding partial aggregate `func` of `column`."""
+    return '{}:{}'.format(column, func)
+
+
+class ChunkedResults:
+    """Builds the results graph from bundle flows given a chunk at a time.
+
+    Only running partial aggregates are kept for each edge of the results
+    graph, so the memory needed does not depend on the number of flows.
+    The aggregation functions must be those in ``_PARTIAL_AGGREGATES``.
+    """
+
+    def __init__(self,
+                 view_graph,
+                 flow_partition=None,
+                 time_partition=None,
+                 measure='value',
+                 agg_measures=None):
+        if not isinstance(measure, str):
+            raise ValueError('measure must be a column name to aggregate '
+                             'in chunks')
+        if agg_measures is None:
+            agg_measures = {}
+        agg_all_measures = all_measures(measure, agg_measures)
+        for column, func in agg_all_measures.items():
+            if func not in _PARTIAL_AGGREGATES:
+                raise ValueError('Cannot aggregate "{}" in chunks using {!r}'
+                                 .format(column, func))
+
+        self.view_graph = view_graph
+        self.flow_partition = flow_partition
+        self.time_partition = time_partition
+        self.measure = measure
+        self.agg_measures = agg_measures
+        self.agg_all_measures = agg_all_measures
+
+        # (column, partial aggregate function, combining function)
+        self._partials = [(column, partial, combine)
+                          for column, func in sorted(agg_all_measures.items())
+                          for partial, combine in _PARTIAL_AGGREGATES[func]]
+        self._view_edges = _view_edges(view_graph, flow_partition,
+                                       time_partition)
+        self._total = None
+
+    def add(self, bundle_flows, aggregated=False):
+        """Add the flows in a chunk (as returned by `Dataset.apply_view`).
+
+        If `aggregated`, the flows hold partial aggregates (see
+        :class:`~sankeyview.cube.Cube`) rather than the measures themselves.
+        """
+        partial = self.partial(bundle_flows, aggregated)
+        if partial is not None:
+            self.merge(partial)
+
+    def partial(self, bundle_flows, aggregated=False):
+        """Partial aggregates of the flows in a chunk (see :meth:`add`), or
+        None if there are none. They can be found in another process, and
+        passed to :meth:`merge`."""
+        if aggregated:
+            columns = [_partial_column(column, func)
+                       for column, func, _ in self._partials]
+        else:
+            columns = [column for column, _, _ in self._partials]
+        columns = list(OrderedDict.fromkeys(columns))
+        keys, flows = _view_flows(self._view_edges, bundle_flows, columns)
+        if len(flows) == 0:
+            return None
+
+        grouped = flows.groupby(keys)
+        if aggregated:
+            partials = [grouped[_partial_column(column, func)].agg(combine)
+                        for column, func, combine in self._partials]
+        else:
+            partials = [grouped[column].agg(func)
+                        for column, func, _ in self._partials]
+        return pd.concat(partials, axis=1, keys=range(len(self._partials)))
+
+    def merge(self, partial):
+        """Combine the partial aggregates from :meth:`partial` with the
+        running totals."""
+        if self._total is not None:
+            grouped = pd.concat([self._total, partial]).groupby(
+                level=list(range(partial.index.nlevels)))
+            partial = pd.concat([grouped[i].agg(combine)
+                                 for i, (_, _, combine)
+                                 in enumerate(self._partials)],
+                                axis=1, keys=range(len(self._partials)))
+        self._total = partial
+
+    def _aggregate(self, total, column):
+        """Final aggregate of `column` from the combined partials."""
+        i = [k for k, p in enumerate(self._partials) if p[0] == column]
+        if self.agg_all_measures[column] == 'mean':
+            return (total[i[0]] / total[i[1]]).values
+        return total[i[0]].values
+
+    def results(self):
+        """The results graph and groups, as from :func:`results_graph`."""
+        results = self.table()
+        return results.to_graph(), results.groups
+
+    def table(self):
+        """The results as a :class:`Results` table."""
+        if self._total is None:
+            index = None
+            values = {column: np.array([])
+                      for column in self.agg_all_measures}
+        else:
+            index = self._total.index
+            values = {column: self._aggregate(self._total, column)
+                      for column in self.agg_all_measures}
+        return _results_from_index(
+            self.view_graph, self._view_edges, self.time_partition, index,
+            values[self.measure],
+            OrderedDict((k, values[k]) for k in self.agg_measures))
 
 
 def nodes_from_partition(u, partition):
@@ -94,51 +544,87 @@ def group_flows(flows,
                 measure,
                 agg_measures=None):
 
-    if callable(measure):
-        data = measure
-    elif isinstance(measure, str):
-        if agg_measures is None:
-            agg_measures = {}
-        agg_all_measures = dict(agg_measures)
-        agg_all_measures[measure] = 'sum'
-        def data(group):
-            agg = group.groupby(lambda x: '').agg(agg_all_measures)
-            return {
-                'value': agg[measure].iloc[0],
-                'measures': {k: agg[k].iloc[0] for k in agg_measures},
-            }
-    else:
+    if not (callable(measure) or isinstance(measure, str)):
         raise ValueError('measure must be string or callable')
 
     e = flows.copy()
+    keys = _set_keys(e, v, partition1, w, partition2, flow_partition,
+                     time_partition)
+
+    # Group by the key codes; the labels are only needed for the results
+    grouped = e.groupby([k.codes for k in keys])
+
+    def labels(codes):
+        source, target, material, time = (
+            k.categories[c] for k, c in zip(keys, codes))
+        return source, target, (material, time)
+
+    # In the order of the labels, as when grouping by them
+    def by_label(edge):
+        return edge[:3]
+
+    if callable(measure):
+        return sorted((labels(codes) + (measure(group), )
+                       for codes, group in grouped), key=by_label)
+
+    if len(e) == 0:
+        return []
+    if agg_measures is None:
+        agg_measures = {}
+
+    # Aggregate all the groups at once
+    values = aggregate(grouped, e, measure, agg_measures)
+    edges = []
+    for i, codes in enumerate(grouped.size().index):
+        edges.append(labels(codes) + ({
+            'value': values[measure][i],
+            'measures': {k: values[k][i] for k in agg_measures},
+        }, ))
+    return sorted(edges, key=by_label)
+
+
+def _set_keys(e, v, partition1, w, partition2, flow_partition,
+              time_partition):
+    """Add the partition keys k1-k4 to `e`, returning their categoricals."""
     set_partition_keys(e, partition1, 'k1', v + '^', process_side='source')
     set_partition_keys(e, partition2, 'k2', w + '^', process_side='target')
     set_partition_keys(e, flow_partition, 'k3', '')
     set_partition_keys(e, time_partition, 'k4', '')
-    grouped = e.groupby(['k1', 'k2', 'k3', 'k4'])
-
-    return [
-        (source, target, (material, time), data(group))
-        for (source, target, material, time), group in grouped
-    ]
+    return [e[k].cat for k in ('k1', 'k2', 'k3', 'k4')]
 
 
 def set_partition_keys(df, partition, key_column, prefix, process_side=None):
+    """Add `key_column` to `df`, giving the label of the group of
+    `partition` each row belongs to (prefixed by `prefix`).
+
+    The key is categorical, so that grouping by it works on integer codes.
+    """
+    codes = _partition_codes(df, partition, process_side)
+    df[key_column] = pd.Categorical.from_codes(
+        codes, _partition_labels(partition, prefix))
+
+
+def _partition_labels(partition, prefix):
+    """Distinct labels of the groups of `partition` (prefixed by `prefix`),
+    followed by the label for other values if it is distinct."""
     if partition is None:
         partition = Partition([Group('*', [])])
-    df[key_column] = prefix + '_'  # other
-    seen = (df.index != df.index)  # False
-    for group in partition.groups:
-        q = (df.index == df.index)  # True
-        for dim, values in group.query:
-            if dim.startswith('process') and process_side:
-                dim = process_side + dim[7:]
-            q = q & df[dim].isin(values)
-        if any(q & seen):
-            dup = df[q & seen]
-            raise ValueError('Duplicate values in group {} ({}): {}'
-                             .format(group, process_side, ', '.join(
-                                 ['{}-{}'.format(e.source, e.target)
-                                  for _, e in dup.iterrows()])))
-        df.loc[q, key_column] = prefix + str(group.label)
-        seen = seen | q
+    labels = [prefix + str(group.label) for group in partition.groups]
+    return pd.Index(labels + [prefix + '_']).unique()
+
+
+def _partition_codes(df, partition, process_side=None):
+    """Codes in `_partition_labels(partition)` of the group of `partition`
+    each row of `df` belongs to."""
+    if partition is None:
+        partition = Partition([Group('*', [])])
+
+    def column(dim):
+        if dim.startswith('process') and process_side:
+            dim = process_side + dim[7:]
+        return df[dim]
+
+    codes = partition.compile().codes(column, len(df))
+    labels = pd.Index([str(group.label) for group in partition.groups] +
+                      ['_'])
+    return labels.unique().get_indexer(labels)[codes]
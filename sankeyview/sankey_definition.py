@@ -2,6 +2,7 @@ import attr
 
 from . import sentinel
 from .ordering import Ordering
+from .selection import compile_selection
 
 # SankeyDefinition
 
@@ -69,6 +70,44 @@ class SankeyDefinition(object):
                               self.ordering, self.flow_partition,
                               self.flow_selection, self.time_partition)
 
+    def referenced_columns(self):
+        """Set of dataset columns referenced by selections and partitions.
+
+        Process dimensions (``process`` and ``process.*``) are given for both
+        the source and target of flows.
+        """
+        columns = set()
+
+        def add_selection(sel, column):
+            if isinstance(sel, str):
+                columns.update(compile_selection(sel, column).columns)
+            elif sel is not None:
+                columns.add(column)
+
+        def add_partition(partition):
+            if partition is None:
+                return
+            for dim in partition.dimensions:
+                if dim == 'process' or dim.startswith('process.'):
+                    columns.add('source' + dim[7:])
+                    columns.add('target' + dim[7:])
+                else:
+                    columns.add(dim)
+
+        for node in self.nodes.values():
+            if isinstance(node, ProcessGroup):
+                add_selection(node.selection, 'source')
+                add_selection(node.selection, 'target')
+            add_partition(node.partition)
+        for bundle in self.bundles.values():
+            add_selection(bundle.flow_selection, '')
+            add_partition(bundle.flow_partition)
+            add_partition(bundle.default_partition)
+        add_selection(self.flow_selection, '')
+        add_partition(self.flow_partition)
+        add_partition(self.time_partition)
+        return columns
+
 # ProcessGroup
 
 
@@ -1,15 +1,32 @@
 import pandas as pd
 
-from .dataset import Dataset
+from .dataset import Dataset, ChunkedDataset
 from .augment_view_graph import augment, elsewhere_bundles
 from .view_graph import view_graph
-from .results_graph import results_graph
+from .aggregation import aggregation_columns, all_measures
+from .results_graph import results_table, ChunkedResults, _PARTIAL_AGGREGATES
+from .parallel import sharded_results
 
 
 def sankey_view(sankey_definition,
                 dataset,
                 measure='value',
-                agg_measures=None):
+                agg_measures=None,
+                as_graph=True,
+                processes=None):
+    """The results graph and groups for `sankey_definition` applied to
+    `dataset`, or a :class:`~sankeyview.results_graph.Results` table if not
+    `as_graph`.
+
+    If `processes` is given, the flows are split into shards of rows which
+    are aggregated by a pool of that many worker processes (see
+    :func:`~sankeyview.parallel.sharded_results`). This is only possible for
+    sums, counts, means, minima and maxima of columns of flows: other
+    aggregation functions, a callable `measure`, and measures with samples
+    (see ``Dataset.samples``) are aggregated serially. Sums of floats may
+    differ from the serial results in the last bits, as they are added in
+    another order.
+    """
 
     # Accept DataFrames as datasets -- assume it's the flow table
     if isinstance(dataset, pd.DataFrame):
@@ -26,16 +43,77 @@ def sankey_view(sankey_definition,
     # XXX messy
     bundles2 = dict(sankey_definition.bundles, **new_bundles)
 
-    # Get the flows selected by the bundles
+    # Get the flows selected by the bundles, joining only the dimension
+    # columns that will be used (a callable measure could use any of them)
+    if callable(measure):
+        columns = None
+    else:
+        columns = sankey_definition.referenced_columns()
+        columns.update(aggregation_columns(measure, agg_measures))
+
+    chunks, aggregated = None, False
+    if isinstance(dataset, ChunkedDataset):
+        # Aggregate the flows a chunk at a time, keeping only the totals
+        chunks = dataset.chunks(columns)
+    elif dataset.cube is not None:
+        # Use the pre-aggregated measures, if they are enough
+        level = dataset.cube.level_for(sankey_definition, measure,
+                                       agg_measures)
+        if level is not None:
+            chunks, aggregated = [level], True
+
+    if chunks is None and processes and not _can_shard(dataset, measure,
+                                                       agg_measures):
+        # The workers can only combine the partial aggregates of columns of
+        # flows, so anything else is aggregated serially
+        processes = None
+
+    if chunks is not None or processes:
+        results = ChunkedResults(
+            GV2,
+            flow_partition=sankey_definition.flow_partition,
+            time_partition=sankey_definition.time_partition,
+            measure=measure,
+            agg_measures=agg_measures)
+        if chunks is None:
+            # Aggregate shards of the flows in parallel
+            view = (sankey_definition.nodes, bundles2,
+                    sankey_definition.flow_selection, columns)
+            sharded_results(dataset, results, view, processes)
+        for chunk in chunks or []:
+            bundle_flows, _ = chunk.apply_view(
+                sankey_definition.nodes, bundles2,
+                sankey_definition.flow_selection, columns)
+            results.add(bundle_flows, aggregated)
+        return _results(results.table(), as_graph)
+
     bundle_flows, unused_flows = dataset.apply_view(
-        sankey_definition.nodes, bundles2, sankey_definition.flow_selection)
+        sankey_definition.nodes, bundles2, sankey_definition.flow_selection,
+        columns)
 
     # Calculate the results graph (actual Sankey data)
-    GR, groups = results_graph(GV2,
-                               bundle_flows,
-                               flow_partition=sankey_definition.flow_partition,
-                               time_partition=sankey_definition.time_partition,
-                               measure=measure,
-                               agg_measures=agg_measures)
-
-    return GR, groups
+    results = results_table(GV2,
+                            bundle_flows,
+                            flow_partition=sankey_definition.flow_partition,
+                            time_partition=sankey_definition.time_partition,
+                            measure=measure,
+                            agg_measures=agg_measures,
+                            samples=dataset.samples)
+    return _results(results, as_graph)
+
+
+def _can_shard(dataset, measure, agg_measures):
+    """Whether the measures can be aggregated by `sharded_results`."""
+    if callable(measure):
+        return False
+    if any(column in dataset.samples
+           for column in aggregation_columns(measure, agg_measures)):
+        return False
+    return all(isinstance(func, str) and func in _PARTIAL_AGGREGATES
+               for func in all_measures(measure, agg_measures).values())
+
+
+def _results(results, as_graph):
+    if as_graph:
+        return results.to_graph(), results.groups
+    return results
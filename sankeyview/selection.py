@@ -0,0 +1,457 @@
+"""Compiled selection expressions.
+
+Selections given as strings (e.g. ``'function == "a" and id in ["a1"]'``) use
+the same syntax as :meth:`pandas.DataFrame.eval`. Rather than going back
+through the pandas expression parser every time a selection is evaluated, the
+expression is parsed once into a :class:`Selection`, which can then be applied
+to any number of tables to give a vectorised boolean mask. Expressions using
+anything else (such as function or method calls) are still evaluated by
+pandas.
+"""
+
+import ast
+import io
+import operator
+import tokenize
+
+import numpy as np
+import pandas as pd
+
+
+def resolve_column(column, name):
+    """Name of the table column referred to by `name` in a selection.
+
+    Names are relative to `column`: ``id`` refers to `column` itself, and
+    anything else to the attribute ``'{column}.{name}'``. If `column` is
+    empty, names refer directly to table columns.
+    """
+    if not column:
+        return name
+    elif name == 'id':
+        return column
+    else:
+        return '{}.{}'.format(column, name)
+
+
+class Encoded:
+    """Dictionary-encoded values: element i is ``values[codes[i]]``, or
+    missing where the code is -1.
+
+    Comparisons against an `Encoded` operand are evaluated once per entry of
+    `values`, and the result looked up by code.
+    """
+
+    def __init__(self, codes, values):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def decode(self):
+        """The values as a plain array."""
+        if len(self.codes) and self.codes.min() < 0:
+            return pd.Series(self.values).reindex(self.codes).values
+        return self.values.take(self.codes)
+
+    def lookup(self, func):
+        """Apply `func` to the dictionary values and look up the result."""
+        result = np.asarray(func(pd.Series(self.values)), dtype=bool)
+        # Code -1 (missing) picks up the result for NaN, at the end
+        try:
+            missing = func(pd.Series([np.nan], dtype=object))
+            missing = bool(np.asarray(missing, dtype=bool)[0])
+        except TypeError:
+            missing = False
+        return np.append(result, missing)[self.codes]
+
+
+_ARRAY_TYPES = (pd.Series, pd.Index, pd.Categorical, np.ndarray, Encoded)
+
+
+def _isin(x, y):
+    if isinstance(x, _ARRAY_TYPES):
+        if not isinstance(y, _ARRAY_TYPES):
+            y = list(y)
+        return pd.Series(x).isin(y).values
+    if isinstance(y, _ARRAY_TYPES):
+        return pd.Series(y).isin([x]).values
+    return x in y
+
+
+def _eq(x, y):
+    if isinstance(y, list):
+        return _isin(x, y)
+    if isinstance(x, list):
+        return _isin(y, x)
+    return x == y
+
+
+def _ne(x, y):
+    return _not(_eq(x, y))
+
+
+def _not_in(x, y):
+    return _not(_isin(x, y))
+
+
+def _not(x):
+    if isinstance(x, bool):
+        return not x
+    return ~x
+
+
+def _values(x):
+    if isinstance(x, pd.Series) and hasattr(x, 'cat'):
+        x = x.values
+    if isinstance(x, pd.Categorical):
+        return Encoded(x.codes, x.categories.values)
+    return x.values if isinstance(x, (pd.Series, pd.Index)) else x
+
+
+def _decode(x):
+    return x.decode() if isinstance(x, Encoded) else x
+
+
+def _on_categories(op):
+    """Apply comparison `op` to the dictionary of an encoded operand, rather
+    than comparing every value."""
+    def compare(x, y):
+        if isinstance(x, Encoded) and not isinstance(y, _ARRAY_TYPES):
+            return x.lookup(lambda values: op(values, y))
+        if isinstance(y, Encoded) and not isinstance(x, _ARRAY_TYPES):
+            return y.lookup(lambda values: op(x, values))
+        return op(_comparable(_decode(x)), _comparable(_decode(y)))
+    return compare
+
+
+def _comparable(x):
+    # Compare objects and datetimes as pandas does: missing values compare
+    # False, and datetimes can be compared to strings
+    if isinstance(x, np.ndarray) and x.dtype.kind in 'OmM':
+        return pd.Series(x)
+    return x
+
+
+def _on_values(op):
+    return lambda x, y: op(_decode(x), _decode(y))
+
+
+_COMPARISONS = {
+    ast.Eq: _on_categories(_eq),
+    ast.NotEq: _on_categories(_ne),
+    ast.Lt: _on_categories(operator.lt),
+    ast.LtE: _on_categories(operator.le),
+    ast.Gt: _on_categories(operator.gt),
+    ast.GtE: _on_categories(operator.ge),
+    ast.In: _on_categories(_isin),
+    ast.NotIn: _on_categories(_not_in),
+}
+
+_BINARY_OPERATORS = {
+    ast.BitAnd: _on_values(operator.and_),
+    ast.BitOr: _on_values(operator.or_),
+    ast.Add: _on_values(operator.add),
+    ast.Sub: _on_values(operator.sub),
+    ast.Mult: _on_values(operator.mul),
+    ast.Div: _on_values(operator.truediv),
+    ast.FloorDiv: _on_values(operator.floordiv),
+    ast.Mod: _on_values(operator.mod),
+    ast.Pow: _on_values(operator.pow),
+}
+
+_UNARY_OPERATORS = {
+    ast.Not: lambda x: _not(_decode(x)),
+    ast.Invert: lambda x: _not(_decode(x)),
+    ast.USub: lambda x: -_decode(x),
+    ast.UAdd: lambda x: +_decode(x),
+}
+
+_CONSTANTS = {'True': True, 'False': False, 'None': None}
+
+_REVERSED_COMPARISONS = {
+    ast.Eq: ast.Eq,
+    ast.NotEq: ast.NotEq,
+    ast.Lt: ast.Gt,
+    ast.LtE: ast.GtE,
+    ast.Gt: ast.Lt,
+    ast.GtE: ast.LtE,
+}
+
+
+_BOOLEAN_OPERATORS = {'&': 'and', '|': 'or'}
+
+
+def _replace_booleans(expression):
+    """Replace ``&`` and ``|`` by ``and`` and ``or``, as pandas does, so that
+    they have a lower precedence than comparisons."""
+    tokens = tokenize.generate_tokens(io.StringIO(expression).readline)
+    return tokenize.untokenize(
+        (tokenize.NAME, _BOOLEAN_OPERATORS[string])
+        if kind == tokenize.OP and string in _BOOLEAN_OPERATORS
+        else (kind, string)
+        for kind, string, _, _, _ in tokens)
+
+
+class Summary:
+    """What is known about the values of a column in part of a table: either
+    the set of distinct `values`, or a range from `lower` to `upper`
+    (`has_missing` says whether there are missing values too).
+
+    Used to rule out parts of a table without evaluating a selection.
+    """
+
+    def __init__(self, values=None, lower=None, upper=None,
+                 has_missing=False):
+        self.values = values
+        self.lower = lower
+        self.upper = upper
+        self.has_missing = has_missing
+
+    def may_compare(self, op, value):
+        """Whether `column <op> value` might be true, for an ast comparison
+        operator class `op`."""
+        try:
+            if self.values is not None:
+                values = np.asarray(self.values, dtype=object)
+                return bool(np.any(_COMPARISONS[op](values, value)))
+            return self._may_compare_range(op, value)
+        except TypeError:
+            return True
+
+    def _may_compare_range(self, op, value):
+        lower, upper = self.lower, self.upper
+        if lower is None or upper is None:
+            return op in (ast.NotEq, ast.NotIn)
+        is_list = isinstance(value, (list, tuple))
+        if op is ast.Eq and is_list:
+            op = ast.In
+
+        if op is ast.Eq:
+            return lower <= value <= upper
+        elif op is ast.In:
+            return any(lower <= v <= upper for v in value)
+        elif op is ast.NotEq and not is_list:
+            return self.has_missing or not (lower == upper == value)
+        elif op in (ast.NotEq, ast.NotIn):
+            return self.has_missing or not (lower == upper and lower in value)
+        elif op is ast.Lt:
+            return lower < value
+        elif op is ast.LtE:
+            return lower <= value
+        elif op is ast.Gt:
+            return upper > value
+        elif op is ast.GtE:
+            return upper >= value
+        return True
+
+
+class Selection:
+    """A selection expression, compiled once and evaluated many times.
+
+    `column` is the prefix used to resolve names in the expression, as in
+    :func:`resolve_column`: ``'source'``, ``'target'`` or ``''``.
+    """
+
+    def __init__(self, expression, column=''):
+        self.expression = expression
+        self.column = column
+        self.columns = set()
+        try:
+            tree = ast.parse(_replace_booleans(expression.strip()),
+                             mode='eval')
+        except (SyntaxError, tokenize.TokenError) as err:
+            raise ValueError('Invalid selection "{}": {}'
+                             .format(expression, err)) from None
+        self._tree = tree.body
+        try:
+            self._evaluate = self._compile(tree.body)
+        except ValueError:
+            self._evaluate = self._compile_pandas(tree.body)
+
+    def __repr__(self):
+        return 'Selection({!r}, {!r})'.format(self.expression, self.column)
+
+    def __call__(self, df):
+        """Evaluate the selection against `df`, giving a boolean Series."""
+        return self.evaluate(df.__getitem__, df.index)
+
+    def evaluate(self, get, index):
+        """Evaluate the selection, looking up columns with `get(name)`.
+
+        `get` may return arrays, Series or :class:`Encoded` values. Returns a
+        boolean Series with the given `index`.
+        """
+        result = _decode(self._evaluate(lambda name: _values(get(name))))
+        if np.ndim(result) == 0:
+            result = np.full(len(index), bool(result))
+        return pd.Series(np.asarray(result, dtype=bool), index=index)
+
+    def may_match(self, summarise):
+        """Whether the selection might be true for any row in part of a table.
+
+        `summarise(name)` gives a :class:`Summary` of the values of column
+        `name` in that part of the table, or None if nothing is known. The
+        answer is conservative: False means no row can match.
+        """
+        return self._may_match(self._tree, summarise) is not False
+
+    def _may_match(self, node, summarise):
+        # Returns False if no row can match, and None if unsure
+        if isinstance(node, ast.BoolOp):
+            results = [self._may_match(v, summarise) for v in node.values]
+            if isinstance(node.op, ast.And):
+                return False if False in results else None
+            else:
+                return False if all(r is False for r in results) else None
+
+        elif isinstance(node, ast.Compare):
+            operands = [node.left] + list(node.comparators)
+            for i, op in enumerate(node.ops):
+                left, right = operands[i], operands[i + 1]
+                if self._may_compare(left, type(op), right,
+                                     summarise) is False:
+                    return False
+            return None
+
+        elif isinstance(node, (ast.Name, ast.Attribute)):
+            name = self._dotted_name(node)
+            return False if _CONSTANTS.get(name, True) is False else None
+
+        else:
+            try:
+                value = self._literal(node)
+            except ValueError:
+                return None
+            return None if value else False
+
+    def _may_compare(self, left, op, right, summarise):
+        if not isinstance(left, (ast.Name, ast.Attribute)):
+            # Put the column on the left
+            left, right = right, left
+            op = _REVERSED_COMPARISONS.get(op)
+        if op is None or not isinstance(left, (ast.Name, ast.Attribute)):
+            return None
+        try:
+            value = self._literal(right)
+            name = resolve_column(self.column, self._dotted_name(left))
+        except ValueError:
+            return None
+        summary = summarise(name)
+        if summary is None:
+            return None
+        return None if summary.may_compare(op, value) else False
+
+    def _compile(self, node):
+        if isinstance(node, ast.BoolOp):
+            op = _on_values(operator.and_ if isinstance(node.op, ast.And)
+                            else operator.or_)
+            return self._reduce(op, [self._compile(v) for v in node.values])
+
+        elif isinstance(node, ast.UnaryOp):
+            op = self._lookup(_UNARY_OPERATORS, node.op)
+            operand = self._compile(node.operand)
+            return lambda get: op(operand(get))
+
+        elif isinstance(node, ast.BinOp):
+            op = self._lookup(_BINARY_OPERATORS, node.op)
+            left = self._compile(node.left)
+            right = self._compile(node.right)
+            return lambda get: op(left(get), right(get))
+
+        elif isinstance(node, ast.Compare):
+            operands = [self._compile(node.left)] + \
+                       [self._compile(c) for c in node.comparators]
+            tests = []
+            for i, op in enumerate(node.ops):
+                tests.append(self._comparison(self._lookup(_COMPARISONS, op),
+                                              operands[i], operands[i + 1]))
+            return self._reduce(operator.and_, tests)
+
+        elif isinstance(node, (ast.Name, ast.Attribute)):
+            name = self._dotted_name(node)
+            if name in _CONSTANTS:
+                return self._constant(_CONSTANTS[name])
+            col = resolve_column(self.column, name)
+            self.columns.add(col)
+            return lambda get: get(col)
+
+        elif isinstance(node, (ast.List, ast.Tuple)):
+            values = [self._literal(elt) for elt in node.elts]
+            return self._constant(values)
+
+        else:
+            return self._constant(self._literal(node))
+
+    def _compile_pandas(self, tree):
+        """Evaluate the expression with :meth:`pandas.DataFrame.eval`, given
+        a table of the columns it names."""
+        functions = {id(node.func) for node in ast.walk(tree)
+                     if isinstance(node, ast.Call)}
+        names = {node.id for node in ast.walk(tree)
+                 if isinstance(node, ast.Name) and id(node) not in functions
+                 and node.id not in _CONSTANTS}
+        columns = {name: resolve_column(self.column, name) for name in names}
+        self.columns = set(columns.values())
+        expression = self.expression
+
+        def evaluate(get):
+            df = pd.DataFrame({name: _decode(get(col))
+                               for name, col in columns.items()})
+            return np.asarray(df.eval(expression, local_dict={},
+                                      global_dict={}))
+        return evaluate
+
+    def _literal(self, node):
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return -self._literal(node.operand)
+        try:
+            return ast.literal_eval(node)
+        except ValueError:
+            raise ValueError('Unsupported expression in selection "{}"'
+                             .format(self.expression)) from None
+
+    def _dotted_name(self, node):
+        if isinstance(node, ast.Name):
+            return node.id
+        elif isinstance(node, ast.Attribute):
+            return '{}.{}'.format(self._dotted_name(node.value), node.attr)
+        raise ValueError('Unsupported attribute access in selection "{}"'
+                         .format(self.expression))
+
+    def _lookup(self, table, op):
+        try:
+            return table[type(op)]
+        except KeyError:
+            raise ValueError('Unsupported operator {} in selection "{}"'
+                             .format(type(op).__name__, self.expression)) \
+                from None
+
+    @staticmethod
+    def _constant(value):
+        return lambda get: value
+
+    @staticmethod
+    def _comparison(op, left, right):
+        return lambda get: op(left(get), right(get))
+
+    @staticmethod
+    def _reduce(op, funcs):
+        def evaluate(get):
+            result = funcs[0](get)
+            for f in funcs[1:]:
+                result = op(result, f(get))
+            return result
+        return evaluate
+
+
+def compile_selection(expression, column='', cache=None):
+    """Compile `expression`, reusing a previous result stored in `cache`."""
+    if cache is None:
+        return Selection(expression, column)
+    key = (expression, column)
+    try:
+        return cache[key]
+    except KeyError:
+        selection = cache[key] = Selection(expression, column)
+        return selection
@@ -1,7 +1,8 @@
 from .layered_graph import LayeredGraph
 from .utils import pairwise
 from .sankey_definition import Elsewhere
-from .dummy_nodes import add_dummy_nodes
+from .dummy_nodes import add_dummy_nodes_in_place
+from .ordering import OrderingBuilder
 
 
 def view_graph(sankey_definition):
@@ -18,13 +19,17 @@ def view_graph(sankey_definition):
 
 
 def _add_bundles_to_graph(G, bundles, sort_key):
+    # Build up a single copy of the graph in place
+    G = G.copy()
+    G.ordering = OrderingBuilder(G.ordering)
     for k, bundle in sorted(bundles.items(), key=sort_key):
         nodes = (bundle.source, ) + bundle.waypoints + (bundle.target, )
         for iw, (a, b) in enumerate(pairwise(nodes)):
             # No need to add waypoints to get to Elsewhere -- it is
             # everywhere!
             if a is not Elsewhere and b is not Elsewhere:
-                G = add_dummy_nodes(G, a, b, k, iw, _dummy_kw(bundle))
+                add_dummy_nodes_in_place(G, a, b, k, iw, _dummy_kw(bundle))
+    G.ordering = G.ordering.freeze()
 
     # check flow partitions are compatible
     for v, w, data in G.edges(data=True):
@@ -0,0 +1,109 @@
+import warnings
+
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from sankeyview import aggregation
+from sankeyview.aggregation import (aggregate, aggregation_columns,
+                                    register_aggregator)
+
+
+def _flows():
+    return pd.DataFrame.from_records([
+        ('x', 3, 2.0, 1.0),
+        ('y', 1, 4.0, np.nan),
+        ('x', 2, 1.0, 3.0),
+        ('x', 1, 1.0, 5.0),
+        ('y', 2, 6.0, 2.0),
+    ],
+                                     columns=('key', 'time', 'value',
+                                              'intensity'))
+
+
+def test_aggregate_registered_functions():
+    flows = _flows()
+    values = aggregate(flows.groupby('key'), flows, 'value', {
+        'intensity': 'weighted_mean',
+        'time': 'count',
+    })
+    assert list(values['value']) == [4, 10]
+    assert list(values['time']) == [3, 2]
+    assert list(values['intensity']) == [(2 + 3 + 5) / 4, 2]
+
+    for func, expected in [('min', [1, 2]), ('max', [5, 2]),
+                           ('mean', [3, 2]), ('count', [3, 1]),
+                           ('first', [5, np.nan]), ('last', [1, 2])]:
+        values = aggregate(flows.groupby('key'), flows, 'value',
+                           {'intensity': func})
+        assert np.allclose(values['intensity'], expected, equal_nan=True)
+
+
+def test_aggregate_empty_groups_without_warnings():
+    flows = _flows()
+    flows['intensity'] = [1.0, np.nan, 3.0, 5.0, np.nan]
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        for func in ['mean', 'weighted_mean']:
+            values = aggregate(flows.groupby('key'), flows, 'value',
+                               {'intensity': func})
+            assert np.isnan(values['intensity'][1])
+
+
+def test_aggregate_matches_pandas():
+    flows = _flows()
+    grouped = flows.groupby('key')
+    for func in ['sum', 'min', 'max', 'mean', 'count']:
+        values = aggregate(grouped, flows, 'value', {'intensity': func})
+        expected = grouped['intensity'].agg(func).values
+        assert np.allclose(values['intensity'], expected, equal_nan=True)
+
+    # Other functions are applied by pandas
+    values = aggregate(grouped, flows, 'value', {'intensity': 'median'})
+    assert list(values['intensity']) == [3, 2]
+
+
+def test_aggregate_columns():
+    flows = _flows()
+    values = aggregate(flows.groupby('key'), flows, 'value',
+                       {'intensity': ('weighted_mean', 'time')})
+    assert list(values['intensity']) == [(3 + 6 + 5) / 6, 2]
+
+    assert aggregation_columns('value', {'intensity': 'last'}) == \
+        ['intensity', 'time', 'value']
+    assert aggregation_columns('value', {'intensity': 'weighted_mean'},
+                               samples={'intensity': None}) == ['value']
+
+    with pytest.raises(ValueError):
+        aggregate(flows.groupby('key'), flows, 'value',
+                  {'intensity': ('weighted_mean', 'weight')})
+    with pytest.raises(ValueError):
+        aggregate(flows.groupby('key'), flows, 'value',
+                  {'intensity': ('unknown', 'time')})
+
+
+def test_register_aggregator():
+    def spread(values, offsets, time):
+        return (np.maximum.reduceat(time, offsets[:-1]) -
+                np.minimum.reduceat(time, offsets[:-1]))
+
+    register_aggregator('time_spread', spread, ['time'])
+    try:
+        flows = _flows()
+        values = aggregate(flows.groupby('key'), flows, 'value',
+                           {'intensity': 'time_spread'})
+        assert list(values['intensity']) == [2, 1]
+    finally:
+        del aggregation._AGGREGATORS['time_spread']
+
+
+def test_aggregate_samples():
+    flows = _flows()
+    flows.index = [4, 3, 2, 1, 0]
+    samples = {'ensemble': np.arange(10).reshape(5, 2)}
+    values = aggregate(flows.groupby('key'), flows, 'ensemble',
+                       {'value': 'sum'}, samples)
+    assert values['ensemble'].tolist() == [[8 + 4 + 2, 9 + 5 + 3],
+                                           [6 + 0, 7 + 1]]
+    assert list(values['value']) == [4, 10]
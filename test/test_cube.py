@@ -0,0 +1,164 @@
+import pytest
+
+import pandas as pd
+
+from sankeyview.cube import Cube
+from sankeyview.dataset import Dataset
+from sankeyview.sankey_definition import SankeyDefinition, ProcessGroup, Bundle
+from sankeyview.sankey_view import sankey_view
+from sankeyview.partition import Partition
+
+
+def _dataset():
+    dim_time = pd.DataFrame.from_records(
+        [(t, 2000 + t // 4) for t in range(8)],
+        columns=['id', 'year']).set_index('id')
+    flows = pd.DataFrame.from_records(
+        [('a', 'b', 'm' if t % 2 else 'n', t, float(t), 1) for t in range(8)] +
+        [('a', 'b', 'm', 1, 2.0, 1), ('a', 'c', 'm', 5, 3.0, 2)],
+        columns=['source', 'target', 'material', 'time', 'value', 'count'])
+    return Dataset(flows, dim_time=dim_time)
+
+
+def _definition(**kwargs):
+    nodes = {
+        'a': ProcessGroup(['a']),
+        'bc': ProcessGroup(['b', 'c'],
+                           partition=Partition.Simple('process', ['b', 'c'])),
+    }
+    return SankeyDefinition(nodes, [Bundle('a', 'bc')], [['a'], ['bc']],
+                            **kwargs)
+
+
+def test_cube_levels():
+    d = _dataset()
+    cube = d.build_cube(rollups=['time.year'])
+    assert cube.measures == ['value', 'count']
+    assert [rolled for rolled, _ in cube.levels] == [(), ('time.year', )]
+
+    finest = cube.levels[0][1]
+    assert finest._num_rows == 9
+    flows = finest._flows
+    row = flows[(flows.target == 'b') & (flows.time == 1)].iloc[0]
+    assert (row['value:sum'], row['value:count'], row['value:min'],
+            row['value:max']) == (3, 2, 1, 2)
+
+    yearly = cube.levels[1][1]
+    flows = yearly._flows.astype(object).sort_values(
+        ['target', 'material', 'time.year'])
+    assert list(flows['time.year']) == [2000, 2001, 2000, 2001, 2001]
+    assert list(flows['value:sum']) == [6, 12, 2, 10, 3]
+    assert list(flows['value:count']) == [3, 2, 2, 2, 1]
+
+
+def test_cube_rejects_unknown_rollups():
+    d = _dataset()
+    with pytest.raises(ValueError):
+        d.build_cube(rollups=['time.month'])
+    with pytest.raises(ValueError):
+        d.build_cube(rollups=['source.type'])
+
+
+def test_cube_level_for():
+    d = _dataset()
+    cube = d.build_cube(rollups=['time.year'])
+    finest, yearly = [level for _, level in cube.levels]
+
+    assert cube.level_for(_definition()) is yearly
+    assert cube.level_for(_definition(
+        time_partition=Partition.Simple('time.year', [2000, 2001]))) is yearly
+    assert cube.level_for(_definition(
+        time_partition=Partition.Simple('time', [1, 2]))) is finest
+    assert cube.level_for(_definition(), agg_measures={'count': 'max'}) \
+        is yearly
+
+    # Selections on measures, and other aggregations, need the flows
+    assert cube.level_for(_definition(flow_selection='value > 2')) is None
+    assert cube.level_for(_definition(), agg_measures={'count': 'median'}) \
+        is None
+    assert cube.level_for(_definition(), measure=lambda group: {}) is None
+
+
+def test_sankey_view_uses_cube():
+    definitions = [
+        _definition(),
+        _definition(time_partition=Partition.Simple('time.year',
+                                                    [2000, 2001])),
+        _definition(flow_partition=Partition.Simple('material', ['m', 'n']),
+                    time_partition=Partition.Simple('time', [1, 5])),
+        _definition(flow_selection='value > 2'),
+    ]
+    agg_measures = {'count': 'mean', 'value': 'max'}
+    for sdd in definitions:
+        d = _dataset()
+        expected = sankey_view(sdd, d, measure='count',
+                               agg_measures=agg_measures)
+        d.build_cube(rollups=['time.year'])
+        GR, groups = sankey_view(sdd, d, measure='count',
+                                 agg_measures=agg_measures)
+        assert GR.edges(keys=True, data=True) == \
+            expected[0].edges(keys=True, data=True)
+        assert GR.nodes(data=True) == expected[0].nodes(data=True)
+        assert groups == expected[1]
+
+
+def test_cube_save_load(tmpdir):
+    d = _dataset()
+    cube = d.build_cube(rollups=['time.year'])
+    cube.save(str(tmpdir))
+
+    cube2 = Cube.load(str(tmpdir))
+    assert cube2.measures == cube.measures
+    assert [rolled for rolled, _ in cube2.levels] == \
+        [rolled for rolled, _ in cube.levels]
+    for (_, level), (_, level2) in zip(cube.levels, cube2.levels):
+        assert level2._flows.astype(object).equals(
+            level._flows.astype(object))
+
+
+def test_cube_updated_by_append():
+    d = _dataset()
+    d.build_cube(rollups=['time.year'])
+    new_flows = pd.DataFrame.from_records(
+        [('a', 'c', 'n', 2, 4.0, 1), ('a', 'd', 'm', 9, 1.0, 1)],
+        columns=['source', 'target', 'material', 'time', 'value', 'count'])
+    d.append(new_flows)
+
+    _check_cube(d.cube, pd.concat([_dataset()._flows, new_flows]),
+                d._dim_time)
+
+
+def test_cube_update_merges_into_existing_rows(tmpdir):
+    d = _dataset()
+    d.build_cube(rollups=['time.year'])
+    d.cube.save(str(tmpdir))
+    d.cube = Cube.load(str(tmpdir), mmap=True)
+    sizes = [level._num_rows for _, level in d.cube.levels]
+
+    new_flows = pd.DataFrame.from_records(
+        [('a', 'b', 'm', 1, 5.0, 1), ('a', 'b', 'm', 1, -1.0, 1),
+         ('a', 'e', 'n', 3, 2.0, 1)],
+        columns=['source', 'target', 'material', 'time', 'value', 'count'])
+    cube = d.cube
+    d.append(new_flows)
+    assert d.cube is cube
+    # Only the new key (a, e, n) adds a row
+    assert [level._num_rows for _, level in d.cube.levels] == \
+        [n + 1 for n in sizes]
+    _check_cube(d.cube, pd.concat([_dataset()._flows, new_flows]),
+                d._dim_time)
+
+    d.append(new_flows[:1])
+    _check_cube(d.cube, pd.concat([_dataset()._flows, new_flows,
+                                   new_flows[:1]]), d._dim_time)
+
+
+def _check_cube(cube, flows, dim_time):
+    expected_cube = Dataset(flows, dim_time=dim_time).build_cube(
+        rollups=['time.year'])
+    for (_, level), (_, expected) in zip(cube.levels, expected_cube.levels):
+        columns = list(expected._columns)
+        flows = level._flows[columns].astype(object).fillna('-')
+        expected = expected._flows.astype(object).fillna('-')
+        assert sorted(map(tuple, flows.values), key=str) == \
+            sorted(map(tuple, expected.values), key=str)
@@ -1,9 +1,14 @@
+import pickle
+
 import pytest
 
+import numpy as np
 import pandas as pd
 
 from sankeyview.dataset import Dataset, eval_selection
-from sankeyview.sankey_definition import ProcessGroup, Bundle, Elsewhere
+from sankeyview.sankey_definition import (SankeyDefinition, ProcessGroup, Bundle,
+                                         Elsewhere)
+from sankeyview.partition import Partition
 
 
 def _dataset():
@@ -83,6 +88,23 @@ def test_selection_string():
         == [True, False, False, False]
 
 
+def test_selection_ranges_on_encoded_columns():
+    flows = pd.DataFrame({
+        'source': ['a', 'b', 'a', 'b'],
+        'target': ['b', 'c', 'c', 'c'],
+        'material': ['m1', 'm2', np.nan, 'm3'],
+        'time': pd.to_datetime(['2020-01-01', '2020-02-01', '2020-03-01',
+                                '2020-01-15']),
+        'value': [1, 2, 3, 4],
+    })
+    d = Dataset(flows)
+    for q in ['material >= "m2"', 'material < "m2"', 'material != "m2"',
+              'time >= "2020-02-01"', 'time < "2020-02-01"']:
+        expected = list(flows.eval(q))
+        assert list(d.select_flows(q)) == expected, q
+        assert list(eval_selection(flows, '', q)) == expected, q
+
+
 def test_dataset_only_includes_unused_flows_in_elsewhere_bundles():
     # Bundle 0 should include flow 0, bundle 1 should include flow 1
     nodes = {
@@ -257,3 +279,357 @@ def test_internal_flows_elsewhere():
     assert get_source_target(1) == [('b', 'other')]
 
     assert len(unused) == 0
+
+
+def test_apply_view_caches_compiled_selections():
+    d = _dataset()
+    nodes = {
+        'a': ProcessGroup(selection='function == "a"'),
+        'b': ProcessGroup(selection=['b']),
+    }
+    bundles = {
+        0: Bundle('a', 'b'),
+        1: Bundle('a', Elsewhere),
+    }
+    d.apply_view(nodes, bundles)
+    assert list(d._selections) == [('function == "a"', 'source')]
+    assert set(d._memberships) == {'function == "a"', ('b', )}
+
+    cached = dict(d._memberships)
+    bundle_flows, _ = d.apply_view(nodes, bundles)
+    assert all(d._memberships[k] is v for k, v in cached.items())
+    assert list(bundle_flows[0].source) == ['a1', 'a2']
+
+
+def test_process_membership():
+    d = _dataset()
+    assert list(d._processes) == ['a1', 'a2', 'b', 'c']
+    assert list(d.process_membership(['a1', 'c'])) == [True, False, False, True]
+    assert list(d.process_membership('function == "a"')) == \
+        [True, True, False, False]
+    assert list(d.process_membership('id == "b"')) == \
+        [False, False, True, False]
+
+    assert list(d.eval_selection(d._table, 'target', 'function == "b"')) \
+        == [True, True, False, False]
+    subset = d._table.iloc[2:]
+    assert list(d.eval_selection(subset, 'source', ['b'])) == [True, True]
+
+
+def test_apply_view_rejects_duplicate_bundles():
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'a1': ProcessGroup(selection=['a1']),
+        'b': ProcessGroup(selection=['b']),
+    }
+    d = _dataset()
+
+    with pytest.raises(ValueError):
+        d.apply_view(nodes, {0: Bundle('a', 'b'), 1: Bundle('a1', 'b')})
+
+    # Overlapping flow selections
+    with pytest.raises(ValueError):
+        d.apply_view(nodes, {
+            0: Bundle('a', 'b', flow_selection='material == "m1"'),
+            1: Bundle('a1', 'b', flow_selection='value > 1'),
+        })
+
+    # No overlap once the flow selection is applied
+    bundle_flows, _ = d.apply_view(nodes, {
+        0: Bundle('a', 'b', flow_selection='material == "m2"'),
+        1: Bundle('a1', 'b'),
+    })
+    assert list(bundle_flows[0].index) == [1]
+    assert list(bundle_flows[1].index) == [0]
+
+    # ... or if the view's flow selection excludes the overlap
+    bundle_flows, _ = d.apply_view(nodes, {
+        0: Bundle('a', 'b'),
+        1: Bundle('a1', 'b'),
+    }, flow_selection='source != "a1"')
+    assert list(bundle_flows[0].index) == [1]
+    assert list(bundle_flows[1].index) == []
+
+
+def test_dataset_encodes_key_columns():
+    d = _dataset()
+    for column in ('source', 'target', 'material', 'time'):
+        assert d._flows[column].dtype.name == 'category'
+    assert list(d._dictionaries['source']) == ['a1', 'a2', 'b', 'c']
+    assert d._dictionaries['target'] is d._dictionaries['source']
+    assert list(d._codes('target')) == [2, 2, 3, 3]
+    assert list(d._flows.material) == ['m1', 'm2', 'm1', 'm2']
+
+
+def test_dataset_selections_on_encoded_columns():
+    flows = pd.DataFrame.from_records(
+        [
+            ('a', 'b', 'm', 2015, 1),
+            ('a', 'b', 'm', 2016, 2),
+            ('a', 'b', 'n', 2017, 3),
+        ],
+        columns=('source', 'target', 'material', 'time', 'value'))
+    d = Dataset(flows)
+    assert list(d.eval_selection(d._table, '', 'time >= 2016')) == \
+        [False, True, True]
+    assert list(d.eval_selection(d._table, '', 'time + 1 == 2016')) == \
+        [True, False, False]
+    assert list(d.eval_selection(d._table, '', 'material != "m"')) == \
+        [False, False, True]
+
+
+def test_dataset_partition():
+    d = _dataset()
+    assert d.partition('material') == Partition.Simple('material', ['m1', 'm2'])
+    assert d.partition('target', processes=['a1']) == \
+        Partition.Simple('target', ['b'])
+    assert d.partition('source.function') == \
+        Partition.Simple('source.function', ['a', 'b'])
+
+
+def test_dataset_joins_dimension_columns_lazily():
+    d = _dataset()
+    nodes = {
+        'a': ProcessGroup(selection='function == "a"'),
+        'b': ProcessGroup(selection=['b']),
+    }
+    bundles = {0: Bundle('a', 'b', flow_selection='material.type == "type1"')}
+
+    # Selections don't need dimension columns to be joined to the flows
+    bundle_flows, _ = d.apply_view(nodes, bundles, columns=[])
+    assert d._gathered == {}
+    assert set(bundle_flows[0].columns) == {'source', 'target', 'material',
+                                            'time', 'value'}
+    assert list(bundle_flows[0].index) == [0]
+
+    bundle_flows, _ = d.apply_view(nodes, bundles, columns=['time.month'])
+    assert set(d._gathered) == {'time.month'}
+    assert list(bundle_flows[0]['time.month']) == ['August']
+
+    # All dimension columns by default
+    bundle_flows, _ = d.apply_view(nodes, bundles)
+    assert set(bundle_flows[0].columns) == set(d._table.columns)
+
+
+def _time_series_dataset():
+    dim_time = pd.DataFrame.from_records(
+        [(t, 2000 + t // 4) for t in range(12)],
+        columns=['id', 'year']).set_index('id')
+    flows = pd.DataFrame.from_records(
+        [('a', 'b', 'm' if t % 2 else 'n', t, 'x', float(t)) for t in range(12)],
+        columns=['source', 'target', 'material', 'time', 'note', 'value'])
+    return Dataset(flows, dim_time=dim_time)
+
+
+def test_columnar_roundtrip(tmpdir):
+    d = _time_series_dataset()
+    d.save_columnar(str(tmpdir), row_group_size=5)
+
+    d2 = Dataset.from_columnar(str(tmpdir))
+    assert d2._flows.astype(object).equals(d._flows.astype(object))
+    assert d2._dim_time.equals(d._dim_time)
+    assert d2._dictionaries['target'].equals(d._dictionaries['source'])
+    assert list(d2._table['time.year']) == list(d._table['time.year'])
+
+
+def test_columnar_saves_nothing_pickled(tmpdir):
+    dim_process = pd.DataFrame.from_records(
+        [('a', 'farm', 1.5), ('b', None, 2.0), ('c', 'farm', np.nan)],
+        columns=['id', 'function', 'size']).set_index('id')
+    flows = pd.DataFrame.from_records(
+        [('a', 'b', 'm', 1, 'x', 3.0), ('b', 'c', 'n', 2, 7, 1.0)],
+        columns=['source', 'target', 'material', 'time', 'note', 'value'])
+    d = Dataset(flows, dim_process)
+    d.save_columnar(str(tmpdir))
+    assert {f.ext for f in tmpdir.listdir()} == {'.npy', '.json'}
+
+    d2 = Dataset.from_columnar(str(tmpdir))
+    assert d2._dim_process.equals(d._dim_process)
+    assert list(d2._flows.note) == ['x', 7]
+    assert list(d2._table['source.function'].fillna('-')) == ['farm', '-']
+
+    # Only text and numbers can be saved in dictionaries
+    flows['note'] = [('x', ), 'y']
+    with pytest.raises(ValueError):
+        Dataset(flows).save_columnar(str(tmpdir.join('tuples')))
+
+
+def test_columnar_projection(tmpdir):
+    d = _time_series_dataset()
+    d.save_columnar(str(tmpdir), row_group_size=5)
+
+    d2 = Dataset.from_columnar(str(tmpdir), columns=['value'])
+    assert list(d2._flows.columns) == ['source', 'target', 'material', 'time',
+                                       'value']
+
+    nodes = {'a': ProcessGroup(['a']), 'b': ProcessGroup(['b'])}
+    sdd = SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']],
+                           flow_partition=Partition.Simple('note', ['x']))
+    d3 = Dataset.from_columnar(str(tmpdir), sankey_definition=sdd)
+    assert list(d3._flows.columns) == ['source', 'target', 'material', 'time',
+                                       'note', 'value']
+
+
+def test_columnar_skips_row_groups(tmpdir):
+    d = _time_series_dataset()
+    d.save_columnar(str(tmpdir), row_group_size=4)
+
+    def load(sel):
+        return list(Dataset.from_columnar(str(tmpdir),
+                                          flow_selection=sel)._flows.time)
+
+    # Row groups hold times 0-3, 4-7, 8-11
+    assert load('value >= 8.5') == [8, 9, 10, 11]
+    assert load('value < 2 or value > 10') == [0, 1, 2, 3, 8, 9, 10, 11]
+    assert load('time in [5, 6]') == [4, 5, 6, 7]
+    assert load('time.year == 2001') == [4, 5, 6, 7]
+    assert load('material == "m" and value < 4') == [0, 1, 2, 3]
+    assert load('material == "z"') == []
+    # Can't rule anything out
+    assert load('value * 2 > 20') == list(range(12))
+    assert load('not (value > 4)') == list(range(12))
+
+
+def test_columnar_mmap(tmpdir):
+    d = _time_series_dataset()
+    d.save_columnar(str(tmpdir), row_group_size=4)
+
+    d2 = Dataset.from_columnar(str(tmpdir), mmap=True)
+    assert isinstance(d2._codes('source'), np.memmap)
+    assert d2._flows.astype(object).equals(d._flows.astype(object))
+
+    # Contiguous row groups are still mapped
+    d3 = Dataset.from_columnar(str(tmpdir), flow_selection='value >= 4',
+                               mmap=True)
+    assert isinstance(d3._codes('source'), np.memmap)
+    assert list(d3._flows.time) == list(range(4, 12))
+
+    nodes = {'a': ProcessGroup(['a']), 'b': ProcessGroup(['b'])}
+    bundles = {0: Bundle('a', 'b')}
+    flows, _ = d2.apply_view(nodes, bundles)
+    assert list(flows[0].value) == list(d._flows.value)
+
+
+def test_columnar_mmap_pickles_as_file_reference(tmpdir):
+    d = _time_series_dataset()
+    d.save_columnar(str(tmpdir), row_group_size=4)
+
+    d2 = Dataset.from_columnar(str(tmpdir), flow_selection='value >= 4',
+                               mmap=True)
+    data = pickle.dumps(d2)
+    assert len(data) < len(pickle.dumps(d))
+    d3 = pickle.loads(data)
+    assert isinstance(d3._codes('source'), np.memmap)
+    assert d3._flows.astype(object).equals(d2._flows.astype(object))
+
+    # Datasets in memory are pickled as usual
+    d4 = pickle.loads(pickle.dumps(d))
+    assert d4._flows.equals(d._flows)
+
+
+def test_columnar_roundtrip_samples(tmpdir):
+    flows = _time_series_dataset()._flows
+    samples = np.arange(36.0).reshape(12, 3)
+    d = Dataset(flows, samples={'value_samples': samples})
+    d.save_columnar(str(tmpdir), row_group_size=4)
+
+    d2 = Dataset.from_columnar(str(tmpdir))
+    assert list(d2.samples) == ['value_samples']
+    assert d2.samples['value_samples'].tolist() == samples.tolist()
+
+    # Only the rows of the row groups read, and mapped files pickle as a
+    # reference to them
+    d3 = Dataset.from_columnar(str(tmpdir), flow_selection='value >= 4',
+                               mmap=True)
+    assert d3.samples['value_samples'].tolist() == samples[4:].tolist()
+    d4 = pickle.loads(pickle.dumps(d3))
+    assert d4._mapped == d3._mapped
+    assert d4.samples['value_samples'].tolist() == samples[4:].tolist()
+
+    # Samples are columns, which may not be needed
+    d5 = Dataset.from_columnar(str(tmpdir), columns=['value'])
+    assert list(d5.samples) == []
+
+
+def test_hdf_roundtrip_samples(tmpdir):
+    pytest.importorskip('tables')
+    flows = _time_series_dataset()._flows
+    samples = np.arange(36.0).reshape(12, 3)
+    d = Dataset(flows, samples={'value_samples': samples})
+    d.save(str(tmpdir.join('dataset.h5')))
+
+    d2 = Dataset.from_hdf(str(tmpdir.join('dataset.h5')))
+    assert list(d2.samples) == ['value_samples']
+    assert d2.samples['value_samples'].tolist() == samples.tolist()
+
+
+def test_dataset_append():
+    d = _time_series_dataset()
+    codes = d._codes('source').copy()
+    new_flows = pd.DataFrame.from_records(
+        [('a', 'c', 'm', 3, 'y', 20.0), ('c', 'b', 'z', 12, 'x', 21.0)],
+        columns=['source', 'target', 'material', 'time', 'note', 'value'])
+
+    version, rows = d.append(new_flows)
+    assert version == d.version == 1
+    assert rows == range(12, 14)
+
+    expected = pd.concat([_time_series_dataset()._flows, new_flows],
+                         ignore_index=True)
+    assert d._flows.astype(object).equals(expected.astype(object))
+    assert list(d._codes('source')[:12]) == list(codes)
+    years = d._table['time.year']
+    assert list(years[:13]) == [2000] * 4 + [2001] * 4 + [2002] * 4 + [2000]
+    assert np.isnan(years[13])
+
+    with pytest.raises(ValueError):
+        d.append(new_flows[['source', 'target', 'value']])
+
+
+def test_dataset_append_extends_caches():
+    d = _time_series_dataset()
+    nodes = {'a': ProcessGroup('id in ["a", "c"]'), 'b': ProcessGroup(['b'])}
+    bundles = {0: Bundle('a', 'b'), 1: Bundle('a', Elsewhere)}
+    d.apply_view(nodes, bundles, 'time.year == 2001')
+
+    new_flows = pd.DataFrame.from_records(
+        [('c', 'b', 'm', 5, 'y', 20.0), ('a', 'd', 'm', 6, 'x', 21.0)],
+        columns=['source', 'target', 'material', 'time', 'note', 'value'])
+    for i in range(3):
+        d.append(new_flows)
+    buffer = d._columns['value'].base
+    d.append(new_flows)
+    assert d._columns['value'].base is buffer
+
+    fresh = Dataset(pd.concat([_time_series_dataset()._flows] +
+                              [new_flows] * 4),
+                    dim_time=d._dim_time)
+    flows, unused = d.apply_view(nodes, bundles, 'time.year == 2001')
+    expected, expected_unused = fresh.apply_view(nodes, bundles,
+                                                 'time.year == 2001')
+    for k in bundles:
+        assert flows[k].astype(object).equals(expected[k].astype(object))
+    assert unused.astype(object).equals(expected_unused.astype(object))
+
+
+def test_dataset_samples():
+    flows = pd.DataFrame.from_records(
+        [('a', 'b', 'm', 3), ('a', 'c', 'm', 2)],
+        columns=('source', 'target', 'material', 'value'))
+    samples = np.array([[1, 2, 3], [4, 5, 6]])
+    d = Dataset(flows, samples={'value_samples': samples})
+    assert d.samples['value_samples'] is samples
+
+    with pytest.raises(ValueError):
+        Dataset(flows, samples={'value_samples': samples[:1]})
+    with pytest.raises(ValueError):
+        Dataset(flows, samples={'value': samples})
+
+    new_flows = flows.iloc[:1]
+    with pytest.raises(ValueError):
+        d.append(new_flows)
+    with pytest.raises(ValueError):
+        d.append(new_flows, samples={'value_samples': [[7, 8]]})
+    d.append(new_flows, samples={'value_samples': [[7, 8, 9]]})
+    assert d.samples['value_samples'].tolist() == [[1, 2, 3], [4, 5, 6],
+                                                   [7, 8, 9]]
@@ -1,5 +1,5 @@
 from sankeyview.layered_graph import LayeredGraph, Ordering
-from sankeyview.dummy_nodes import add_dummy_nodes
+from sankeyview.dummy_nodes import add_dummy_nodes, add_dummy_nodes_in_place
 from sankeyview.sankey_definition import ProcessGroup
 from sankeyview.partition import Partition
 
@@ -41,6 +41,25 @@ def test_dummy_nodes_merge_bundles():
     assert G.ordering == Ordering([[['a']], [['b']]])
 
 
+def test_dummy_nodes_copy_or_in_place():
+    G = LayeredGraph()
+    G.add_node('a', node=ProcessGroup())
+    G.add_node('b', node=ProcessGroup())
+    G.ordering = Ordering([[['a']], [[]], [['b']]])
+    G.add_edge('a', 'b', bundles=[0])
+
+    H = add_dummy_nodes(G, 'a', 'b', bundle_key=1)
+    assert set(H.nodes()) == {'a', 'b', '__a_b_1'}
+    assert set(G.nodes()) == {'a', 'b'}
+    assert G['a']['b']['bundles'] == [0]
+    assert G.ordering == Ordering([[['a']], [[]], [['b']]])
+
+    add_dummy_nodes_in_place(G, 'a', 'b', bundle_key=1)
+    assert set(G.nodes()) == set(H.nodes())
+    assert set(G.edges()) == set(H.edges())
+    assert G.ordering == H.ordering
+
+
 def test_dummy_nodes_sets_node_attributes():
     G = _twonodes(0, 'R', 2, 'R')
     assert G.node['__x_y_1']['node'].partition == None
@@ -10,3 +10,13 @@ def test_remove_node():
     G.remove_node('c')
     assert sorted(G.nodes()) == ['a', 'b', 'd']
     assert G.ordering == Ordering([['a'], ['b'], ['d']])
+
+
+def test_remove_nodes_from():
+    G = LayeredGraph()
+    G.add_edges_from([('a', 'b'), ('a', 'c'), ('b', 'd')])
+    G.ordering = Ordering([['a'], ['b', 'c'], ['d']])
+
+    G.remove_nodes_from(n for n in ['c', 'd'])
+    assert sorted(G.nodes()) == ['a', 'b']
+    assert G.ordering == Ordering([['a'], ['b']])
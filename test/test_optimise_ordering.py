@@ -0,0 +1,78 @@
+import itertools
+import random
+
+import pandas as pd
+
+from sankeyview.sankey_definition import SankeyDefinition, Ordering, ProcessGroup, Bundle
+from sankeyview.optimise_ordering import optimise_ordering, bilayer_crossings
+
+
+def _definition(ordering, bundles):
+    ordering = Ordering(ordering)
+    nodes = {k: ProcessGroup(selection=[k]) for bands in ordering.layers
+             for rank in bands for k in rank}
+    return SankeyDefinition(nodes, [Bundle(v, w) for v, w in bundles],
+                            ordering)
+
+
+def test_bilayer_crossings():
+    assert bilayer_crossings([], []) == 0
+    assert bilayer_crossings([0, 1], [1, 0]) == 1
+    assert bilayer_crossings([0, 0, 1], [0, 1, 0]) == 1
+    assert bilayer_crossings([0, 1], [1, 0], [2., 3.]) == 6.
+
+    # Same as comparing every pair of edges
+    rng = random.Random(1)
+    for trial in range(20):
+        E = rng.randint(1, 30)
+        upper = [rng.randint(0, 5) for e in range(E)]
+        lower = [rng.randint(0, 5) for e in range(E)]
+        weights = [rng.randint(1, 4) for e in range(E)]
+        expected = sum(
+            weights[e] * weights[f]
+            for e, f in itertools.combinations(range(E), 2)
+            if (upper[e] - upper[f]) * (lower[e] - lower[f]) < 0)
+        assert bilayer_crossings(upper, lower, weights) == expected
+
+
+def test_optimise_ordering():
+    sdd = _definition([['a', 'b', 'c'], ['d', 'e', 'f']],
+                      [('a', 'f'), ('b', 'e'), ('c', 'd'), ('a', 'e')])
+    ordering, before, after = optimise_ordering(sdd)
+    assert (before, after) == (4, 0)
+    assert sorted(ordering.layers[0][0]) == ['a', 'b', 'c']
+    assert sorted(ordering.layers[1][0]) == ['d', 'e', 'f']
+
+    # The new ordering has no crossings
+    _, before, after = optimise_ordering(
+        SankeyDefinition(sdd.nodes, sdd.bundles, ordering))
+    assert (before, after) == (0, 0)
+
+
+def test_optimise_ordering_respects_bands():
+    # The crossing cannot be removed without moving nodes between bands
+    sdd = _definition([[['a'], ['b']], [['c'], ['d']]],
+                      [('a', 'd'), ('b', 'c')])
+    assert optimise_ordering(sdd) == (sdd.ordering, 1, 1)
+
+    sdd = _definition([[['a', 'b'], ['c']], [['d'], ['e', 'f']]],
+                      [('a', 'e'), ('b', 'd'), ('c', 'f')])
+    ordering, before, after = optimise_ordering(sdd)
+    assert (before, after) == (1, 0)
+    assert ordering == Ordering([[['b', 'a'], ['c']], [['d'], ['e', 'f']]])
+
+
+def test_optimise_ordering_weighted_by_flows():
+    # b--e must cross either a--d or a--f: it should be the smaller flow
+    sdd = _definition([[['b', 'a']], [['d'], ['e'], ['f']]],
+                      [('a', 'd'), ('a', 'f'), ('b', 'e')])
+    flows = pd.DataFrame.from_records(
+        [('a', 'd', 'm', 5), ('a', 'f', 'm', 2), ('b', 'e', 'm', 1)],
+        columns=('source', 'target', 'material', 'value'))
+
+    ordering, before, after = optimise_ordering(sdd, flows)
+    assert (before, after) == (5, 2)
+    assert ordering.layers[0] == (('a', 'b'), )
+
+    # Unweighted, there is no improvement
+    assert optimise_ordering(sdd) == (sdd.ordering, 1, 1)
@@ -3,7 +3,8 @@ import networkx as nx
 
 from sankeyview.ordering import (flatten_bands, unflatten_bands, band_index,
                                  new_node_indices, median_value,
-                                 neighbour_positions, fill_unknown, Ordering)
+                                 neighbour_positions, fill_unknown, Ordering,
+                                 OrderingBuilder)
 
 
 def test_ordering_normalisation():
@@ -53,6 +54,21 @@ def test_ordering_remove():
     ])
 
 
+def test_ordering_remove_many():
+    a = Ordering([
+        [['a', 'b'], ['c']],
+        [[], ['d']],
+    ])
+
+    assert a.remove_many(['a', 'c']) == Ordering([
+        [['b'], []],
+        [[], ['d']],
+    ])
+    assert a.remove_many(['a', 'b', 'c']) == Ordering([[[], ['d']]])
+    assert a.remove_many(['x']) == a
+    assert a.remove_many([]) == a
+
+
 def test_ordering_indices():
     a = Ordering([
         [['a', 'b'], ['c']],
@@ -67,6 +83,98 @@ def test_ordering_indices():
         a.indices('e')
 
 
+def test_ordering_indices_updated_by_insert_and_remove():
+    def check(ordering):
+        fresh = Ordering(ordering.layers)
+        for bands in ordering.layers:
+            for rank in bands:
+                for x in rank:
+                    assert ordering.indices(x) == fresh.indices(x)
+
+    a = Ordering([
+        [['a', 'b'], ['c']],
+        [[], ['d']],
+        [['e'], ['f', 'g']],
+    ])
+    a.indices('a')
+
+    b = a.insert(0, 0, 1, 'x')
+    assert b.indices('x') == (0, 0, 1)
+    assert b.indices('b') == (0, 0, 2)
+    check(b)
+    assert a.indices('b') == (0, 0, 1)
+
+    c = b.remove_many(['d', 'a'])
+    assert c.indices('f') == (1, 1, 0)
+    check(c)
+    with pytest.raises(ValueError):
+        c.indices('d')
+
+    check(c.insert(1, 1, 0, 'y').remove('x'))
+    assert c == Ordering([[['x', 'b'], ['c']], [['e'], ['f', 'g']]])
+
+
+def test_ordering_insert_into_missing_band_with_index():
+    a = Ordering([['a'], ['b']])
+    a.indices('a')
+    assert a.insert(0, 1, 0, 'x') == a
+    assert a.insert(2, 0, 0, 'x') == a
+    assert a.insert(0, 1, 0, 'x').indices('b') == (1, 0, 0)
+
+
+def test_ordering_insert_negative_position_with_index():
+    a = Ordering([['a', 'b'], ['c']])
+    a.indices('a')
+    b = a.insert(0, 0, -1, 'x')
+    assert b == Ordering([['a', 'x', 'b'], ['c']])
+    assert [b.indices(x) for x in 'axb'] == [(0, 0, 0), (0, 0, 1), (0, 0, 2)]
+    assert a.insert(0, 0, -5, 'x').indices('x') == (0, 0, 0)
+    assert a.insert(0, 0, 9, 'x').indices('x') == (0, 0, 2)
+
+
+def test_ordering_builder():
+    a = Ordering([
+        [['a', 'b'], ['c']],
+        [[], ['d']],
+        [['e'], ['f', 'g']],
+    ])
+    builder = OrderingBuilder(a)
+    assert builder.indices('d') == (1, 1, 0)
+
+    assert builder.insert(0, 0, 1, 'x') is builder
+    builder.insert(0, 0, 0, 'y')
+    assert builder.indices('b') == (0, 0, 3)
+    assert builder.indices('x') == (0, 0, 2)
+    builder.remove_many(['d', 'a'])
+    assert builder.indices('f') == (1, 1, 0)
+    builder.insert_layer(0)
+    assert builder.indices('x') == (1, 0, 1)
+    with pytest.raises(ValueError):
+        builder.indices('d')
+    with pytest.raises(ValueError):
+        builder.insert(1, 0, 0, 'b')
+
+    # Like Ordering.insert, does nothing if there is no such band
+    builder.insert(1, 2, 0, 'z')
+    builder.insert(9, 0, 0, 'z')
+    with pytest.raises(ValueError):
+        builder.indices('z')
+
+    expected = a.insert(0, 0, 1, 'x').insert(0, 0, 0, 'y') \
+                .remove_many(['d', 'a'])
+    expected = Ordering((((), ()), ) + expected.layers)
+    b = builder.freeze()
+    assert b == expected
+    for bands in b.layers:
+        for rank in bands:
+            for x in rank:
+                assert b.indices(x) == expected.indices(x)
+
+    # The ordering is not changed by the builder
+    assert a.indices('b') == (0, 0, 1)
+    assert OrderingBuilder().freeze() == Ordering([])
+
+
 def test_flatten_bands():
     bands = [['a'], ['b', 'c'], ['d']]
     L, idx = flatten_bands(bands)
@@ -85,6 +193,10 @@ def test_band_index():
     assert band_index([0, 1, 3], 3) == 2
     assert band_index([0, 1, 3], 9) == 2
 
+    # bands:  (empty) | a | (empty) | b c
+    assert band_index([0, 0, 1, 1], 0) == 1
+    assert band_index([0, 0, 1, 1], 2) == 3
+
 
 def test_new_node_indices():
     # Simple alignment: a--x, n--y || b--z
@@ -152,6 +264,15 @@ def test_neighbour_positions():
     assert neighbour_positions(G, order[0], 's4') == [2, 5], 's4'
     assert neighbour_positions(G, order[0], 's0') == [0, 2, 3], 's0'
 
+    # Edges in both directions count once; nodes not in the rank are ignored
+    G.add_edges_from([('s4', 'n2'), ('s4', 'x')])
+    assert neighbour_positions(G, order[0], 's4') == [2, 5], 's4'
+    assert neighbour_positions(G, order[0], 'y') == [], 'not in graph'
+
+    # Multigraphs and undirected graphs too
+    for H in (nx.MultiDiGraph(G), nx.Graph(G)):
+        assert neighbour_positions(H, order[0], 's4') == [2, 5], 's4'
+
 
 def test_fill_unknown():
     assert fill_unknown([0, 1, 2], 'above') == [0, 1, 2]
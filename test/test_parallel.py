@@ -0,0 +1,97 @@
+import pickle
+import sys
+
+import pytest
+
+import numpy as np
+import pandas as pd
+
+from sankeyview.dataset import Dataset
+from sankeyview.parallel import SharedDataset, sankey_views
+from sankeyview.partition import Partition
+from sankeyview.sankey_definition import SankeyDefinition, ProcessGroup, Bundle
+from sankeyview.sankey_view import sankey_view
+
+needs_shared_memory = pytest.mark.skipif(
+    sys.version_info < (3, 8), reason='needs multiprocessing.shared_memory')
+
+
+def _dataset():
+    flows = pd.DataFrame.from_records(
+        [('a1', 'b1', 'm', 3), ('a2', 'b1', 'n', 1), ('a1', 'b2', 'm', 2),
+         ('a2', 'b2', 'n', 4)],
+        columns=('source', 'target', 'material', 'value'))
+    return Dataset(flows, samples={'value_samples': np.arange(8).reshape(4, 2)})
+
+
+def _definitions():
+    nodes = {
+        'a': ProcessGroup(['a1', 'a2']),
+        'b': ProcessGroup(['b1', 'b2'],
+                          partition=Partition.Simple('process', ['b1', 'b2'])),
+    }
+    return [
+        SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']]),
+        SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']],
+                         flow_partition=Partition.Simple('material',
+                                                         ['m', 'n'])),
+        SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']],
+                         flow_selection='material == "m"'),
+    ]
+
+
+def _edges(results):
+    return [(v, w, k, d['value'], d['bundles'])
+            for v, w, k, d in results[0].edges(keys=True, data=True)]
+
+
+def test_sankey_views():
+    dataset = _dataset()
+    definitions = _definitions()
+    results = sankey_views(definitions, dataset, processes=2)
+    assert len(results) == len(definitions)
+    for sdd, result in zip(definitions, results):
+        expected = sankey_view(sdd, dataset)
+        assert _edges(result) == _edges(expected)
+        assert result[1] == expected[1]
+
+
+@needs_shared_memory
+def test_shared_dataset():
+    dataset = _dataset()
+    with SharedDataset(dataset) as shared:
+        assert shared._flows.astype(object).equals(
+            dataset._flows.astype(object))
+        assert shared.samples['value_samples'].tolist() == \
+            dataset.samples['value_samples'].tolist()
+
+        # Pickles as a reference to the shared memory
+        data = pickle.dumps(shared)
+        assert len(data) < len(pickle.dumps(dataset))
+        attached = pickle.loads(data)
+        assert attached._flows.astype(object).equals(
+            dataset._flows.astype(object))
+
+        definitions = _definitions()
+        results = sankey_views(definitions, shared, processes=2,
+                               measure='value_samples', as_graph=False)
+        for sdd, result in zip(definitions, results):
+            expected = sankey_view(sdd, dataset, measure='value_samples',
+                                   as_graph=False)
+            assert result.value_samples.tolist() == \
+                expected.value_samples.tolist()
+        del attached
+
+
+@needs_shared_memory
+def test_shared_dataset_closed():
+    shared = SharedDataset(_dataset())
+    shared.close()
+    assert shared.dataset is None
+
+
+def test_shared_dataset_needs_shared_memory(monkeypatch):
+    import sankeyview.parallel
+    monkeypatch.setattr(sankeyview.parallel, 'shared_memory', None)
+    with pytest.raises(RuntimeError):
+        SharedDataset(_dataset())
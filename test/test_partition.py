@@ -1,4 +1,8 @@
 import pytest
+
+import numpy as np
+import pandas as pd
+
 from sankeyview.partition import Partition, Group
 
 
@@ -49,3 +53,47 @@ def test_partition_simple_checks_for_duplicates():
             ('label1', ['a', 'b']),
             'b'
         ])
+
+
+def test_partition_dimensions():
+    assert Partition().dimensions == set()
+    assert Partition.Simple('dim1', ['x', 'y']).dimensions == {'dim1'}
+    G = Partition.Simple('dim1', ['x']) * Partition.Simple('dim2', ['y'])
+    assert G.dimensions == {'dim1', 'dim2'}
+
+
+def test_partition_compile():
+    G = Partition.Simple('dim1', ['x', ('yz', ['y', 'z'])])
+    compiled = G.compile()
+    assert G.compile() is compiled
+
+    data = {'dim1': ['z', 'x', 'w', None, 'y']}
+    codes = compiled.codes(lambda dim: pd.Series(data[dim]), 5)
+    assert list(codes) == [1, 0, 2, 2, 1]
+
+    # Categorical columns are looked up by category
+    column = pd.Series(data['dim1'], dtype='category')
+    assert list(compiled.codes(lambda dim: column, 5)) == [1, 0, 2, 2, 1]
+
+
+def test_partition_compile_product():
+    G = (Partition.Simple('dim1', ['x', 'y']) *
+         Partition.Simple('dim2', [1, ('23', [2, 3])]))
+    data = {
+        'dim1': np.array(['x', 'y', 'y', 'x', 'w']),
+        'dim2': np.array([3, 1, 2, 4, 1]),
+    }
+    codes = G.compile().codes(lambda dim: data[dim], 5)
+    assert [G.labels[i] if i < 4 else None for i in codes] == \
+        ['x/23', 'y/1', 'y/23', None, None]
+
+
+def test_partition_compile_checks_for_duplicates():
+    g1 = Group('g1', [('dim1', ('a', 'b'))])
+    g2 = Group('g2', [('dim1', ('b', 'c'))])
+    g3 = Group('g3', [('dim2', ('x', ))])
+    with pytest.raises(ValueError):
+        Partition([g1, g2]).compile()
+    with pytest.raises(ValueError):
+        Partition([g1, g3]).compile()
+    Partition([g1, Group('g4', [('dim1', ('c', ))])]).compile()
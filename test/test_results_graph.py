@@ -1,8 +1,11 @@
+import pytest
+
 import numpy as np
 import pandas as pd
 
 from sankeyview.layered_graph import LayeredGraph, Ordering
-from sankeyview.results_graph import results_graph
+from sankeyview.results_graph import (results_graph, results_table,
+                                       ChunkedResults)
 from sankeyview.sankey_definition import ProcessGroup, Waypoint, Bundle
 from sankeyview.partition import Partition
 
@@ -238,6 +241,82 @@ def test_results_graph_measures():
     ]
 
 
+def test_results_graph_measures_for_each_group():
+    view_graph = _twonode_viewgraph()
+    material_partition = Partition.Simple('material', ['m', 'n'])
+
+    bundle_flows = {
+        0: pd.DataFrame.from_records([
+            ('a', 'b1', 'm', 4, 2),
+            ('a', 'b2', 'n', 7, 1),
+            ('a', 'b2', 'm', 1, 6),
+            ('a', 'b1', 'n', 3, 3),
+        ],
+                                     columns=('source', 'target', 'material',
+                                              'value', 'another_measure')),
+    }
+
+    Gr, groups = results_graph(view_graph, bundle_flows, material_partition,
+                               agg_measures={'another_measure': 'mean'})
+    assert Gr.edges(keys=True, data=True) == [
+        ('a^*', 'b^*', ('m', '*'), {'value': 5,
+                                    'measures': {'another_measure': 4},
+                                    'bundles': [0]}),
+        ('a^*', 'b^*', ('n', '*'), {'value': 10,
+                                    'measures': {'another_measure': 2},
+                                    'bundles': [0]}),
+    ]
+
+
+def test_results_graph_long_bundles():
+    material_partition = Partition.Simple('material', ['m', 'n'])
+    view_graph = LayeredGraph()
+    view_graph.add_node('a', node=ProcessGroup())
+    view_graph.add_node('b', node=ProcessGroup())
+    view_graph.add_node('via', node=Waypoint(partition=material_partition))
+    for i in range(3):
+        view_graph.add_node('d{}'.format(i), node=Waypoint())
+    view_graph.add_edges_from([
+        ('a', 'd0', {'bundles': [0, 1]}),
+        ('d0', 'via', {'bundles': [0, 1]}),
+        ('via', 'd1', {'bundles': [0]}),
+        ('d1', 'b', {'bundles': [0]}),
+        ('via', 'd2', {'bundles': [1]}),
+        ('d2', 'b', {'bundles': [1]}),
+    ])
+    view_graph.ordering = Ordering([[['a']], [['d0']], [['via']],
+                                    [['d1', 'd2']], [['b']]])
+
+    bundle_flows = {
+        0: pd.DataFrame.from_records(
+            [('a1', 'b1', 'm', 3), ('a1', 'b1', 'n', 1)],
+            columns=('source', 'target', 'material', 'value')),
+        1: pd.DataFrame.from_records(
+            [('a2', 'b1', 'm', 2)],
+            columns=('source', 'target', 'material', 'value')),
+    }
+
+    # Named measures are aggregated for all edges at once; the results should
+    # be the same as aggregating each edge separately
+    Gr, groups = results_graph(view_graph, bundle_flows)
+    expected, _ = results_graph(
+        view_graph, bundle_flows,
+        measure=lambda group: {'value': group.value.sum(), 'measures': {}})
+    assert Gr.edges(keys=True, data=True) == \
+        expected.edges(keys=True, data=True)
+    assert sorted((v, w, d['value'])
+                  for v, w, d in Gr.edges(data=True)) == [
+        ('a^*', 'd0^*', 6),
+        ('d0^*', 'via^m', 5),
+        ('d0^*', 'via^n', 1),
+        ('d1^*', 'b^*', 4),
+        ('d2^*', 'b^*', 2),
+        ('via^m', 'd1^*', 3),
+        ('via^m', 'd2^*', 2),
+        ('via^n', 'd1^*', 1),
+    ]
+
+
 def test_results_graph_samples():
     view_graph = _threenode_viewgraph()
 
@@ -404,3 +483,196 @@ def _threenode_viewgraph():
         [['b', 'c']],
     ])
     return view_graph
+
+
+def test_chunked_results_matches_results_graph():
+    view_graph = _twonode_viewgraph()
+
+    flows = pd.DataFrame.from_records([
+        ('a', 'b1', 'm', 4, 2),
+        ('a', 'b2', 'm', 7, 1),
+        ('a', 'b1', 'n', 1, 6),
+    ],
+                                      columns=('source', 'target', 'material',
+                                               'value', 'another_measure'))
+    agg_measures = {'another_measure': 'mean'}
+    expected = results_graph(view_graph, {0: flows},
+                             agg_measures=agg_measures)
+
+    results = ChunkedResults(view_graph, agg_measures=agg_measures)
+    results.add({0: flows.iloc[:2]})
+    results.add({0: flows.iloc[2:]})
+    Gr, groups = results.results()
+    assert Gr.edges(keys=True, data=True) == \
+        expected[0].edges(keys=True, data=True)
+    assert groups == expected[1]
+
+
+def test_chunked_results_needs_partial_aggregates():
+    view_graph = _twonode_viewgraph()
+    with pytest.raises(ValueError):
+        ChunkedResults(view_graph, agg_measures={'another_measure': 'median'})
+    with pytest.raises(ValueError):
+        ChunkedResults(view_graph, measure=lambda group: {})
+
+
+def _partitioned_viewgraph():
+    view_graph = LayeredGraph()
+    view_graph.add_node('a', node=ProcessGroup())
+    view_graph.add_node('b', node=ProcessGroup(
+        partition=Partition.Simple('process', ['b1', 'b2'])))
+    view_graph.add_edge('a', 'b', {'bundles': [0]})
+    view_graph.ordering = Ordering([[['a']], [['b']]])
+    return view_graph
+
+
+def test_results_table():
+    view_graph = _partitioned_viewgraph()
+    flows = pd.DataFrame.from_records([
+        ('a', 'b1', 'm', 4, 2),
+        ('a', 'b1', 'n', 1, 6),
+    ],
+                                      columns=('source', 'target', 'material',
+                                               'value', 'another_measure'))
+    flow_partition = Partition.Simple('material', ['m', 'n'])
+    results = results_table(view_graph, {0: flows},
+                            flow_partition=flow_partition,
+                            agg_measures={'another_measure': 'max'})
+
+    # The unused node b^b2 is dropped
+    assert list(results.node_table.index) == ['a^*', 'b^b1']
+    assert list(results.node_table['title']) == ['a', 'b1']
+    links = results.link_table
+    assert list(links['source']) == [0, 0]
+    assert list(links['target']) == [1, 1]
+    assert list(links['material']) == ['m', 'n']
+    assert list(links['time']) == ['*', '*']
+    assert list(links['value']) == [4, 1]
+    assert list(links['bundles']) == [[0], [0]]
+    assert list(results.measures['another_measure']) == [2, 6]
+    assert results.ordering == Ordering([[['a^*']], [['b^b1']]])
+    assert [g['nodes'] for g in results.groups] == [['a^*'], ['b^b1']]
+
+    # Same as the graph
+    Gr, groups = results_graph(view_graph, {0: flows},
+                               flow_partition=flow_partition,
+                               agg_measures={'another_measure': 'max'})
+    for G in (results, results.to_graph()):
+        assert G.nodes(data=True) == Gr.nodes(data=True)
+        assert G.edges(keys=True, data=True) == \
+            Gr.edges(keys=True, data=True)
+    assert results.to_graph().ordering == Gr.ordering
+    assert results.groups == groups
+
+
+def test_results_table_callable_measure():
+    view_graph = _partitioned_viewgraph()
+    flows = pd.DataFrame.from_records([('a', 'b1', 'm', 4)],
+                                      columns=('source', 'target', 'material',
+                                               'value'))
+    results = results_table(view_graph, {0: flows},
+                            measure=lambda group: {'value': group.value.values,
+                                                   'n': len(group)})
+    assert list(results.node_table.index) == ['a^*', 'b^b1']
+    assert list(results.link_table['value'][0]) == [4]
+    [(v, w, k, data)] = results.edges(keys=True, data=True)
+    assert (v, w, k) == ('a^*', 'b^b1', ('*', '*'))
+    assert data['n'] == 1
+    assert data['bundles'] == [0]
+
+
+def test_results_table_links_sorted_by_label():
+    view_graph = _partitioned_viewgraph()
+    flows = pd.DataFrame.from_records([
+        ('a', 'b1', 'n', 1),
+        ('a', 'b1', 'x', 2),
+        ('a', 'b1', 'm', 4),
+    ],
+                                      columns=('source', 'target', 'material',
+                                               'value'))
+
+    # Not in the order of the partition groups
+    flow_partition = Partition.Simple('material', ['n', 'm'])
+    results = results_table(view_graph, {0: flows},
+                            flow_partition=flow_partition)
+    assert list(results.link_table['material']) == ['_', 'm', 'n']
+    assert list(results.link_table['value']) == [2, 4, 1]
+
+    results = results_table(view_graph, {0: flows},
+                            flow_partition=flow_partition,
+                            measure=lambda group: {'value': group.value.sum()})
+    assert list(results.link_table['material']) == ['_', 'm', 'n']
+    assert list(results.link_table['value']) == [2, 4, 1]
+
+
+def test_results_time_matrix():
+    view_graph = _partitioned_viewgraph()
+    flows = pd.DataFrame.from_records([
+        ('a', 'b1', 'm', 2, 3, 1),
+        ('a', 'b1', 'm', 1, 1, 1),
+        ('a', 'b2', 'n', 2, 2, 1),
+        ('a', 'b2', 'n', 3, 5, 1),
+        ('a', 'b1', 'n', 1, 4, 1),
+    ],
+                                      columns=('source', 'target', 'material',
+                                               'time', 'value', 'count'))
+    results = results_table(view_graph, {0: flows},
+                            flow_partition=Partition.Simple('material',
+                                                            ['m', 'n']),
+                            time_partition=Partition.Simple('time', [2, 1]),
+                            agg_measures={'count': 'sum'})
+
+    links, times, matrix = results.time_matrix()
+    assert list(times) == ['2', '1', '_']
+    nodes = results.node_table.index
+    assert [(nodes[v], nodes[w], m) for v, w, m in links.values] == [
+        ('a^*', 'b^b1', 'm'),
+        ('a^*', 'b^b1', 'n'),
+        ('a^*', 'b^b2', 'n'),
+    ]
+    assert matrix.tolist() == [
+        [3, 1, 0],
+        [0, 4, 0],
+        [2, 0, 5],
+    ]
+
+    links, times, matrix = results.time_matrix('count', fill_value=np.nan)
+    assert np.isnan(matrix[1, 0])
+    assert matrix[2, 2] == 1
+
+
+def test_results_table_samples():
+    view_graph = _partitioned_viewgraph()
+    flows = pd.DataFrame.from_records([
+        ('a', 'b1', 'm', 4),
+        ('a', 'b2', 'm', 7),
+        ('a', 'b1', 'n', 1),
+    ],
+                                      columns=('source', 'target', 'material',
+                                               'value'),
+                                      index=[2, 0, 1])
+    samples = {'value_samples': np.array([[1., 2.], [3., 4.], [5., 9.]])}
+    results = results_table(view_graph, {0: flows},
+                            measure='value_samples',
+                            agg_measures={'value': 'sum',
+                                          'value_samples': 'sum'},
+                            samples=samples)
+    assert results.value_samples.tolist() == [[8, 13], [1, 2]]
+    assert results.samples['value_samples'].tolist() == [[8, 13], [1, 2]]
+    assert list(results.link_table['value']) == [10.5, 1.5]
+    assert list(results.measures['value']) == [5, 7]
+
+    [(_, _, d1), (_, _, d2)] = results.edges(data=True)
+    assert d1['value'].tolist() == [8, 13]
+    assert d1['measures']['value'] == 5
+
+    results = results_table(view_graph, {0: flows},
+                            agg_measures={'value_samples': 'mean'},
+                            samples=samples)
+    assert list(results.link_table['value']) == [5, 7]
+    assert results.samples['value_samples'].tolist() == [[4, 6.5], [1, 2]]
+
+    with pytest.raises(ValueError):
+        results_table(view_graph, {0: flows},
+                      agg_measures={'value_samples': 'median'},
+                      samples=samples)
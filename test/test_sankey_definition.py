@@ -2,6 +2,7 @@ import pytest
 
 from sankeyview.sankey_definition import SankeyDefinition, Waypoint, ProcessGroup, Bundle
 from sankeyview.ordering import Ordering
+from sankeyview.partition import Partition
 
 
 def test_sankey_definition():
@@ -55,3 +56,22 @@ def test_sankey_definition_checks_nodes_exist():
     with pytest.raises(ValueError):
         bundles = [Bundle('a', 'b', waypoints=['does not exist'])]
         SankeyDefinition(nodes, bundles, ordering)
+
+
+def test_sankey_definition_referenced_columns():
+    nodes = {
+        'a': ProcessGroup(selection=['a1']),
+        'b': ProcessGroup(selection='function == "b"',
+                          partition=Partition.Simple('process.region', ['x'])),
+        'w': Waypoint(partition=Partition.Simple('material.type', ['t'])),
+    }
+    bundles = [Bundle('a', 'b', waypoints=['w'],
+                      flow_selection='time.year > 2000')]
+    ordering = [['a'], ['w'], ['b']]
+    sdd = SankeyDefinition(nodes, bundles, ordering,
+                           flow_partition=Partition.Simple('material', ['m']))
+    assert sdd.referenced_columns() == {
+        'source', 'target', 'source.function', 'target.function',
+        'source.region', 'target.region', 'material.type', 'time.year',
+        'material',
+    }
@@ -1,9 +1,11 @@
+import numpy as np
 import pandas as pd
 
 from sankeyview.sankey_definition import SankeyDefinition, Ordering, ProcessGroup, Waypoint, Bundle
 from sankeyview.sankey_view import sankey_view
 from sankeyview.partition import Partition
 from sankeyview.dataset import Dataset
+from sankeyview.graph_to_sankey import graph_to_sankey
 
 
 def test_sankey_view_accepts_dataframe_as_dataset():
@@ -158,3 +160,156 @@ def test_sankey_view_results_time_partition():
                                     'bundles': [0]}),
     ]
     assert GR.ordering == Ordering([[['a^*']], [['b^*']]])
+
+
+def test_sankey_view_chunked_csv(tmpdir):
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'b': ProcessGroup(selection=['b1']),
+        'c': ProcessGroup(selection=['c1', 'c2'],
+                          partition=Partition.Simple('process', ['c1', 'c2'])),
+        'via': Waypoint(partition=Partition.Simple('material', ['m', 'n'])),
+    }
+    bundles = [
+        Bundle('a', 'c', waypoints=['via']),
+        Bundle('b', 'c', waypoints=['via']),
+    ]
+    ordering = [[['a', 'b']], [['via']], [['c']]]
+    vd = SankeyDefinition(nodes, bundles, ordering, flow_selection='value > 0')
+
+    flows = pd.DataFrame.from_records(
+        [
+            ('a1', 'c1', 'm', 3),
+            ('a2', 'c1', 'n', 1),
+            ('b1', 'c1', 'm', 1),
+            ('a1', 'c1', 'm', 0),
+            ('b1', 'c2', 'm', 2),
+            ('b1', 'c2', 'n', 1),
+            ('a2', 'c1', 'n', 5),
+        ],
+        columns=('source', 'target', 'material', 'value'))
+    filename = str(tmpdir.join('flows.csv'))
+    flows.to_csv(filename, index=False)
+
+    expected = sankey_view(vd, Dataset(flows),
+                           agg_measures={'material': 'count'})
+    for chunksize in (1, 3, 100):
+        dataset = Dataset.from_csv(filename, chunksize=chunksize)
+        GR, groups = sankey_view(vd, dataset, agg_measures={'material': 'count'})
+        assert GR.edges(keys=True, data=True) == \
+            expected[0].edges(keys=True, data=True)
+        assert GR.nodes(data=True) == expected[0].nodes(data=True)
+        assert GR.ordering == expected[0].ordering
+        assert groups == expected[1]
+
+
+def test_sankey_view_processes():
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'c': ProcessGroup(selection=['c1', 'c2'],
+                          partition=Partition.Simple('process', ['c1', 'c2'])),
+        'via': Waypoint(partition=Partition.Simple('material', ['m', 'n'])),
+    }
+    bundles = [Bundle('a', 'c', waypoints=['via'])]
+    ordering = [[['a']], [['via']], [['c']]]
+    vd = SankeyDefinition(nodes, bundles, ordering, flow_selection='value > 0')
+
+    flows = pd.DataFrame.from_records(
+        [('a1', 'c1', 'm', 3), ('a2', 'c1', 'n', 1), ('a1', 'x', 'm', 1),
+         ('a1', 'c1', 'm', 0), ('a1', 'c2', 'm', 2), ('x', 'c2', 'n', 1),
+         ('a2', 'c1', 'n', 5)] * 3,
+        columns=('source', 'target', 'material', 'value'))
+    dataset = Dataset(flows)
+
+    agg_measures = {'material': 'count', 'value': 'max'}
+    expected = sankey_view(vd, dataset, agg_measures=agg_measures)
+    for processes in (1, 2):
+        GR, groups = sankey_view(vd, dataset, agg_measures=agg_measures,
+                                 processes=processes)
+        assert GR.edges(keys=True, data=True) == \
+            expected[0].edges(keys=True, data=True)
+        assert GR.nodes(data=True) == expected[0].nodes(data=True)
+        assert GR.ordering == expected[0].ordering
+        assert groups == expected[1]
+
+
+def test_sankey_view_processes_falls_back_to_serial():
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'b': ProcessGroup(selection=['b1']),
+    }
+    sdd = SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']])
+    flows = pd.DataFrame.from_records(
+        [('a1', 'b1', 'm', 1, 3, 2.), ('a2', 'b1', 'n', 2, 1, 4.),
+         ('a1', 'b1', 'n', 3, 2, 1.)],
+        columns=('source', 'target', 'material', 'time', 'value', 'w'))
+    dataset = Dataset(flows)
+
+    for kwargs in [dict(agg_measures={'w': 'weighted_mean'}),
+                   dict(agg_measures={'w': 'last', 'time': 'median'}),
+                   dict(measure=lambda group: {'value': len(group)})]:
+        expected = sankey_view(sdd, dataset, **kwargs)
+        GR, groups = sankey_view(sdd, dataset, processes=2, **kwargs)
+        assert GR.edges(keys=True, data=True) == \
+            expected[0].edges(keys=True, data=True)
+        assert groups == expected[1]
+
+
+def test_sankey_view_results_table():
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'b': ProcessGroup(selection=['b1', 'b2'],
+                          partition=Partition.Simple('process', ['b1', 'b2'])),
+    }
+    sdd = SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']])
+    flows = pd.DataFrame.from_records(
+        [('a1', 'b1', 'm', 3), ('a2', 'b1', 'n', 1), ('a1', 'b2', 'm', 2)],
+        columns=('source', 'target', 'material', 'value'))
+
+    GR, groups = sankey_view(sdd, flows)
+    results = sankey_view(sdd, flows, as_graph=False)
+    assert results.groups == groups
+    assert graph_to_sankey(results, results.groups) == \
+        graph_to_sankey(GR, groups)
+
+
+def test_sankey_view_samples():
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'b': ProcessGroup(selection=['b1']),
+    }
+    sdd = SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']])
+    flows = pd.DataFrame.from_records(
+        [('a1', 'b1', 'm', 3), ('a2', 'b1', 'n', 1), ('a2', 'c', 'n', 1)],
+        columns=('source', 'target', 'material', 'value'))
+    samples = np.array([[2., 4.], [0., 2.], [7., 7.]])
+    dataset = Dataset(flows, samples={'value_samples': samples})
+
+    GR, groups = sankey_view(sdd, dataset, measure='value_samples')
+    data = GR['a^*']['b^*'][('*', '*')]
+    assert data['value'].tolist() == [2, 6]
+    links = graph_to_sankey(GR, groups, sample='mean')['links']
+    assert [link['value'] for link in links
+            if (link['source'], link['target']) == ('a^*', 'b^*')] == [4]
+
+
+def test_sankey_view_samples_with_processes():
+    nodes = {
+        'a': ProcessGroup(selection=['a1', 'a2']),
+        'b': ProcessGroup(selection=['b1']),
+    }
+    sdd = SankeyDefinition(nodes, [Bundle('a', 'b')], [['a'], ['b']])
+    flows = pd.DataFrame.from_records(
+        [('a1', 'b1', 'm', 3), ('a2', 'b1', 'n', 1), ('a2', 'c', 'n', 1)],
+        columns=('source', 'target', 'material', 'value'))
+    samples = np.array([[2., 4.], [0., 2.], [7., 7.]])
+    dataset = Dataset(flows, samples={'ens': samples})
+
+    GR, groups = sankey_view(sdd, dataset, measure='ens', processes=2)
+    assert GR['a^*']['b^*'][('*', '*')]['value'].tolist() == [2, 6]
+
+    GR, groups = sankey_view(sdd, dataset, agg_measures={'ens': 'mean'},
+                             processes=2)
+    data = GR['a^*']['b^*'][('*', '*')]
+    assert data['value'] == 4
+    assert data['measures']['ens'].tolist() == [1, 3]
@@ -0,0 +1,77 @@
+import pytest
+
+import pandas as pd
+
+from sankeyview.selection import Selection, compile_selection
+
+
+def _table():
+    return pd.DataFrame({
+        'source': ['a1', 'a2', 'b', 'b'],
+        'target': ['b', 'b', 'c', 'c'],
+        'source.function': ['a', 'a', 'b', 'b'],
+        'value': [3, 4, 3, 4],
+    })
+
+
+def test_selection_matches_pandas_eval_syntax():
+    df = _table()
+
+    def check(expression, column, expected):
+        assert list(Selection(expression, column)(df)) == expected
+
+    check('function == "a"', 'source', [True, True, False, False])
+    check('function != "a"', 'source', [False, False, True, True])
+    check('id in ["a1", "b"]', 'source', [True, False, True, True])
+    check('id not in ["a1", "b"]', 'source', [False, True, False, False])
+    check('id == ["a1", "a2"]', 'source', [True, True, False, False])
+    check('function == "a" and id in ["a1"]', 'source',
+          [True, False, False, False])
+    check('(value > 3) | (target == "b")', '', [True, True, False, True])
+    check('value > 3 | target == "b"', '', [True, True, False, True])
+    check('function == "a" & id != "a2"', 'source',
+          [True, False, False, False])
+    check('value > 1 & value < 4', '', [True, False, True, False])
+    check('not (value >= 4)', '', [True, False, True, False])
+    check('2 < value * 2 <= 6', '', [True, False, True, False])
+    check('source.function == "b"', '', [False, False, True, True])
+    check('True', '', [True, True, True, True])
+
+
+def test_selection_records_columns_used():
+    s = Selection('function == "a" and id in ["a1"]', 'source')
+    assert s.columns == {'source', 'source.function'}
+
+
+def test_selection_rejects_unsupported_expressions():
+    with pytest.raises(ValueError):
+        Selection('value ==', '')
+
+
+def test_selection_falls_back_to_pandas_eval():
+    df = _table()
+    df['value'] = [-2, 1, 1.5, None]
+
+    def check(expression, column, expected):
+        assert list(df.eval(expression)) == expected
+        assert list(Selection(expression, column)(df)) == expected
+
+    check('abs(value) > 1', '', [True, False, True, False])
+    check('value.isnull()', '', [False, False, False, True])
+    check('value.between(1, 2) & (target == "b")', '',
+          [False, True, False, False])
+
+    s = Selection('function.isin(["a"]) & (id != "a2")', 'source')
+    assert s.columns == {'source', 'source.function'}
+    assert list(s(df)) == [True, False, False, False]
+
+
+def test_compiled_selections_are_cached():
+    cache = {}
+    s1 = compile_selection('function == "a"', 'source', cache)
+    s2 = compile_selection('function == "a"', 'source', cache)
+    s3 = compile_selection('function == "a"', 'target', cache)
+    assert s1 is s2
+    assert s1 is not s3
+    assert set(cache) == {('function == "a"', 'source'),
+                          ('function == "a"', 'target')}